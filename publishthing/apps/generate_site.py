@@ -39,6 +39,12 @@ def main(argv: Optional[List[str]] = None) -> None:
         type=str,
         help="Branch name to check out on, by default no checkout occurs",
     )
+    parser.add_argument(
+        "--reference",
+        type=str,
+        help="Local repository, e.g. the source's mirror, for the work "
+        "checkout to borrow objects from rather than copy them",
+    )
     parser.add_argument("source", type=str, help="Source repository path")
     parser.add_argument("destination", choices=["local"], help="Destination")
     args = parser.parse_args(argv)
@@ -58,7 +64,14 @@ def main(argv: Optional[List[str]] = None) -> None:
     # make "work" sibling path to where the git repo is
     work_dir: str = os.path.join(os.path.dirname(repo_path), "work")
     with thing.shell_in(work_dir, create=True) as shell:
-        git_repo = shell.git_repo(sitename, origin=repo_path, create=True)
+        git_repo = shell.git_repo(
+            sitename,
+            origin=repo_path,
+            create=True,
+            reference=(
+                os.path.abspath(args.reference) if args.reference else None
+            ),
+        )
         if args.branch:
             git_repo.checkout(args.branch)
         else:
@@ -36,6 +36,11 @@ Then create a symlink named after the gerrit hook, in
 
     # ln -s myconfig.py /var/gerrit/hooks/patchset-created
 
+Alternatively, run the configuration as a daemon with
+``thing.gerrit_hook.serve()`` in place of ``main()``, and link the hook
+to ``publishthing/gerritforward.py`` instead; each hook then only hands
+its arguments to the already-running process.
+
 A new gerrit review to ``orgname/projectname`` that mentions an issue
 will post to the Github repository ``orgname/projectname``, to that issue
 number.
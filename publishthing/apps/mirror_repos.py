@@ -36,6 +36,12 @@ using ``git clone --mirror``.  The "origin" should be where we get the
 push from.  push_to is then a list of remotes to push to.  These remotes
 have to also be in the local mirror checkout using "git remote add".
 
+A mirror can also serve as the ``reference`` of other clones, such as
+the prtogerrit work checkouts (see the ``prtogerrit_git_references``
+option), which then borrow its objects rather than store their own.
+Such a clone sets ``gc.pruneExpire=never`` on the mirror, as objects the
+mirror drops after a force push may still be needed by the clones.
+
 """
 
 import os
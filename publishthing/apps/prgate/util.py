@@ -150,7 +150,9 @@ def find_issue_references(
 
 
 def user_has_write_permission(
-    gh_repo: github.GithubRepo, username: str
+    gh_repo: github.GithubRepo,
+    username: str,
+    prefetched: Optional[github.PrefetchedRecords] = None,
 ) -> bool:
     """True if the user can push to the repo.
 
@@ -160,7 +162,10 @@ def user_has_write_permission(
 
     """
 
-    permission = gh_repo.get_user_permission(username)
+    if prefetched is not None and username in prefetched.permissions:
+        permission = prefetched.permissions[username]
+    else:
+        permission = gh_repo.get_user_permission(username)
     return bool(
         permission and permission.get("permission") in ("admin", "write")
     )
@@ -207,10 +212,22 @@ def evaluate_pr(
     if approved_label.lower() in {name.lower() for name in pr_labels or ()}:
         return GateResult("allow", ALLOW_APPROVED, None)
 
-    if exempt_maintainers and user_has_write_permission(gh_repo, sender):
+    references = find_issue_references(title, body, repo)
+
+    # one round trip for the sender's permission and every referenced
+    # issue, rather than one each; the lookups below are then answered
+    # from what this loaded, which is only good for this one evaluation.
+    prefetched = github.PrefetchedRecords({}, {})
+    if len(references) + (1 if exempt_maintainers else 0) > 1:
+        prefetched = gh_repo.prefetch_issues(
+            references, sender if exempt_maintainers else None
+        )
+
+    if exempt_maintainers and user_has_write_permission(
+        gh_repo, sender, prefetched
+    ):
         return GateResult("allow", ALLOW_MAINTAINER, None)
 
-    references = find_issue_references(title, body, repo)
     if not references:
         return GateResult("close", CLOSE_NO_ISSUE, None)
 
@@ -220,7 +237,10 @@ def evaluate_pr(
     best: Optional[GateResult] = None
 
     for number in references:
-        issue = gh_repo.get_issue(str(number))
+        if str(number) in prefetched.issues:
+            issue = prefetched.issues[str(number)]
+        else:
+            issue = gh_repo.get_issue(str(number))
 
         # a number that resolves to nothing, or to a pull request rather
         # than an issue, tells us nothing either way; keep looking.
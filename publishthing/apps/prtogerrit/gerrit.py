@@ -1,8 +1,10 @@
+import functools
 from typing import Any
 
 from . import util
 from ... import gerrit
 from ... import publishthing
+from ...util import run_concurrently
 
 
 def gerrit_hook(thing: publishthing.PublishThing) -> None:
@@ -25,68 +27,16 @@ def gerrit_hook(thing: publishthing.PublishThing) -> None:
 
         detail = thing.gerrit_api.get_change_detail(opts.change)
 
-        verified = detail["labels"]["Verified"]
-        verified_approved = "approved" in verified
-        verified_rejected = "rejected" in verified
-        verified_neutral = not verified_approved and not verified_rejected
-
-        codereview = detail["labels"]["Code-Review"]
-        codereview_approved = "approved" in codereview
-        codereview_rejected = (
-            "disliked" in codereview or "rejected" in codereview
-        )
-        codereview_neutral = (
-            not codereview_approved and not codereview_rejected
-        )
-
         gh_repo = thing.github_repo(opts.project)
 
-        for send, context, state, message in [
-            (
-                verified_approved,
-                "ci_verification",
-                "success",
-                "Gerrit review has been verified",
-            ),
-            (
-                verified_rejected,
-                "ci_verification",
-                "failure",
-                "Gerrit review has failed verification",
-            ),
-            (
-                verified_neutral,
-                "ci_verification",
-                "pending",
-                "Needs CI verified status",
-            ),
-            (
-                codereview_approved,
-                "code_review",
-                "success",
-                "Received code review +2",
-            ),
-            (
-                codereview_rejected,
-                "code_review",
-                "failure",
-                "Code review has been rejected",
-            ),
-            (
-                codereview_neutral,
-                "code_review",
-                "pending",
-                "Needs code review +2",
-            ),
-        ]:
-            if send:
-                gh_repo.create_status(
-                    pull_request_match.sha,
-                    description=message,
-                    state=state,
-                    context=context,
-                    target_url=opts.change_url,
-                )
+        for status in util.gerrit_label_statuses(detail["labels"]):
+            gh_repo.create_status(
+                pull_request_match.sha,
+                description=status.description,
+                state=status.state,
+                context=status.context,
+                target_url=opts.change_url,
+            )
 
     @thing.gerrit_hook.event("change-merged")  # type: ignore
     @thing.gerrit_hook.event("change-abandoned")  # type: ignore
@@ -181,8 +131,16 @@ def gerrit_hook(thing: publishthing.PublishThing) -> None:
         hook_comment = opts.comment
         hook_user = opts.author_username
 
-        # index the comments for the gerrit
-        gerrit_comments = util.GerritComments(thing.gerrit_api, change)
+        # index the comments for the gerrit, and the comments on the PR.
+        # all of it is needed unless the gerrit comment can't be found,
+        # which is rare, so it's fetched together up front rather than one
+        # request after another
+        gh_repo = thing.github_repo(opts.project)
+        pullreq = util.GithubPullRequest(gh_repo, pull_request_match.number)
+        gerrit_comments, _ = run_concurrently(
+            functools.partial(util.GerritComments, thing.gerrit_api, change),
+            pullreq.prefetch,
+        )
 
         # the commandline hook gives us no identifier or timestamp so we just
         # search by text and username, getting most recent comment first.
@@ -201,10 +159,6 @@ def gerrit_hook(thing: publishthing.PublishThing) -> None:
             )
             return
 
-        # index the comments on the PR
-        gh_repo = thing.github_repo(opts.project)
-        pullreq = util.GithubPullRequest(gh_repo, pull_request_match.number)
-
         outgoing_inline_comments = []
         outgoing_inline_replies = []
         outgoing_external_line_comments = []
@@ -3,11 +3,13 @@ from typing import Dict
 from typing import List
 from typing import Union
 
+from . import index
 from . import util
 from ... import github
 from ... import publishthing
 from ... import shell as _shell
 from ... import wsgi
+from ...git import GitError
 
 
 def github_hook(
@@ -64,39 +66,57 @@ def github_hook(
 
         with thing.shell_in(workdir).shell_in(owner, create=True) as shell:
 
+            # prtogerrit_git_filter="blob:none" keeps the clone, and what's
+            # fetched into it, to what an import needs.
+            # prtogerrit_git_shallow_since makes a new clone shallow; the
+            # shallow boundary stays put from then on, other than being
+            # pushed back for a PR that branched off before it.
+            # prtogerrit_git_references maps "owner/project" to a local
+            # mirror, e.g. one kept by mirror_repos, to borrow objects from
             git = shell.git_repo(
-                project, origin=pr["base"]["repo"]["ssh_url"], create=True
+                project,
+                origin=pr["base"]["repo"]["ssh_url"],
+                create=True,
+                filter_=thing.opts.get("prtogerrit_git_filter"),
+                shallow_since=thing.opts.get("prtogerrit_git_shallow_since"),
+                reference=thing.opts.get("prtogerrit_git_references", {}).get(
+                    event.repo_name
+                ),
             )
 
             target_branch = pr["base"]["ref"]
+            base = "origin/%s" % (target_branch,)
 
-            git.fetch(all_=True)
-
-            # checkout the base branch as detached, usually main
-            git.checkout("origin/%s" % (target_branch,), detached=True)
-
-            # sets everything up for gerrit
-            git.enable_gerrit(
-                wait_for_reviewer,
-                git_email,
-                shell.thing.opts["gerrit_api_username"],
-                shell.thing.opts["gerrit_api_password"],
+            # the base branch and the PR, rather than every branch of every
+            # remote
+            pull_ref = "refs/publishthing/pull/%s" % (
+                event.json_data["number"],
             )
+            # other imports for the project fetch the same base branch, and
+            # may move the shallow boundary; they wait for each other
+            with git.fetch_lock():
+                git.fetch_branch(target_branch)
+                git.fetch_pull_request(event.json_data["number"], pull_ref)
+
+                # a shallow clone might not reach back to where the PR
+                # branched off, which would look like unrelated histories to
+                # the squash; not a conflict, so not reported as one
+                git.deepen_to_merge_base(
+                    base,
+                    pull_ref,
+                    refspecs=[
+                        git.branch_refspec(target_branch),
+                        git.pull_request_refspec(
+                            event.json_data["number"], pull_ref
+                        ),
+                    ],
+                )
 
-            # name the new branch against the PR
-            git.create_branch(
-                "pr_github_%s" % event.json_data["number"], force=True
-            )
+                # what the base branch is now; another import may move it
+                # once the lock is let go
+                base = git.rev_parse(base)
 
-            # pull remote PR into the local repo
-            try:
-                git.pull(
-                    pr["head"]["repo"]["clone_url"],
-                    pr["head"]["ref"],
-                    squash=True,
-                )
-            except _shell.CalledProcessError:
-                git.reset(hard=True)
+            def squash_failed() -> None:
                 gh_repo.publish_pr_comment_w_status_change(
                     event.json_data["number"],
                     pr["head"]["sha"],
@@ -105,10 +125,6 @@ def github_hook(
                     state="error",
                     context="gerrit_review",
                 )
-                raise
-
-            # get the author from the squash so we can maintain it
-            author = git.read_author_from_squash_pull()
 
             pull_request_badge = "Pull-request: %s" % pr["html_url"]
 
@@ -124,30 +140,91 @@ def github_hook(
                 )
             )
 
-            results = thing.gerrit_api.search(
-                status="open", message=pull_request_badge
+            existing_gerrit = util.find_gerrit_change(
+                thing,
+                event.repo_name,
+                event.json_data["number"],
+                pr["html_url"],
+                open_only=True,
+            )
+
+            # without an existing change, gerrit commit will make sure the
+            # change-id is written without relying on a git commit hook
+            is_new_gerrit = existing_gerrit is None
+            change_id = existing_gerrit.change_id if existing_gerrit else None
+
+            # sets everything up for gerrit
+            git.enable_gerrit(
+                wait_for_reviewer,
+                git_email,
+                shell.thing.opts["gerrit_api_username"],
+                shell.thing.opts["gerrit_api_password"],
+                rev=base,
             )
-            if results:
-                # there should be only one, but in any case use the
-                # most recent, which is first in the list
-                existing_gerrit = results[0]
-            else:
-                existing_gerrit = None
 
-            if existing_gerrit:
-                is_new_gerrit = False
-                git.gerrit.commit(
+            if git.can_merge_tree:
+                # squash the PR onto the base branch in the object database
+                # only.  nothing is checked out, so this doesn't wait on
+                # the working tree of a large repo, and imports for the
+                # same project don't get in each other's way
+                try:
+                    tree = git.merge_tree(base, pull_ref)
+                except GitError:
+                    squash_failed()
+                    raise
+
+                # the author of the PR's last commit, as the squash
+                # would have it
+                revision, change_id = git.gerrit.commit_tree(
+                    tree,
+                    base,
                     commit_msg,
-                    author=author,
-                    change_id=existing_gerrit["change_id"],
+                    author=git.read_author(pull_ref),
+                    change_id=change_id,
                 )
             else:
-                # gerrit commit will make sure the change-id is written
-                # without relying on a git commit hook
-                is_new_gerrit = True
-                git.gerrit.commit(commit_msg, author=author)
+                # git older than 2.38 can only merge in a checkout.  take
+                # one from the pool, with the base branch checked out
+                # detached, so other imports for the project can go on
+                # at the same time; the commit stays in the shared
+                # object store once the worktree is returned
+                with git.worktrees.checkout(base) as worktree:
+                    worktree.enable_gerrit(
+                        wait_for_reviewer,
+                        git_email,
+                        shell.thing.opts["gerrit_api_username"],
+                        shell.thing.opts["gerrit_api_password"],
+                    )
 
-            gerrit_link = git.gerrit.review()
+                    # squash the PR into the worktree.  on failure, the
+                    # pool resets it
+                    try:
+                        worktree.merge(pull_ref, squash=True)
+                    except _shell.CalledProcessError:
+                        squash_failed()
+                        raise
+
+                    # get the author from the squash so we can maintain it
+                    change_id = worktree.gerrit.commit(
+                        commit_msg,
+                        author=worktree.read_author_from_squash_pull(),
+                        change_id=change_id,
+                        parent=base,
+                    )
+                    revision = worktree.rev_parse("HEAD")
+
+            gerrit_link = git.gerrit.review(revision)
+
+            pr_index = index.index_for(thing)
+            if pr_index is not None:
+                pr_index.record(
+                    event.repo_name,
+                    event.json_data["number"],
+                    git.gerrit.change_triplet(change_id),
+                    change_id,
+                    revision=revision,
+                    pullreq_sha=pr["head"]["sha"],
+                )
 
             gh_repo.publish_pr_comment_w_status_change(
                 event.json_data["number"],
@@ -209,16 +286,10 @@ def github_hook(
             )
             return
 
-        # search in gerrit reviews for this pull request URL
-        # in commit comments
-        pull_request_badge = "Pull-request: %s" % pr["html_url"]
-        results = thing.gerrit_api.search(message=pull_request_badge)
-
-        if results:
-            # there should be only one, but in any case use the
-            # most recent, which is first in the list
-            existing_gerrit = results[0]
-        else:
+        existing_gerrit = util.find_gerrit_change(
+            thing, event.repo_name, pr["number"], pr["html_url"]
+        )
+        if existing_gerrit is None:
             thing.debug(
                 "prtogerrit",
                 "Can't find a gerrit review for pull request: %s",
@@ -242,28 +313,40 @@ def github_hook(
         # could be ahead of the review if new patches were submitted
         # directly to gerrit, in which case the comments go to an older
         # rev in the gerrit.
-        all_revisions = thing.gerrit_api.get_change_all_revisions(
-            existing_gerrit["id"]
-        )
-
-        for gerrit_revision_sha, gerrit_revision in all_revisions[
-            "revisions"
-        ].items():
-            pullreq_match = util.get_pullreq_for_gerrit_commit_message(
-                event.repo_name, gerrit_revision["commit"]["message"]
+        pr_index = index.index_for(thing)
+        if pr_index is not None:
+            indexed_revision_sha = pr_index.revision_for(
+                event.repo_name, pr["number"], review_commit_id
             )
-            if pullreq_match and pullreq_match.sha == review_commit_id:
-                break
         else:
-            thing.debug(
-                "prtogerrit",
-                "Can't find commit %s in Gerrit pull request messages "
-                "while trying to mirror a github comment, pull request %s",
-                review_commit_id,
-                pr["html_url"],
+            indexed_revision_sha = None
+
+        if indexed_revision_sha is not None:
+            gerrit_revision_sha = indexed_revision_sha
+        else:
+            all_revisions = thing.gerrit_api.get_change_all_revisions(
+                existing_gerrit.change
             )
-            # use the latest revision
-            gerrit_revision_sha = all_revisions["current_revision"]
+
+            for gerrit_revision_sha, gerrit_revision in all_revisions[
+                "revisions"
+            ].items():
+                pullreq_match = util.get_pullreq_for_gerrit_commit_message(
+                    event.repo_name, gerrit_revision["commit"]["message"]
+                )
+                if pullreq_match and pullreq_match.sha == review_commit_id:
+                    break
+            else:
+                thing.debug(
+                    "prtogerrit",
+                    "Can't find commit %s in Gerrit pull request messages "
+                    "while trying to mirror a github comment, "
+                    "pull request %s",
+                    review_commit_id,
+                    pr["html_url"],
+                )
+                # use the latest revision
+                gerrit_revision_sha = all_revisions["current_revision"]
 
         pullreq_index = util.GithubPullRequest(
             gh_repo, pr["number"], existing_pullreq=pr
@@ -311,7 +394,7 @@ def github_hook(
         review = {"message": message, "comments": inline_comments}
 
         thing.gerrit_api.set_review(
-            existing_gerrit["id"], gerrit_revision_sha, review
+            existing_gerrit.change, gerrit_revision_sha, review
         )
 
     @thing.github_webhook.event(
@@ -342,16 +425,10 @@ def github_hook(
             )
             return
 
-        # search in gerrit reviews for this pull request URL
-        # in commit comments
-        pull_request_badge = "Pull-request: %s" % pr["html_url"]
-        results = thing.gerrit_api.search(message=pull_request_badge)
-
-        if results:
-            # there should be only one, but in any case use the
-            # most recent, which is first in the list
-            existing_gerrit = results[0]
-        else:
+        existing_gerrit = util.find_gerrit_change(
+            thing, event.repo_name, issue["number"], pr["html_url"]
+        )
+        if existing_gerrit is None:
             thing.debug(
                 "prtogerrit",
                 "Can't find a gerrit review for pull request: %s",
@@ -360,7 +437,7 @@ def github_hook(
             return
 
         gerrit_revision = thing.gerrit_api.get_change_current_revision(
-            existing_gerrit["id"]
+            existing_gerrit.change
         )
 
         gerrit_revision_sha = gerrit_revision["current_revision"]
@@ -371,5 +448,5 @@ def github_hook(
         review = {"message": message}
 
         thing.gerrit_api.set_review(
-            existing_gerrit["id"], gerrit_revision_sha, review
+            existing_gerrit.change, gerrit_revision_sha, review
         )
@@ -0,0 +1,138 @@
+"""A local index from github pull requests to the gerrit changes for them.
+
+Finding the gerrit change for a pull request otherwise takes a full-text
+search of every commit message on the gerrit server, for each comment
+or review mirrored.  The index is written when we push a review and on
+every gerrit hook event for a change that links a pull request, and
+holds only open changes; a pull request that isn't in it is searched
+for as before, see :func:`.util.find_gerrit_change`.
+
+Alongside each change it keeps the gerrit revisions seen for it, with
+the pull request commit each one was made from, so a github review on
+an older commit can be placed without listing every revision of the
+change.
+
+"""
+
+import sqlite3
+import threading
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+
+from ... import publishthing
+
+
+class IndexedChange(NamedTuple):
+    # the "project~branch~Change-Id" triplet, for the API
+    change: str
+
+    # the Change-Id itself, for the next commit to the same change
+    change_id: str
+
+
+class PullRequestIndex:
+    """The index, kept in a sqlite file any number of processes share."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS changes ("
+                "repo TEXT, number INTEGER, change TEXT, change_id TEXT, "
+                "PRIMARY KEY (repo, number))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS revisions ("
+                "repo TEXT, number INTEGER, revision TEXT, "
+                "pullreq_sha TEXT, PRIMARY KEY (repo, number, revision))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't cross threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def lookup(self, repo: str, number: int) -> Optional[IndexedChange]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT change, change_id FROM changes "
+                "WHERE repo=? AND number=?",
+                (repo, int(number)),
+            )
+            .fetchone()
+        )
+        return IndexedChange(*row) if row is not None else None
+
+    def record(
+        self,
+        repo: str,
+        number: int,
+        change: str,
+        change_id: str,
+        revision: Optional[str] = None,
+        pullreq_sha: Optional[str] = None,
+    ) -> None:
+        """Note the open change for a pull request, and one revision."""
+
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO changes "
+                "(repo, number, change, change_id) VALUES (?, ?, ?, ?)",
+                (repo, int(number), change, change_id),
+            )
+            if revision is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO revisions "
+                    "(repo, number, revision, pullreq_sha) "
+                    "VALUES (?, ?, ?, ?)",
+                    (repo, int(number), revision, pullreq_sha),
+                )
+
+    def revision_for(
+        self, repo: str, number: int, pullreq_sha: str
+    ) -> Optional[str]:
+        """Return the gerrit revision made from a pull request commit."""
+
+        row = (
+            self._connection()
+            .execute(
+                "SELECT revision FROM revisions "
+                "WHERE repo=? AND number=? AND pullreq_sha=?",
+                (repo, int(number), pullreq_sha),
+            )
+            .fetchone()
+        )
+        return row[0] if row is not None else None
+
+    def forget(self, repo: str, number: int) -> None:
+        """Drop a pull request whose change is no longer open."""
+
+        with self._connection() as conn:
+            for table in ("changes", "revisions"):
+                conn.execute(
+                    "DELETE FROM %s WHERE repo=? AND number=?" % table,
+                    (repo, int(number)),
+                )
+
+
+_indexes: Dict[str, PullRequestIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def index_for(thing: publishthing.PublishThing) -> Optional[PullRequestIndex]:
+    """Return the index named by ``prtogerrit_index_path``, if any."""
+
+    path = thing.opts.get("prtogerrit_index_path")
+    if not path:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = PullRequestIndex(path)
+        return index
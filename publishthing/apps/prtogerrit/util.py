@@ -1,4 +1,5 @@
 import collections
+import functools
 import re
 from typing import Callable
 from typing import Dict
@@ -11,10 +12,12 @@ from typing import Union
 
 import unidiff
 
+from . import index
 from ... import gerrit
 from ... import github
 from ... import publishthing
 from ...util import memoized_property
+from ...util import run_concurrently
 
 
 class PullRequestRec(NamedTuple):
@@ -37,6 +40,79 @@ class GithubReviewPosition(NamedTuple):
     position: int
 
 
+class CommitStatus(NamedTuple):
+    """A github commit status, as create_status() takes it."""
+
+    context: str
+    state: str
+    description: str
+
+
+def gerrit_label_statuses(
+    labels: gerrit.GerritJsonRec,
+) -> List[CommitStatus]:
+    """The github statuses that a change's gerrit labels come to.
+
+    One each for the "ci_verification" and "code_review" contexts, from
+    the Verified and Code-Review labels as returned with the LABELS
+    option.
+
+    """
+
+    verified = labels["Verified"]
+    verified_approved = "approved" in verified
+    verified_rejected = "rejected" in verified
+    verified_neutral = not verified_approved and not verified_rejected
+
+    codereview = labels["Code-Review"]
+    codereview_approved = "approved" in codereview
+    codereview_rejected = "disliked" in codereview or "rejected" in codereview
+    codereview_neutral = not codereview_approved and not codereview_rejected
+
+    return [
+        CommitStatus(context, state, message)
+        for send, context, state, message in [
+            (
+                verified_approved,
+                "ci_verification",
+                "success",
+                "Gerrit review has been verified",
+            ),
+            (
+                verified_rejected,
+                "ci_verification",
+                "failure",
+                "Gerrit review has failed verification",
+            ),
+            (
+                verified_neutral,
+                "ci_verification",
+                "pending",
+                "Needs CI verified status",
+            ),
+            (
+                codereview_approved,
+                "code_review",
+                "success",
+                "Received code review +2",
+            ),
+            (
+                codereview_rejected,
+                "code_review",
+                "failure",
+                "Code review has been rejected",
+            ),
+            (
+                codereview_neutral,
+                "code_review",
+                "pending",
+                "Needs code review +2",
+            ),
+        ]
+        if send
+    ]
+
+
 def get_pullreq_for_gerrit_change(
     thing: publishthing.PublishThing, opts: gerrit.GerritHookEvent
 ) -> Optional[PullRequestRec]:
@@ -61,9 +137,72 @@ def get_pullreq_for_gerrit_change(
         pr_num_match.sha,
         opts.change,
     )
+
+    # the index holds open changes only; any hook on a change that's been
+    # merged or abandoned since takes it out
+    pr_index = index.index_for(thing)
+    if pr_index is not None:
+        if change_commit["status"] == "NEW":
+            pr_index.record(
+                opts.project,
+                int(pr_num_match.number),
+                change_commit["id"],
+                change_commit["change_id"],
+                revision=current_revision,
+                pullreq_sha=pr_num_match.sha,
+            )
+        else:
+            pr_index.forget(opts.project, int(pr_num_match.number))
     return pr_num_match
 
 
+def find_gerrit_change(
+    thing: publishthing.PublishThing,
+    repo: str,
+    number: int,
+    html_url: str,
+    open_only: bool = False,
+) -> Optional[index.IndexedChange]:
+    """Locate the gerrit change for a pull request.
+
+    Looks in the ``prtogerrit_index_path`` index first, if there is
+    one, and otherwise searches gerrit commit messages for the pull
+    request URL, adding an open change found that way to the index.
+
+    """
+
+    # only open changes are indexed, so a hit is the answer whether or
+    # not open_only; a miss may yet be a closed change, and is searched
+    pr_index = index.index_for(thing)
+    if pr_index is not None:
+        indexed = pr_index.lookup(repo, number)
+        if indexed is not None:
+            return indexed
+
+    # search in gerrit reviews for this pull request URL
+    # in commit comments
+    pull_request_badge = "Pull-request: %s" % html_url
+    if open_only:
+        results = thing.gerrit_api.search(
+            status="open", message=pull_request_badge
+        )
+    else:
+        results = thing.gerrit_api.search(message=pull_request_badge)
+
+    if not results:
+        return None
+
+    # there should be only one, but in any case use the
+    # most recent, which is first in the list
+    existing_gerrit = results[0]
+    indexed = index.IndexedChange(
+        existing_gerrit["id"], existing_gerrit["change_id"]
+    )
+    if pr_index is not None and existing_gerrit.get("status") == "NEW":
+        pr_index.record(repo, number, *indexed)
+    return indexed
+
+
 def get_pullreq_for_gerrit_commit_message(
     project: str, commit_message: str
 ) -> Optional[PullRequestRec]:
@@ -206,6 +345,9 @@ def format_github_comment_for_gerrit(
     return "%s@github wrote:\n\n%s" % (author_username, message)
 
 
+_LeadCommentIndex = Dict[Tuple[Optional[str], str], gerrit.GerritJsonRec]
+
+
 class GerritComments:
     """operations and services specific to the list of comments on a
     gerrit review."""
@@ -215,22 +357,29 @@ class GerritComments:
     PATCHSET_LEVEL = "/PATCHSET_LEVEL"
 
     def __init__(self, gerrit_api: gerrit.GerritApi, change: str) -> None:
+        # the standalone comments API call is still the one that gives us
+        # text that will be in what the command line hook sends us, so
+        # still using this.
+
+        # in gerrit 3.3, we can get all the comment data with the inline
+        # comments API request; previously the "non file" comments weren't
+        # here (or maybe I just missed them)
+
+        # neither depends on the other, so ask for both at once
+        standalone, self._gerrit_inline_comments = run_concurrently(
+            functools.partial(
+                gerrit_api.get_change_standalone_comments, change
+            ),
+            functools.partial(gerrit_api.get_change_inline_comments, change),
+        )
+        self._gerrit_messages = standalone["messages"]
 
-        # this API call is still the one that gives us text that will
-        # be in what the command line hook sends us, so still using this.
-        gerrit_messages = gerrit_api.get_change_standalone_comments(change)[
-            "messages"
-        ]
-
+    @memoized_property
+    def _lead_comments(self) -> List[gerrit.GerritJsonRec]:
         _change_message_id_to_msg = {
-            msg["id"]: msg["message"] for msg in gerrit_messages
+            msg["id"]: msg["message"] for msg in self._gerrit_messages
         }
 
-        # in gerrit 3.3, we can get all the comment data with this API request;
-        # previously the "non file" comments weren't here (or maybe I just
-        # missed them)
-        gerrit_inline_comments = gerrit_api.get_change_inline_comments(change)
-
         # We want to organize the comments into:
         #
         # patch level comment
@@ -240,7 +389,7 @@ class GerritComments:
         # etc.
 
         gerrit_comments_by_change_message_id = {}
-        for file_, items in gerrit_inline_comments.items():
+        for file_, items in self._gerrit_inline_comments.items():
             for item in items:
                 change_message_id = item["change_message_id"]
 
@@ -280,7 +429,7 @@ class GerritComments:
                     item["path"] = file_
                     lead_comment["line_comments"].append(item)
 
-        self._lead_comments = sorted(
+        return sorted(
             gerrit_comments_by_change_message_id.values(),
             key=lambda item: item["updated"],
         )
@@ -288,34 +437,59 @@ class GerritComments:
     def __iter__(self) -> Iterable[gerrit.GerritJsonRec]:
         return iter(self._lead_comments)
 
-    def _compare_message(self, message: str, hook_message: str) -> bool:
-        # an absent message compares equal to nothing at all; otherwise a
-        # comment we failed to look up would match any empty hook message.
-        if not message or not hook_message:
-            return False
+    @staticmethod
+    def _normalize_message(message: str) -> str:
+        return re.sub(r"(?:^Patch Set \d+\:)|\\.|\n|\t", "", message)
 
-        return re.sub(
-            r"(?:^Patch Set \d+\:)|\\.|\n|\t", "", message
-        ) == re.sub(r"(?:^Patch Set \d+\:)|\\.|\n|\t", "", hook_message)
+    @memoized_property
+    def _lead_comment_index(self) -> _LeadCommentIndex:
+        """Index lead comments by author and by normalized message.
+
+        Each is indexed under both its command line message and its
+        review message, for its author's username and for no username
+        at all.  The comments are in ascending timestamp order, so the
+        most recent one for a key is the one left in the index.
+
+        """
+
+        index: _LeadCommentIndex = {}
+        for lead_gerrit_comment in self._lead_comments:
+            username = (lead_gerrit_comment.get("author") or {}).get(
+                "username"
+            )
+            for message in (
+                lead_gerrit_comment.get("command_line_message", ""),
+                lead_gerrit_comment.get("message", ""),
+            ):
+                # an absent message matches nothing at all; otherwise a
+                # comment we failed to look up would match any empty hook
+                # message.
+                if not message:
+                    continue
+                normalized = self._normalize_message(message)
+                index[(username, normalized)] = lead_gerrit_comment
+                index[(None, normalized)] = lead_gerrit_comment
+        return index
 
     def most_recent_comment_matching(
-        self, username: str, text: str
+        self, username: Optional[str], text: str
     ) -> Optional[gerrit.GerritJsonRec]:
-        # comments are in ascending timestamp so go in reverse order.
-        # it's *easy* to find dupes here because per-line reviews are often
-        # left without a main comment body.
-
-        for lead_gerrit_comment in reversed(self._lead_comments):
-            if (
-                self._compare_message(
-                    lead_gerrit_comment.get("command_line_message", ""), text
-                )
-                or "message" in lead_gerrit_comment
-                and self._compare_message(lead_gerrit_comment["message"], text)
-            ):
-                return lead_gerrit_comment
+        """Return the most recent review with this message.
 
-        return None
+        One by ``username`` if there's one, else by anyone; it's *easy*
+        to find dupes here because per-line reviews are often left
+        without a main comment body.
+
+        """
+
+        if not text:
+            return None
+        normalized = self._normalize_message(text)
+
+        index = self._lead_comment_index
+        if username is not None and (username, normalized) in index:
+            return index[(username, normalized)]
+        return index.get((None, normalized))
 
 
 class GithubPullRequest:
@@ -336,6 +510,26 @@ class GithubPullRequest:
     def _pullreq(self) -> github.GithubJsonRec:
         return self.gh_repo.get_pull_request(self.number)
 
+    def prefetch(self) -> None:
+        """Load the pull request, its diff and its review comments.
+
+        They're otherwise loaded one at a time as first needed; this
+        fetches whichever aren't loaded yet concurrently.
+
+        """
+
+        run_concurrently(
+            *[
+                functools.partial(getattr, self, name)
+                for name in (
+                    "_pullreq",
+                    "_gerrit_line_index",
+                    "_comment_index",
+                )
+                if name not in self.__dict__
+            ]
+        )
+
     def convert_gerrit_line_number(
         self, line: GerritReviewLine
     ) -> Optional[GithubReviewPosition]:
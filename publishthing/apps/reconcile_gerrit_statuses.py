@@ -0,0 +1,168 @@
+"""Bring github commit statuses back in line with gerrit votes.
+
+The prtogerrit gerrit hook keeps the "ci_verification" and
+"code_review" statuses of a pull request's commit in step with the
+Verified and Code-Review labels of its gerrit change, but only as hooks
+arrive; after an outage they drift apart until the next vote on each
+change.  This goes over every matching gerrit change that links a pull
+request, a page of changes with their labels at a time, works out the
+statuses the hook would have set, and posts the ones github doesn't
+already have::
+
+    reconcile_gerrit_statuses --gerrit-api-url https://gerrit.example.com \\
+        --gerrit-api-username bot --gerrit-api-password xyz \\
+        --access-token ghp_xyz --query "status:open project:org/name"
+
+or, as a GitHub App, ``--github-app-id 1234
+--github-app-private-key-path app.pem`` in place of ``--access-token``.
+
+"""
+
+import argparse
+from concurrent import futures
+from typing import List
+from typing import Optional
+
+from .prtogerrit import util
+from .. import gerrit
+from .. import publishthing
+
+WORKERS = 8
+
+
+def reconcile_change(
+    thing: publishthing.PublishThing,
+    change: gerrit.GerritJsonRec,
+    dry_run: bool = False,
+) -> List[util.CommitStatus]:
+    """Post the statuses a change's labels call for; return those posted."""
+
+    current = change["revisions"][change["current_revision"]]
+    pull_request_match = util.get_pullreq_for_gerrit_commit_message(
+        change["project"], current["commit"]["message"]
+    )
+    if pull_request_match is None:
+        return []
+
+    gh_repo = thing.github_repo(change["project"])
+    existing = {
+        status["context"]: (status["state"], status["description"])
+        for status in gh_repo.get_combined_status(pull_request_match.sha)[
+            "statuses"
+        ]
+    }
+
+    change_url = "%s/c/%s/+/%s" % (
+        thing.gerrit_api.service_url,
+        change["project"],
+        change["_number"],
+    )
+
+    posted = []
+    for status in util.gerrit_label_statuses(change["labels"]):
+        if existing.get(status.context) == (status.state, status.description):
+            continue
+        if not dry_run:
+            gh_repo.create_status(
+                pull_request_match.sha,
+                description=status.description,
+                state=status.state,
+                context=status.context,
+                target_url=change_url,
+            )
+        posted.append(status)
+    return posted
+
+
+def reconcile(
+    thing: publishthing.PublishThing,
+    query: str,
+    workers: int = WORKERS,
+    dry_run: bool = False,
+) -> int:
+    """Reconcile every change matching ``query``; return statuses posted."""
+
+    changes = thing.gerrit_api.query_changes(
+        query, options=("CURRENT_REVISION", "CURRENT_COMMIT", "LABELS")
+    )
+    posted = 0
+    with futures.ThreadPoolExecutor(workers) as executor:
+        pending = {
+            executor.submit(reconcile_change, thing, change, dry_run): change
+            for change in changes
+        }
+        for future in futures.as_completed(pending):
+            change = pending[future]
+            try:
+                statuses = future.result()
+            except Exception as err:
+                thing.warning(
+                    "Could not reconcile gerrit change %s: %s",
+                    change["_number"],
+                    err,
+                )
+                continue
+            for status in statuses:
+                thing.message(
+                    "%s change %s: %s -> %s",
+                    "Would set" if dry_run else "Set",
+                    change["_number"],
+                    status.context,
+                    status.state,
+                )
+            posted += len(statuses)
+    return posted
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gerrit-api-url", type=str, required=True)
+    parser.add_argument("--gerrit-api-username", type=str, required=True)
+    parser.add_argument("--gerrit-api-password", type=str, required=True)
+    credentials = parser.add_mutually_exclusive_group(required=True)
+    credentials.add_argument(
+        "--access-token", type=str, help="oauth access token"
+    )
+    credentials.add_argument(
+        "--github-app-id",
+        type=str,
+        help="authenticate as this GitHub App instead of with a token",
+    )
+    parser.add_argument(
+        "--github-app-private-key-path",
+        type=str,
+        help="PEM private key of the GitHub App",
+    )
+    parser.add_argument(
+        "--query",
+        type=str,
+        default="status:open",
+        help="gerrit search for the changes to reconcile",
+    )
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report what would change without posting anything",
+    )
+
+    opts = parser.parse_args(argv)
+    if opts.github_app_id and not opts.github_app_private_key_path:
+        parser.error("--github-app-id needs --github-app-private-key-path")
+
+    thing = publishthing.PublishThing(
+        github_access_token=opts.access_token,
+        github_app_id=opts.github_app_id,
+        github_app_private_key_path=opts.github_app_private_key_path,
+        github_api_concurrency=opts.workers,
+        gerrit_api_url=opts.gerrit_api_url,
+        gerrit_api_username=opts.gerrit_api_username,
+        gerrit_api_password=opts.gerrit_api_password,
+        gerrit_api_pool_size=opts.workers,
+    )
+    posted = reconcile(
+        thing, opts.query, workers=opts.workers, dry_run=opts.dry_run
+    )
+    thing.message(
+        "%s %d statuses", "Would post" if opts.dry_run else "Posted", posted
+    )
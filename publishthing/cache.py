@@ -0,0 +1,258 @@
+"""Conditional-request caching for the HTTP API clients.
+
+GitHub doesn't count a "304 Not Modified" against the rate limit, so
+remembering the ETag / Last-Modified validators of each response and
+sending them back on the next request for the same URL turns most
+repeat reads into free ones, and the 304 itself carries no body.
+
+The webhook app runs under several worker processes and gerrit hooks
+are separate short-lived processes, so an in-process cache mostly dies
+before it's used again.  :class:`SqliteResponseCache` keeps the same
+entries in a file every process can share; see
+``PublishThing.http_cache`` for the options that select it.
+
+"""
+
+import collections
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+ConditionalGet = Callable[[Dict[str, str]], requests.Response]
+
+
+class CachedResponse(NamedTuple):
+    """The parts of a response needed to hand it back out again."""
+
+    status_code: int
+    headers: Dict[str, str]
+    content: bytes
+    encoding: Optional[str]
+    stored_at: float
+
+    @classmethod
+    def from_response(cls, resp: requests.Response) -> "CachedResponse":
+        return cls(
+            resp.status_code,
+            dict(resp.headers),
+            resp.content,
+            resp.encoding,
+            time.time(),
+        )
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        """Request headers that ask the server whether this is stale."""
+
+        headers = CaseInsensitiveDict(self.headers)
+        validators = {}
+        if "ETag" in headers:
+            validators["If-None-Match"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            validators["If-Modified-Since"] = headers["Last-Modified"]
+        return validators
+
+    def as_response(self, url: str) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = self.status_code
+        resp.headers = CaseInsensitiveDict(self.headers)
+        resp._content = self.content
+        resp.encoding = self.encoding
+        resp.url = url
+        return resp
+
+
+class ResponseCache:
+    """An in-process LRU of cacheable responses.
+
+    ``size`` bounds the number of entries; zero turns caching off
+    entirely, leaving :meth:`conditional_get` a plain pass-through.
+
+    ``ttls`` maps regular expressions, searched against the URL, to a
+    number of seconds during which a cached response is served without
+    asking the server at all; the first pattern that matches wins.  A
+    URL matching none of them is revalidated on every request.
+
+    """
+
+    def __init__(
+        self, size: int = 1000, ttls: Optional[Dict[str, float]] = None
+    ) -> None:
+        self.size = size
+        self.ttls = [
+            (re.compile(pattern), ttl) for pattern, ttl in (ttls or {}).items()
+        ]
+        self._entries: "collections.OrderedDict[str, CachedResponse]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def ttl_for(self, url: str) -> float:
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Build a cache key from the parts that identify a response.
+
+        Callers pass the auth identity along with the URL, since two
+        tokens can legitimately see different things at the same URL,
+        and the Accept header, since one pull request URL serves both
+        json and a diff.  Hashing keeps the token itself out of the key.
+
+        """
+
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+            return cached
+
+    def set(self, key: str, cached: CachedResponse) -> None:
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = cached
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def conditional_get(
+        self,
+        key: str,
+        url: str,
+        get: ConditionalGet,
+        ttl: Optional[float] = None,
+    ) -> requests.Response:
+        """Run ``get`` with validators from any cached copy of ``url``.
+
+        ``get`` receives the extra request headers to send, and isn't
+        called at all while a cached copy is within its ttl.  A 304 is
+        answered from the cache; any other 200 that has validators, or a
+        ttl, replaces the cached copy.  Everything else, errors included,
+        is returned as is for the caller to deal with.
+
+        ``ttl`` overrides the configured ttls for this call, for a
+        caller that knows better, e.g. ``math.inf`` for a response that
+        can never change.
+
+        """
+
+        if self.size <= 0:
+            return get({})
+
+        if ttl is None:
+            ttl = self.ttl_for(url)
+        cached = self.get(key)
+        if cached is not None and time.time() - cached.stored_at < ttl:
+            return cached.as_response(url)
+
+        resp = get(cached.validators if cached is not None else {})
+
+        if resp.status_code == 304 and cached is not None:
+            if ttl:
+                # revalidated; good for another ttl
+                self.set(key, cached._replace(stored_at=time.time()))
+            return cached.as_response(url)
+
+        if resp.status_code == 200:
+            fresh = CachedResponse.from_response(resp)
+            if fresh.validators or ttl:
+                self.set(key, fresh)
+
+        return resp
+
+
+class SqliteResponseCache(ResponseCache):
+    """A :class:`ResponseCache` kept in a sqlite file.
+
+    Any number of processes may point at the same file; sqlite does the
+    locking.  Least recently used entries past ``size`` are evicted on
+    write.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 1000,
+        ttls: Optional[Dict[str, float]] = None,
+    ) -> None:
+        super(SqliteResponseCache, self).__init__(size, ttls)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, status_code INTEGER, headers TEXT, "
+                "content BLOB, encoding TEXT, stored_at REAL, used_at REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_responses_used_at "
+                "ON responses (used_at)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't cross threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT status_code, headers, content, encoding, stored_at "
+                "FROM responses WHERE key=?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE responses SET used_at=? WHERE key=?",
+                (time.time(), key),
+            )
+        status_code, headers, content, encoding, stored_at = row
+        return CachedResponse(
+            status_code, json.loads(headers), content, encoding, stored_at
+        )
+
+    def set(self, key: str, cached: CachedResponse) -> None:
+        if self.size <= 0:
+            return
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, status_code, "
+                "headers, content, encoding, stored_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    cached.status_code,
+                    json.dumps(cached.headers),
+                    cached.content,
+                    cached.encoding,
+                    cached.stored_at,
+                    time.time(),
+                ),
+            )
+            conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM "
+                "responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.size,),
+            )
@@ -1,68 +1,265 @@
 import argparse
 from configparser import ConfigParser
+import contextlib
+import contextvars
 import json
+import math
 import os
 import re
 import sys
+import time
 from typing import Any
 from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import NamedTuple
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import Union
 import urllib.parse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from . import cache
+from . import gerritdaemon
+from . import gerritstream
 from . import git
 from . import publishthing  # noqa
 from .util import Hooks
+from .util import memoized_property
 
 GerritJsonRec = Dict[str, Any]
 GerritApiResult = Union[List[GerritJsonRec], GerritJsonRec]
 GerritHookEvent = Any
 
+# the change record ``changes/<id>/detail`` returns
+DETAIL_OPTIONS = (
+    "LABELS",
+    "DETAILED_LABELS",
+    "DETAILED_ACCOUNTS",
+    "REVIEWER_UPDATES",
+    "MESSAGES",
+)
+
+# everything the hooks ask of a change between them, fetched together on
+# the first call of an event; see GerritApi.event_scope()
+HOOK_CHANGE_OPTIONS = ("CURRENT_REVISION", "CURRENT_COMMIT") + DETAIL_OPTIONS
+
+
+class _EventScope(NamedTuple):
+    options: Tuple[str, ...]
+    changes: Dict[str, Tuple[Sequence[str], GerritJsonRec]]
+
 
 class GerritApi:
     def __init__(self, thing: "publishthing.PublishThing") -> None:
+        self.thing = thing
         self.service_url = thing.opts["gerrit_api_url"]
         self.api_username = thing.opts["gerrit_api_username"]
         self.api_password = thing.opts["gerrit_api_password"]
 
+        # one hook can make half a dozen calls; keep the connection, and
+        # the TLS session with it, open between them
+        self.timeout = thing.opts.get("gerrit_api_timeout", 30)
+        self.change_cache_ttl = thing.opts.get("gerrit_change_cache_ttl", 10)
+        self.session = requests.Session()
+        self.session.auth = (self.api_username, self.api_password)
+        self.session.mount(
+            self.service_url,
+            HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=thing.opts.get("gerrit_api_pool_size", 10),
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.5,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                    raise_on_status=False,
+                ),
+            ),
+        )
+        self.session.hooks["response"].append(self._debug_response)
+
+        # a context variable rather than a thread local, so that the
+        # scope follows the event into util.run_concurrently()
+        self._scope: contextvars.ContextVar[Optional[_EventScope]] = (
+            contextvars.ContextVar("gerrit_event_scope", default=None)
+        )
+
+    def _debug_response(self, resp: Any, *args: Any, **kw: Any) -> None:
+        self.thing.debug(
+            "gerrit",
+            "%s %s -> %s (%.3fs)",
+            resp.request.method,
+            resp.url,
+            resp.status_code,
+            resp.elapsed.total_seconds(),
+        )
+
     def get_patchset_commit(
         self, change: str, patchset: int
     ) -> GerritApiResult:
+        # a patchset, named by number or by sha, never changes once it's
+        # been uploaded; only "current" moves
         return self._gerrit_api_call(
-            "changes/%s/revisions/%s/commit" % (change, patchset)
+            "changes/%s/revisions/%s/commit" % (change, patchset),
+            ttl=math.inf if str(patchset) != "current" else None,
         )
 
+    @contextlib.contextmanager
+    def event_scope(
+        self, options: Sequence[str] = HOOK_CHANGE_OPTIONS
+    ) -> Iterator[None]:
+        """Share :meth:`get_change` results for the length of one event.
+
+        Within the scope, the first :meth:`get_change` for a change
+        fetches ``options`` along with whatever was asked for, and later
+        calls for any of those are answered from that one record.  The
+        scope is per thread, shared with the calls the thread hands to
+        :func:`.util.run_concurrently`, and a :meth:`set_review` in it
+        drops the change's record, since labels and messages will have
+        moved.
+
+        """
+
+        token = self._scope.set(_EventScope(tuple(options), {}))
+        try:
+            yield
+        finally:
+            self._scope.reset(token)
+
+    def get_change(
+        self, change: str, options: Sequence[str] = ()
+    ) -> GerritJsonRec:
+        """Return the change record, with the given ``o=`` options."""
+
+        scope = self._scope.get()
+        if scope is None:
+            return self._get_change(change, options)
+        changes = scope.changes
+
+        if change in changes:
+            fetched_options, rec = changes[change]
+            if set(fetched_options).issuperset(options):
+                return rec
+            options = list(fetched_options) + list(options)
+        else:
+            options = list(scope.options) + list(options)
+
+        # keep the order given, so the url is the same from call to call
+        options = list(dict.fromkeys(options))
+        rec = self._get_change(change, options)
+        changes[change] = (options, rec)
+        return rec
+
+    def _get_change(self, change: str, options: Sequence[str]) -> Any:
+        if options:
+            return self._gerrit_api_call(
+                "changes/%s?%s"
+                % (change, "&".join("o=%s" % option for option in options))
+            )
+        else:
+            return self._gerrit_api_call("changes/%s" % (change,))
+
     def get_change_detail(self, change: str) -> GerritApiResult:
-        return self._gerrit_api_call("changes/%s/detail" % (change,))
+        return self.get_change(change, DETAIL_OPTIONS)
 
     def get_change_standalone_comments(self, change: str) -> GerritJsonRec:
-        return self._gerrit_api_call(
-            "changes/%s?o=MESSAGES&o=DETAILED_ACCOUNTS" % (change,)
-        )
+        return self.get_change(change, ("MESSAGES", "DETAILED_ACCOUNTS"))
 
     def get_change_inline_comments(self, change: str) -> GerritJsonRec:
         return self._gerrit_api_call("changes/%s/comments" % (change,))
 
     def get_change_current_revision(self, change: str) -> GerritApiResult:
-        return self._gerrit_api_call(
-            "changes/%s?o=CURRENT_REVISION&o=CURRENT_COMMIT" % (change,)
-        )
+        return self.get_change(change, ("CURRENT_REVISION", "CURRENT_COMMIT"))
 
     def get_change_all_revisions(self, change: str) -> GerritApiResult:
-        return self._gerrit_api_call(
-            "changes/%s?o=ALL_REVISIONS&o=ALL_COMMITS" % (change,)
-        )
+        """Return the change with every revision and its commit.
+
+        The full history is kept in the cache.  For
+        ``gerrit_change_cache_ttl`` seconds it's returned as is; after
+        that, only the current revision is fetched and added to it, so
+        long as that accounts for every patchset, which it does unless
+        more than one was uploaded in between.
+
+        """
+
+        path = "changes/%s?o=ALL_REVISIONS&o=ALL_COMMITS" % (change,)
+        cached = self._recall(path)
+        if cached is not None:
+            rec, stored_at = cached
+            if time.time() - stored_at < self.change_cache_ttl:
+                return rec
+
+            current = self.get_change_current_revision(change)
+            revisions = dict(rec["revisions"])
+            revisions.update(current["revisions"])
+            numbers = sorted(rev["_number"] for rev in revisions.values())
+            if numbers == list(range(1, len(numbers) + 1)):
+                rec = dict(current, revisions=revisions)
+            else:
+                rec = None
+        else:
+            rec = None
+
+        if rec is None:
+            rec = self._gerrit_api_call(path)
+
+        self._remember(path, rec)
+        for sha, revision in rec["revisions"].items():
+            commit = dict(revision["commit"], commit=sha)
+            for patchset in (sha, revision["_number"]):
+                self._remember(
+                    "changes/%s/revisions/%s/commit" % (change, patchset),
+                    commit,
+                )
+        return rec
 
     def set_review(
         self, change: str, revision_id: str, review: GerritJsonRec
     ) -> None:
+        scope = self._scope.get()
+        if scope is not None:
+            scope.changes.pop(change, None)
         return self._gerrit_api_post(
             "changes/%s/revisions/%s/review" % (change, revision_id), review
         )
 
+    def query_changes(
+        self,
+        query: str,
+        options: Sequence[str] = (),
+        limit: Optional[int] = None,
+        page_size: int = 100,
+    ) -> Iterator[GerritJsonRec]:
+        """Yield every change matching a search query, a page at a time.
+
+        ``query`` is gerrit search syntax, e.g. ``status:open
+        project:org/name``; ``options`` are ``o=`` options applied to
+        each change, so that e.g. labels come back with the search
+        rather than with a request per change.
+
+        """
+
+        start = 0
+        while limit is None or start < limit:
+            count = (
+                page_size if limit is None else min(page_size, limit - start)
+            )
+            params = [("q", query)]
+            params += [("o", option) for option in options]
+            params += [("n", str(count)), ("S", str(start))]
+            page = self._gerrit_api_call(
+                "changes/?%s" % urllib.parse.urlencode(params)
+            )
+            yield from page
+            start += len(page)
+            if not page or not page[-1].get("_more_changes"):
+                break
+
     def search(self, **kw: str) -> GerritApiResult:
         return self._gerrit_api_call(
             "changes/?q=%s"
@@ -74,9 +271,44 @@ class GerritApi:
             )
         )
 
-    def _gerrit_api_call(self, path: str) -> Any:
+    def _cache_key(self, url: str) -> str:
+        return self.thing.http_cache.key("gerrit", self.api_username, url)
+
+    def _recall(self, path: str) -> Optional[Tuple[Any, float]]:
+        """Return a cached record for ``path`` and when it was stored."""
+
+        url = "%s/a/%s" % (self.service_url, path)
+        cached = self.thing.http_cache.get(self._cache_key(url))
+        if cached is None or cached.status_code != 200:
+            return None
+        body = cached.content.decode(cached.encoding or "utf-8")
+        return json.loads(body.lstrip(")]}'")), cached.stored_at
+
+    def _remember(self, path: str, rec: Any) -> None:
+        """Cache ``rec`` as though it were the response for ``path``."""
+
+        url = "%s/a/%s" % (self.service_url, path)
+        self.thing.http_cache.set(
+            self._cache_key(url),
+            cache.CachedResponse(
+                200,
+                {"Content-Type": "application/json; charset=utf-8"},
+                (")]}'\n" + json.dumps(rec)).encode("utf-8"),
+                "utf-8",
+                time.time(),
+            ),
+        )
+
+    def _gerrit_api_call(self, path: str, ttl: Optional[float] = None) -> Any:
         url = "%s/a/%s" % (self.service_url, path)
-        resp = requests.get(url, auth=(self.api_username, self.api_password))
+        resp = self.thing.http_cache.conditional_get(
+            self._cache_key(url),
+            url,
+            lambda validators: self.session.get(
+                url, headers=validators, timeout=self.timeout
+            ),
+            ttl=ttl,
+        )
 
         if resp.status_code > 299:
             raise Exception(
@@ -92,9 +324,7 @@ class GerritApi:
     def _gerrit_api_post(self, path: str, rec: GerritJsonRec) -> Any:
         url = "%s/a/%s" % (self.service_url, path)
 
-        resp = requests.post(
-            url, auth=(self.api_username, self.api_password), json=rec
-        )
+        resp = self.session.post(url, json=rec, timeout=self.timeout)
         if resp.status_code > 299:
             raise Exception(
                 "Got response %s for %s: %s"
@@ -114,12 +344,20 @@ class GerritGit:
         git_email: str,
         git_remote_username: str,
         git_remote_password: str,
+        rev: Optional[str] = None,
     ) -> None:
         self.git = git
-        self.git._assert_not_bare()
+        self.git_identity = git_identity
+        self.git_email = git_email
         self.gerritconfig = ConfigParser(interpolation=None)
-        with self.git.checkout_shell() as gr_shell:
-            self.gerritconfig.read_file(gr_shell.open(".gitreview"))
+        if rev is None:
+            self.git._assert_not_bare()
+            with self.git.checkout_shell() as gr_shell:
+                self.gerritconfig.read_file(gr_shell.open(".gitreview"))
+        else:
+            self.gerritconfig.read_string(
+                self.git.show_file(rev, ".gitreview")
+            )
 
         self._setup_repo_for_gerrit(
             git_identity, git_email, git_remote_username, git_remote_password
@@ -133,7 +371,7 @@ class GerritGit:
         git_remote_password: str,
     ) -> None:
 
-        with self.git.checkout_shell() as gr_shell:
+        with self.git.cmd_shell() as gr_shell:
             username = gr_shell.output_shell_cmd(
                 "git", "config", "user.name", none_for_error=True
             )
@@ -153,7 +391,7 @@ class GerritGit:
             gerrit_host = self.gerritconfig["gerrit"]["host"]
         gerrit_project = self.gerritconfig["gerrit"]["project"]
 
-        with self.git.checkout_shell() as gr_shell:
+        with self.git.cmd_shell() as gr_shell:
             url = "https://%s:%s@%s/%s" % (
                 git_remote_username,
                 urllib.parse.quote_plus(git_remote_password),
@@ -174,11 +412,75 @@ class GerritGit:
         author: Optional[str] = None,
         amend: bool = False,
         change_id: Optional[str] = None,
-    ) -> None:
+        parent: Optional[str] = None,
+    ) -> str:
+        """Commit, with a Change-Id at the end of the message.
+
+        The Change-Id is the one given, else the one already in the
+        message, else a new one; it's returned.  ``parent`` is the id of
+        the commit HEAD is at, for a caller that knows it, to work into
+        a new Change-Id as gerrit's commit-msg hook would.
+
+        """
+
+        commit_msg, found_change_id = self._place_change_id(
+            commit_msg, change_id
+        )
 
+        # manually generate a change_id because apache under selinux
+        # can't run gerrit's commit-msg hook.  it's worked out from what's
+        # staged, so that the commit only has to be made once
+        if found_change_id is None:
+            found_change_id = self._create_change_id(
+                commit_msg, parent=parent, author=author
+            )
+            commit_msg += "\nChange-Id: %s" % found_change_id
+
+        self.git.commit(commit_msg, author=author, amend=amend)
+
+        return found_change_id
+
+    def commit_tree(
+        self,
+        tree: str,
+        parent: str,
+        commit_msg: str,
+        author: Optional[str] = None,
+        change_id: Optional[str] = None,
+    ) -> Tuple[str, str]:
+        """Like :meth:`commit`, for a tree from :meth:`.GitRepo.merge_tree`.
+
+        The commit is written on ``parent`` without a checkout or a
+        branch; the commit and its Change-Id are returned, and the
+        commit is what's passed to :meth:`review`.  ``parent`` is best
+        given as a commit id; anything else is resolved to one first.
+
+        """
+
+        if not re.match(r"^[0-9a-f]{40}$", parent):
+            parent = self.git.rev_parse("%s^{commit}" % parent)
+
+        commit_msg, found_change_id = self._place_change_id(
+            commit_msg, change_id
+        )
+        if found_change_id is None:
+            found_change_id = self._create_change_id(
+                commit_msg, tree=tree, parent=parent, author=author
+            )
+            commit_msg += "\nChange-Id: %s" % found_change_id
+
+        commit = self.git.commit_tree(
+            tree, [parent], commit_msg, author=author
+        )
+        return commit, found_change_id
+
+    def _place_change_id(
+        self, commit_msg: str, change_id: Optional[str]
+    ) -> Tuple[str, Optional[str]]:
         # rewrite the message to not include Change-id:, since
         # in any case it needs to be at the very bottom for gerrit
-        # to locate it reliably
+        # to locate it reliably.  returns the message and its change id,
+        # or None if one has to be made up
         rewrite_lines = []
         change_id_match = None
         for line in commit_msg.split("\n"):
@@ -192,21 +494,25 @@ class GerritGit:
         # so write it in
         if change_id_match and not change_id:
             rewrite_lines.append(change_id_match.group(0))
+            change_id = change_id_match.group(0).split(":", 1)[1].strip()
         elif change_id:
             rewrite_lines.append("Change-Id: %s" % change_id)
-        commit_msg = "\n".join(rewrite_lines)
-
-        self.git.commit(commit_msg, author=author, amend=amend)
-
-        # manually generate a change_id and re-commit because apache under
-        # selinux can't run gerrit's commit-msg hook
-        if not change_id_match and not change_id:
-            change_id = self._create_change_id(commit_msg)
-            commit_msg += "\nChange-Id: %s" % change_id
-            self.git.commit(commit_msg, author=author, amend=True)
+        return "\n".join(rewrite_lines), change_id
+
+    def change_triplet(self, change_id: str) -> str:
+        """The "project~branch~Change-Id" the API knows a change by."""
+
+        project = self.gerritconfig["gerrit"]["project"]
+        if project.endswith(".git"):
+            project = project[0:-4]
+        return "%s~%s~%s" % (
+            urllib.parse.quote(project, safe=""),
+            self.gerritconfig["gerrit"]["defaultbranch"],
+            change_id,
+        )
 
-    def review(self) -> str:
-        with self.git.checkout_shell() as gr_shell:
+    def review(self, rev: str = "HEAD") -> str:
+        with self.git.cmd_shell() as gr_shell:
             branch = self.gerritconfig["gerrit"]["defaultbranch"]
             if "httphost" in self.gerritconfig["gerrit"]:
                 gerrit_host = self.gerritconfig["gerrit"]["httphost"]
@@ -216,7 +522,7 @@ class GerritGit:
                 "git",
                 "push",
                 "gerrit",
-                "HEAD:refs/for/%s" % branch,
+                "%s:refs/for/%s" % (rev, branch),
                 include_stderr=True,
             )
 
@@ -231,38 +537,37 @@ class GerritGit:
                     f"locate PR link in content: {output}"
                 )
 
-    def _create_change_id(self, change_msg: str) -> str:
-        with self.git.checkout_shell().shell_in(".git") as subshell:
-            payload = []
-            payload.append(
-                "tree %s" % subshell.output_shell_cmd("git", "write-tree")
-            )
-            parent = subshell.output_shell_cmd(
-                "git", "rev-parse", "HEAD^0"
-            ).strip()
-            if parent:
-                payload.append("parent %s" % parent)
-            payload.append(
-                "author %s"
-                % subshell.output_shell_cmd("git", "var", "GIT_AUTHOR_IDENT")
-            )
-            payload.append(
-                "committer %s"
-                % subshell.output_shell_cmd(
-                    "git", "var", "GIT_COMMITTER_IDENT"
-                )
-            )
-            payload.append("\n%s" % change_msg)
+    def _create_change_id(
+        self,
+        change_msg: str,
+        tree: Optional[str] = None,
+        parent: Optional[str] = None,
+        author: Optional[str] = None,
+    ) -> str:
+        # what gerrit's commit-msg hook does: the id of a commit object for
+        # the tree, parent, identities and message.  it only has to be
+        # unique, so it's worked out here rather than with git var and
+        # git hash-object; write-tree is the one git command, and only if
+        # the tree isn't known already.  the parent is a commit id from
+        # the caller, and is left out when the caller doesn't have one
+        if tree is None:
+            with self.git.cmd_shell() as subshell:
+                tree = subshell.output_shell_cmd("git", "write-tree")
+
+        committer = "%s <%s>" % (self.git_identity, self.git_email)
+        timestamp = "%d %s" % (time.time(), time.strftime("%z"))
+
+        payload = []
+        payload.append("tree %s" % tree)
+        if parent:
+            payload.append("parent %s" % parent)
+        payload.append(
+            "author %s %s" % ((author or committer).strip(), timestamp)
+        )
+        payload.append("committer %s %s" % (committer, timestamp))
+        payload.append("\n%s" % change_msg)
 
-            change_id = subshell.output_shell_cmd_stdin(
-                "\n".join(payload),
-                "git",
-                "hash-object",
-                "-t",
-                "commit",
-                "--stdin",
-            )
-            return "I%s" % (change_id,)
+        return "I%s" % (git.hash_commit("\n".join(payload)),)
 
 
 class GerritHook(Hooks):
@@ -273,7 +578,8 @@ class GerritHook(Hooks):
         )
         super(GerritHook, self).__init__()
 
-    def main(self, argv: Optional[List[str]] = None) -> None:
+    @memoized_property
+    def _argument_parser(self) -> argparse.ArgumentParser:
         # hooks are at: https://gerrit.googlesource.com/plugins/hooks/+/refs/
         # heads/master/src/main/resources/Documentation/hooks.md#patchset_created
         parser = argparse.ArgumentParser()
@@ -318,11 +624,48 @@ class GerritHook(Hooks):
         for cat in {"Code-Review", "Verified"}.union(self.approval_categories):
             parser.add_argument("--%s" % cat, type=int)
             parser.add_argument("--%s-oldValue" % cat, type=int)
+        return parser
 
-        opts, other_args = parser.parse_known_args(argv)
+    def main(self, argv: Optional[List[str]] = None) -> None:
+        opts, other_args = self._argument_parser.parse_known_args(argv)
         if opts.hook:
             hook = opts.hook
         else:
             hook = opts.hook = os.path.basename(sys.argv[0])
         self.thing.debug("gerrithook", "event received: %s  (%s)", hook, opts)
-        self._run_hooks(hook, opts)
+        if "gerrit_api_url" in self.thing.opts:
+            with self.thing.gerrit_api.event_scope():
+                self._run_hooks(hook, opts)
+        else:
+            self._run_hooks(hook, opts)
+
+    def stream_events(
+        self,
+        command: Optional[Sequence[str]] = None,
+        workers: Optional[int] = None,
+    ) -> None:
+        """Handle events from gerrit's stream-events feed, until stopped.
+
+        An alternative to installing the script as a hook: one
+        long-running process rather than one per event.  See
+        :class:`.gerritstream.GerritEventStream`.
+
+        """
+
+        gerritstream.GerritEventStream(
+            self.thing, command=command, workers=workers
+        ).run()
+
+    def serve(
+        self, path: Optional[str] = None, workers: Optional[int] = None
+    ) -> None:
+        """Handle hook invocations forwarded over a Unix socket.
+
+        For hook symlinks pointed at :mod:`.gerritforward`; see
+        :class:`.gerritdaemon.GerritHookDaemon`.
+
+        """
+
+        gerritdaemon.GerritHookDaemon(
+            self.thing, path=path, workers=workers
+        ).serve_forever()
@@ -0,0 +1,118 @@
+"""A long-running process for gerrit hook invocations.
+
+Where gerrit has to keep running hooks through the hooks plugin, the
+hook symlinks can point at :mod:`.gerritforward` instead of at the
+configuration script.  That writes each invocation to the Unix socket
+of a :class:`GerritHookDaemon`, which runs ``GerritHook.main()`` on it
+here, with the HTTP connection pools and caches already warm.
+
+As with the stream consumer, invocations for the same change are
+handled one at a time and in order, different changes in parallel.
+
+"""
+
+import json
+import os
+import socketserver
+import threading
+import traceback
+from typing import List
+from typing import Optional
+
+from . import gerritforward
+from . import publishthing  # noqa
+from .util import KeyedWorkers
+
+
+class _HookRequestHandler(socketserver.StreamRequestHandler):
+    server: "_HookServer"
+
+    def handle(self) -> None:
+        try:
+            argv = json.loads(self.rfile.readline())["argv"]
+            self.server.hook_daemon.submit(argv)
+        except (Exception, SystemExit):
+            # SystemExit being how argparse reports bad arguments
+            self.server.hook_daemon.thing.warning(
+                "gerrit hook daemon: bad request\n%s", traceback.format_exc()
+            )
+            self.wfile.write(b"error\n")
+        else:
+            self.wfile.write(b"ok\n")
+
+
+class _HookServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    hook_daemon: "GerritHookDaemon"
+
+
+class GerritHookDaemon:
+    """Serve forwarded hook invocations on a Unix socket.
+
+    ``path`` defaults to the ``gerrit_hook_socket`` option, else the
+    same default :mod:`.gerritforward` uses; ``workers`` to
+    ``gerrit_hook_workers``, or 4.
+
+    """
+
+    def __init__(
+        self,
+        thing: "publishthing.PublishThing",
+        path: Optional[str] = None,
+        workers: Optional[int] = None,
+    ) -> None:
+        self.thing = thing
+        self.path = (
+            path
+            or thing.opts.get("gerrit_hook_socket")
+            or gerritforward.socket_path()
+        )
+        self.workers = workers or thing.opts.get("gerrit_hook_workers", 4)
+        self.ready = threading.Event()
+        self._finished = threading.Event()
+        self._server: Optional[_HookServer] = None
+        self._keyed_workers: Optional[KeyedWorkers] = None
+
+    def serve_forever(self) -> None:
+        # a socket file left by a previous run would fail the bind
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self._keyed_workers = KeyedWorkers(self.workers, self._handle)
+        self._server = _HookServer(self.path, _HookRequestHandler)
+        self._server.hook_daemon = self
+        os.chmod(self.path, 0o600)
+        self.ready.set()
+        self.thing.debug("gerritdaemon", "listening on %s", self.path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.path)
+            # let what was accepted finish; the forwarders were told ok
+            self._keyed_workers.close()
+            self._finished.set()
+
+    def shutdown(self) -> None:
+        """Stop serving; returns once the hooks accepted have run."""
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._finished.wait()
+
+    def submit(self, argv: List[str]) -> None:
+        opts, _ = self.thing.gerrit_hook._argument_parser.parse_known_args(
+            argv
+        )
+        assert self._keyed_workers is not None
+        self._keyed_workers.submit(
+            str(opts.change or opts.project or opts.hook), argv
+        )
+
+    def _handle(self, argv: List[str]) -> None:
+        try:
+            self.thing.gerrit_hook.main(argv)
+        except Exception:
+            self.thing.warning(
+                "gerrit hook %s failed:\n%s", argv, traceback.format_exc()
+            )
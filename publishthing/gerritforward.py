@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Hand a gerrit hook invocation to a running hook daemon, and exit.
+
+Point the hook symlinks at this file::
+
+    # ln -s /path/to/publishthing/gerritforward.py \\
+        /var/gerrit/hooks/patchset-created
+
+The hook's arguments, with the hook name taken from the symlink, are
+written to the Unix socket of a :class:`.gerritdaemon.GerritHookDaemon`,
+which runs ``GerritHook.main()`` on them in a process that's already
+warm.  The socket is ``$PUBLISHTHING_HOOK_SOCKET``, by default
+``~/.publishthing-gerrit-hook.sock``.
+
+This module uses the standard library only and must stay that way;
+run as a script it doesn't import the rest of publishthing, which is the
+point.  (The ``publishthing_gerrit_forward`` console script works too,
+but pays for importing the package.)
+
+"""
+
+import json
+import os
+import socket
+import sys
+from typing import List
+from typing import Optional
+
+DEFAULT_SOCKET = "~/.publishthing-gerrit-hook.sock"
+
+
+def socket_path() -> str:
+    return os.path.expanduser(
+        os.environ.get("PUBLISHTHING_HOOK_SOCKET", DEFAULT_SOCKET)
+    )
+
+
+def forward(
+    argv: List[str],
+    path: str,
+    hook: Optional[str] = None,
+    timeout: float = 10,
+) -> None:
+    """Send one hook invocation; returns once the daemon has queued it."""
+
+    if hook and "--hook" not in argv:
+        argv = ["--hook", hook] + list(argv)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps({"argv": argv}) + "\n").encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        ack = sock.makefile("rb").readline()
+
+    if ack != b"ok\n":
+        raise Exception(
+            "gerrit hook daemon at %s didn't accept %s: %r" % (path, argv, ack)
+        )
+
+
+def main() -> None:
+    forward(sys.argv[1:], socket_path(), hook=os.path.basename(sys.argv[0]))
+
+
+if __name__ == "__main__":
+    main()
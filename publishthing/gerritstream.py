@@ -0,0 +1,264 @@
+"""Consume gerrit's stream-events feed in one long-running process.
+
+Installed as a hook, each gerrit event starts a fresh interpreter that
+imports everything before it can do anything.  :class:`GerritEventStream`
+instead runs ``gerrit stream-events`` (usually over ssh) and turns each
+JSON event it prints into the same command line the hooks plugin would
+have run the hook with, so the handlers registered on
+``thing.gerrit_hook`` receive the same ``opts`` either way.
+
+Events go to a pool of worker threads, always the same worker for the
+same change, so that a change's events are still handled one at a time
+and in order.  When the feed ends or the connection drops, the command
+is run again after a backoff.  Gerrit's stream-events doesn't replay
+what was missed, but a command that wraps it may; the first events of a
+new connection that are exact repeats of the last ones of the one
+before are skipped.  Nothing else is, whatever its ``eventCreatedOn``,
+which is in whole seconds and not in stream order.
+
+"""
+
+import collections
+import hashlib
+import json
+import shlex
+import subprocess
+import threading
+import traceback
+from typing import Any
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+
+from . import publishthing  # noqa
+from .util import KeyedWorkers
+
+GerritStreamEvent = Dict[str, Any]
+
+# event attribute -> hook option, for the accounts each event names
+_ACCOUNTS = (
+    ("uploader", "uploader"),
+    ("author", "author"),
+    ("submitter", "submitter"),
+    ("abandoner", "abandoner"),
+    ("restorer", "restorer"),
+    ("changer", "changer"),
+    ("reviewer", "reviewer"),
+)
+
+
+def _account_args(option: str, account: Dict[str, str]) -> List[str]:
+    # the hooks plugin's rendering of an account: "Name (email)"
+    name = account.get("name") or account.get("username", "")
+    if account.get("email"):
+        name = "%s (%s)" % (name, account["email"])
+    args = ["--%s" % option, name]
+    if account.get("username"):
+        args += ["--%s-username" % option, account["username"]]
+    return args
+
+
+def event_to_argv(event: GerritStreamEvent) -> List[str]:
+    """Return the hook command line for a stream event.
+
+    This follows the arguments the hooks plugin passes, so that the
+    result parses into the same ``opts`` through
+    ``GerritHook.main``.
+
+    """
+
+    argv = ["--hook", event["type"]]
+
+    def arg(option: str, value: Any) -> None:
+        if value is not None:
+            argv.extend(["--%s" % option, str(value)])
+
+    change = event.get("change")
+    if change is not None:
+        arg("change", change.get("id"))
+        arg("change-url", change.get("url"))
+        arg("project", change.get("project"))
+        arg("branch", change.get("branch"))
+        arg("topic", change.get("topic"))
+        if change.get("owner"):
+            argv.extend(_account_args("change-owner", change["owner"]))
+
+    patchset = event.get("patchSet")
+    if patchset is not None:
+        arg("commit", patchset.get("revision"))
+        arg("patchset", patchset.get("number"))
+        arg("kind", patchset.get("kind"))
+
+    for attribute, option in _ACCOUNTS:
+        if event.get(attribute):
+            argv.extend(_account_args(option, event[attribute]))
+
+    arg("comment", event.get("comment"))
+    arg("reason", event.get("reason"))
+    arg("newrev", event.get("newRev"))
+    arg("old-topic", event.get("oldTopic"))
+
+    ref_update = event.get("refUpdate")
+    if ref_update is not None:
+        arg("project", ref_update.get("project"))
+        arg("oldrev", ref_update.get("oldRev"))
+        arg("newrev", ref_update.get("newRev"))
+        arg("refname", ref_update.get("refName"))
+
+    for approval in event.get("approvals", ()):
+        arg(approval["type"], approval.get("value"))
+        arg("%s-oldValue" % approval["type"], approval.get("oldValue"))
+
+    return argv
+
+
+def _event_key(event: GerritStreamEvent) -> str:
+    return hashlib.sha256(
+        json.dumps(event, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _partition_key(event: GerritStreamEvent) -> str:
+    change = event.get("change")
+    if change is not None:
+        return "%s %s" % (change.get("project"), change.get("number"))
+    ref_update = event.get("refUpdate")
+    if ref_update is not None:
+        return str(ref_update.get("project"))
+    return event["type"]
+
+
+class GerritEventStream:
+    """Run the stream-events command and dispatch what it prints.
+
+    ``command`` defaults to the ``gerrit_stream_command`` option, a
+    list or a shell-style string, e.g. ``ssh -p 29418
+    bot@gerrit.example.com gerrit stream-events``.  ``workers``
+    defaults to ``gerrit_stream_workers``, or 4.
+
+    """
+
+    reconnect_backoff = (1, 2, 5, 10, 30, 60)
+
+    # how far back a new connection may repeat the one before it
+    replay_window = 100
+
+    def __init__(
+        self,
+        thing: "publishthing.PublishThing",
+        command: Optional[Sequence[str]] = None,
+        workers: Optional[int] = None,
+    ) -> None:
+        self.thing = thing
+        if command is None:
+            command = thing.opts["gerrit_stream_command"]
+        if isinstance(command, str):
+            command = shlex.split(command)
+        self.command = list(command)
+        self.workers = workers or thing.opts.get("gerrit_stream_workers", 4)
+
+        self._stopped = threading.Event()
+        self._process: Optional[subprocess.Popen] = None
+
+        # the last events of the connection, and of the one before it
+        self._recent: Deque[str] = collections.deque(maxlen=self.replay_window)
+        self._replayable: Set[str] = set()
+        self._connection_events = 0
+
+    def stop(self) -> None:
+        self._stopped.set()
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def run(self, max_connections: Optional[int] = None) -> None:
+        """Consume the feed until :meth:`stop`, reconnecting as needed.
+
+        ``max_connections`` stops after the command has been run that
+        many times, mostly for testing.
+
+        """
+
+        workers = KeyedWorkers(self.workers, self._handle)
+        try:
+            connections = 0
+            failures = 0
+            while not self._stopped.is_set():
+                connections += 1
+                received = self._read_stream(workers)
+                if max_connections is not None and (
+                    connections >= max_connections
+                ):
+                    break
+                if self._stopped.is_set():
+                    break
+
+                failures = 0 if received else failures + 1
+                backoff = self.reconnect_backoff[
+                    min(failures, len(self.reconnect_backoff) - 1)
+                ]
+                self.thing.warning(
+                    "gerrit event stream ended; reconnecting in %ss", backoff
+                )
+                self._stopped.wait(backoff)
+        finally:
+            workers.close()
+
+    def _read_stream(self, workers: KeyedWorkers) -> int:
+        received = 0
+        self._replayable = set(self._recent)
+        self._recent.clear()
+        self._connection_events = 0
+        self.thing.debug("gerritstream", "running %s", self.command)
+        process = self._process = subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
+        )
+        assert process.stdout is not None
+        try:
+            for line in process.stdout:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    self.thing.warning(
+                        "gerrit event stream: unparseable line %r", line
+                    )
+                    continue
+
+                received += 1
+                if self._is_new(event):
+                    workers.submit(_partition_key(event), event_to_argv(event))
+        finally:
+            process.stdout.close()
+            process.wait()
+            self._process = None
+        return received
+
+    def _is_new(self, event: GerritStreamEvent) -> bool:
+        key = _event_key(event)
+        self._connection_events += 1
+        self._recent.append(key)
+        if self._connection_events > self.replay_window:
+            return True
+
+        # an exact repeat, early in a new connection, of an event the
+        # last one had
+        if key in self._replayable:
+            self._replayable.discard(key)
+            return False
+        return True
+
+    def _handle(self, argv: List[str]) -> None:
+        try:
+            self.thing.gerrit_hook.main(argv)
+        except Exception:
+            self.thing.warning(
+                "gerrit event %s failed:\n%s", argv[1], traceback.format_exc()
+            )
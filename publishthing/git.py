@@ -1,5 +1,16 @@
+import contextlib
+import fcntl
+import hashlib
 import os
+import random
+import re
+from typing import ContextManager
+from typing import IO
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
 
 from . import gerrit
 from . import publishthing  # noqa
@@ -11,6 +22,13 @@ class GitError(Exception):
     pass
 
 
+def hash_commit(payload: str) -> str:
+    """Return the id git gives a commit object with this content."""
+
+    data = payload.encode("utf-8")
+    return hashlib.sha1(b"commit %d\0" % len(data) + data).hexdigest()
+
+
 class GitRepo:
     was_created = False
 
@@ -22,19 +40,51 @@ class GitRepo:
         origin: Optional[str] = None,
         bare: bool = False,
         create: bool = False,
+        filter_: Optional[str] = None,
+        depth: Optional[int] = None,
+        shallow_since: Optional[str] = None,
+        reference: Optional[str] = None,
+        dissociate: bool = False,
     ) -> None:
+        """``filter_``, e.g. "blob:none", makes the clone a partial
+        clone, and is the default for :meth:`fetch`.  ``depth`` or
+        ``shallow_since`` make the clone shallow; they're for the clone
+        only, as a later fetch with them would cut away history that's
+        already there.  A shallow clone may not reach back to where a
+        branch split off; see :meth:`deepen_to_merge_base`.
+
+        ``reference`` is a local repository, typically a mirror, to
+        borrow objects from through objects/info/alternates, so that
+        they're stored once for any number of clones.  A repository
+        that's already there starts borrowing too.  With ``dissociate``,
+        the objects are only borrowed for the length of the clone, and a
+        repository that borrows them gets copies of its own.
+
+        """
         self.thing = thing
         self.origin = origin
         self.shell = shell
         self.local_name = local_name
         self.bare = bare
         self.create = create
+        self.filter_ = filter_
+        self.depth = depth
+        self.shallow_since = shallow_since
+        self._check_shallow_args(depth, shallow_since)
+        self.reference = reference
         if not self._ensure():
             if create:
-                self._create()
+                if reference is not None and not dissociate:
+                    self._protect_lender()
+                self._create(dissociate)
                 self.was_created = True
             else:
                 raise GitError("No git repository at %s" % self.shell.path)
+        elif reference is not None:
+            if dissociate:
+                self.dissociate()
+            else:
+                self._borrow_objects()
 
     def checkout(
         self, branchname: str, detached: Optional[bool] = False
@@ -48,14 +98,141 @@ class GitRepo:
         with self.checkout_shell() as shell:
             shell.call_shell_cmd("git", "pull")
 
-    def fetch(self, all_: bool = False) -> None:
+    def fetch(
+        self,
+        all_: bool = False,
+        refspecs: Sequence[str] = (),
+        repository: str = "origin",
+        depth: Optional[int] = None,
+        shallow_since: Optional[str] = None,
+        filter_: Optional[str] = None,
+    ) -> None:
+        """Fetch from every remote, or just ``refspecs`` from one.
+
+        ``filter_`` defaults to what the repository was created with.
+        ``depth`` or ``shallow_since``, one or the other, set a new
+        shallow boundary; without them, a shallow repository keeps the
+        one it has.
+
+        """
+        self._check_shallow_args(depth, shallow_since)
         with self.cmd_shell() as shell:
             cmd = ["git", "fetch"]
-            if all:
+            cmd += self._history_args(
+                depth, shallow_since, filter_ or self.filter_
+            )
+            if all_:
                 cmd += ["--all"]
+            elif refspecs:
+                cmd += [repository] + list(refspecs)
 
             shell.call_shell_cmd(*cmd)
 
+    @staticmethod
+    def branch_refspec(branch: str, repository: str = "origin") -> str:
+        return "+refs/heads/%s:refs/remotes/%s/%s" % (
+            branch,
+            repository,
+            branch,
+        )
+
+    @staticmethod
+    def pull_request_refspec(number: int, local_ref: str) -> str:
+        return "+refs/pull/%s/head:%s" % (number, local_ref)
+
+    def fetch_branch(self, branch: str, repository: str = "origin") -> None:
+        """Update the remote-tracking ref for one branch, and only that."""
+
+        self.fetch(
+            refspecs=[self.branch_refspec(branch, repository)],
+            repository=repository,
+        )
+
+    def fetch_pull_request(
+        self, number: int, local_ref: str, repository: str = "origin"
+    ) -> None:
+        """Fetch a github pull request's head to ``local_ref``.
+
+        This is the ``refs/pull/<number>/head`` ref github keeps in the
+        repository the pull request is against, so the repository it
+        came from isn't needed.
+
+        """
+        self.fetch(
+            refspecs=[self.pull_request_refspec(number, local_ref)],
+            repository=repository,
+        )
+
+    @property
+    def is_shallow(self) -> bool:
+        return os.path.exists(os.path.join(self._git_common_path, "shallow"))
+
+    def merge_base(self, rev: str, other: str) -> Optional[str]:
+        with self.cmd_shell() as shell:
+            return shell.output_shell_cmd(  # type: ignore
+                "git", "merge-base", rev, other, none_for_error=True
+            )
+
+    # commits to deepen a shallow repository by at a time, before giving
+    # up and fetching all of the history
+    _deepen_steps = (100, 1000)
+
+    def deepen_to_merge_base(
+        self,
+        rev: str,
+        other: str,
+        refspecs: Sequence[str],
+        repository: str = "origin",
+    ) -> str:
+        """Return the merge base of two revisions, fetching history for it.
+
+        In a shallow repository the merge base can be past the shallow
+        boundary; history for ``refspecs`` is then deepened a step at a
+        time, and in full as a last resort.  :class:`GitError` is raised
+        if the revisions have no history in common even so.
+
+        """
+        deepen_args = ["--deepen=%d" % step for step in self._deepen_steps]
+        for deepen_arg in deepen_args + ["--unshallow"]:
+            merge_base = self.merge_base(rev, other)
+            if merge_base is not None or not self.is_shallow:
+                break
+            with self.cmd_shell() as shell:
+                shell.call_shell_cmd(
+                    "git", "fetch", deepen_arg, repository, *refspecs
+                )
+        else:
+            merge_base = self.merge_base(rev, other)
+
+        if merge_base is None:
+            raise GitError(
+                "%s and %s have no history in common" % (rev, other)
+            )
+        return merge_base
+
+    @staticmethod
+    def _check_shallow_args(
+        depth: Optional[int], shallow_since: Optional[str]
+    ) -> None:
+        # git refuses --depth along with --shallow-since
+        if depth and shallow_since:
+            raise GitError("Only one of depth and shallow_since can be given")
+
+    @staticmethod
+    def _history_args(
+        depth: Optional[int] = None,
+        shallow_since: Optional[str] = None,
+        filter_: Optional[str] = None,
+    ) -> List[str]:
+        args = []
+        if depth:
+            args += ["--depth", str(depth)]
+        if shallow_since:
+            args += ["--shallow-since", shallow_since]
+        if filter_:
+            args += ["--filter", filter_]
+        return args
+
     def create_branch(self, branchname: str, force: bool = False) -> None:
         self._assert_not_bare()
         with self.shell.shell_in(self.local_name) as shell:
@@ -81,13 +258,21 @@ class GitRepo:
         git_email: str,
         git_remote_username: str,
         git_remote_password: str,
+        rev: Optional[str] = None,
     ) -> None:
+        """Set up for pushing to gerrit.
+
+        The .gitreview file is read from the checkout, or from ``rev``
+        if given, in which case the checkout isn't needed.
+
+        """
         self.gerrit = gerrit.GerritGit(
             self,
             git_identity,
             git_email,
             git_remote_username,
             git_remote_password,
+            rev=rev,
         )
 
     def _assert_not_bare(self) -> None:
@@ -97,12 +282,45 @@ class GitRepo:
                 "file operations cannot be performed" % self._git_bare_path
             )
 
+    @util.memoized_property
+    def worktrees(self) -> "WorktreePool":
+        """Working trees to do checkout work in, one job at a time each.
+
+        There are ``git_worktree_pool_size`` of them, 4 by default.
+
+        """
+        return WorktreePool(
+            self, self.thing.opts.get("git_worktree_pool_size", 4)
+        )
+
     @util.memoized_property
     def _git_bare_path(self) -> str:
         if self.bare:
             return os.path.join(self.shell.path, self.local_name)
-        else:
-            return os.path.join(self.shell.path, self.local_name, ".git")
+
+        path = os.path.join(self.shell.path, self.local_name, ".git")
+
+        # in a worktree, .git is a file naming the git directory
+        if os.path.isfile(path):
+            with open(path) as f:
+                content = f.read().strip()
+            if content.startswith("gitdir: "):
+                path = os.path.normpath(
+                    os.path.join(os.path.dirname(path), content[8:])
+                )
+        return path
+
+    @util.memoized_property
+    def _git_common_path(self) -> str:
+        # where a worktree finds the refs and objects it shares with the
+        # repository it was added to
+        commondir = os.path.join(self._git_bare_path, "commondir")
+        if not os.path.isfile(commondir):
+            return self._git_bare_path
+        with open(commondir) as f:
+            return os.path.normpath(
+                os.path.join(self._git_bare_path, f.read().strip())
+            )
 
     def _ensure_looks_like_git(self, path: str) -> None:
         for dirname in "refs", "objects":
@@ -116,10 +334,120 @@ class GitRepo:
         if not os.path.exists(self._git_bare_path):
             return False
 
-        self._ensure_looks_like_git(self._git_bare_path)
+        self._ensure_looks_like_git(self._git_common_path)
         return True
 
-    def _create(self) -> None:
+    @util.memoized_property
+    def _lender_objects_path(self) -> str:
+        assert self.reference is not None
+        path = os.path.abspath(self.reference)
+        for objects in (
+            os.path.join(path, "objects"),
+            os.path.join(path, ".git", "objects"),
+        ):
+            if os.path.isdir(objects):
+                return objects
+        raise GitError(
+            "Reference repository %s has no objects directory" % path
+        )
+
+    @util.memoized_property
+    def _alternates_path(self) -> str:
+        return os.path.join(
+            self._git_common_path, "objects", "info", "alternates"
+        )
+
+    def _protect_lender(self) -> None:
+        # objects the reference no longer needs can be all that a
+        # borrower has of them, so it must never prune them.  this
+        # is what keeps the git gc, auto or not, of the mirror safe
+        lender = os.path.dirname(self._lender_objects_path)
+        with self.shell.shell_out(lender) as shell:
+            prune_expire = shell.output_shell_cmd(
+                "git", "config", "--get", "gc.pruneExpire", none_for_error=True
+            )
+            if prune_expire != "never":
+                shell.call_shell_cmd(
+                    "git", "config", "gc.pruneExpire", "never"
+                )
+
+    def _borrows_from_lender(self) -> bool:
+        if not os.path.exists(self._alternates_path):
+            return False
+        with open(self._alternates_path) as f:
+            return self._lender_objects_path in (line.strip() for line in f)
+
+    @contextlib.contextmanager
+    def _locked(self, name: str) -> Iterator[None]:
+        # imports for one project run at the same time, in threads and
+        # in processes; an flock on a file in the git directory lets one
+        # of them at a time at what git itself would refuse to share
+        with open(
+            os.path.join(self._git_common_path, "publishthing-%s.lock" % name),
+            "a",
+        ) as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _objects_lock(self) -> ContextManager[None]:
+        # only one of them changes the alternates and repacks
+        return self._locked("objects")
+
+    def fetch_lock(self) -> ContextManager[None]:
+        """Hold the repository's refs, and shallow boundary, for a fetch.
+
+        Concurrent fetches into one repository that update the same
+        refs, or move the shallow boundary, fail on git's own locks
+        rather than wait; the fetches of one import are made under this,
+        so that imports for the same project wait on each other instead.
+
+        """
+
+        return self._locked("fetch")
+
+    def _borrow_objects(self) -> None:
+        # the usual case, already borrowing, costs a file read
+        if self._borrows_from_lender():
+            return
+
+        with self._objects_lock():
+            if self._borrows_from_lender():
+                return
+
+            self._protect_lender()
+            os.makedirs(os.path.dirname(self._alternates_path), exist_ok=True)
+            with open(self._alternates_path, "a") as f:
+                f.write("%s\n" % self._lender_objects_path)
+
+            # drop the copies of what the reference has; from here on,
+            # git only stores what the reference doesn't
+            self.repack(local=True)
+
+    def dissociate(self) -> None:
+        """Stop borrowing objects, copying in the ones borrowed."""
+
+        if not os.path.exists(self._alternates_path):
+            return
+        with self._objects_lock():
+            if not os.path.exists(self._alternates_path):
+                return
+            self.repack()
+            os.unlink(self._alternates_path)
+
+    def repack(self, local: bool = False) -> None:
+        """Repack into one pack.
+
+        With ``local``, objects that can be borrowed from a reference
+        repository are left out; otherwise they're copied in.
+
+        """
+        args = ["git", "repack", "-a", "-d", "-q"]
+        if local:
+            args += ["-l"]
+        with self.cmd_shell() as shell:
+            shell.call_shell_cmd(*args)
+
+    def _create(self, dissociate: bool = False) -> None:
         if not os.path.exists(self.checkout_location):
             if not os.path.exists(self.shell.path):
                 raise GitError(
@@ -130,6 +458,13 @@ class GitRepo:
             args = ["git", "clone", self.origin, self.local_name]
             if self.bare:
                 args.append("--bare")
+            args += self._history_args(
+                self.depth, self.shallow_since, self.filter_
+            )
+            if self.reference is not None:
+                args += ["--reference", self.reference]
+                if dissociate:
+                    args.append("--dissociate")
             self.shell.call_shell_cmd(*args)
 
     def set_identity(self, git_identity: str, git_email: str) -> None:
@@ -176,6 +511,13 @@ class GitRepo:
         with self.cmd_shell() as shell:
             shell.call_shell_cmd(*args)
 
+    def merge(self, rev: str, squash: bool = False) -> None:
+        args = ["git", "merge", rev]
+        if squash:
+            args += ["--squash"]
+        with self.checkout_shell() as shell:
+            shell.call_shell_cmd(*args)
+
     def reset(self, hard: bool = False) -> None:
         args = ["git", "reset"]
         if hard:
@@ -183,15 +525,103 @@ class GitRepo:
         with self.cmd_shell() as shell:
             shell.call_shell_cmd(*args)
 
+    def rev_parse(self, rev: str) -> str:
+        with self.cmd_shell() as shell:
+            return shell.output_shell_cmd("git", "rev-parse", rev)
+
+    def show_file(self, rev: str, path: str) -> str:
+        """Return the content of a file as of ``rev``."""
+
+        with self.cmd_shell() as shell:
+            return shell.output_shell_cmd("git", "show", "%s:%s" % (rev, path))
+
+    @util.memoized_property
+    def can_merge_tree(self) -> bool:
+        """Whether git is new enough for :meth:`merge_tree`, 2.38 or later."""
+
+        with self.cmd_shell() as shell:
+            version = shell.output_shell_cmd("git", "version")
+        match = re.search(r"(\d+)\.(\d+)", version)
+        return match is not None and (
+            int(match.group(1)),
+            int(match.group(2)),
+        ) >= (2, 38)
+
+    def merge_tree(self, base: str, head: str) -> str:
+        """Merge ``head`` into ``base`` and return the resulting tree.
+
+        The merge happens in the object database only, so unlike
+        :meth:`pull` it leaves the checkout alone, and any number can run
+        at once.  A conflict raises :class:`GitError`.
+
+        """
+
+        with self.cmd_shell() as shell:
+            try:
+                output = shell.output_shell_cmd(
+                    "git", "merge-tree", "--write-tree", base, head
+                )
+            except _shell.CalledProcessError as err:
+                # exit status 1 is a conflict; anything else is an error
+                if err.returncode != 1:
+                    raise
+                raise GitError(
+                    "Merging %s into %s conflicts:\n%s"
+                    % (head, base, err.output)
+                ) from err
+        # the first line is the tree; any more are informational
+        return str(output.split("\n")[0])
+
+    def commit_tree(
+        self,
+        tree: str,
+        parents: Sequence[str],
+        comment: str,
+        author: Optional[str] = None,
+    ) -> str:
+        """Write a commit of ``tree`` and return it, touching no branch.
+
+        ``author`` is in the "Name <email>" form that :meth:`commit`
+        takes.
+
+        """
+
+        args = ["git", "commit-tree", tree, "-m", comment]
+        for parent in parents:
+            args += ["-p", parent]
+        env = None
+        if author:
+            name, email = self._parse_ident(author)
+            env = {"GIT_AUTHOR_NAME": name, "GIT_AUTHOR_EMAIL": email}
+        with self.cmd_shell() as shell:
+            return str(shell.output_shell_cmd(*args, env=env))
+
+    @staticmethod
+    def _parse_ident(ident: str) -> Tuple[str, str]:
+        match = re.match(r"^\s*(.*?)\s*<(.*)>\s*$", ident)
+        if not match:
+            raise GitError("Can't parse git identity %r" % ident)
+        return match.group(1), match.group(2)
+
+    def read_author(self, rev: str) -> str:
+        """Return the author of a commit as "Name <email>"."""
+
+        with self.cmd_shell() as shell:
+            return str(
+                shell.output_shell_cmd(
+                    "git", "log", "-1", "--format=%an <%ae>", rev
+                )
+            )
+
     def read_author_from_squash_pull(self) -> str:
-        with self.checkout_shell() as shell:
-            with shell.open(".git/SQUASH_MSG") as f:
-                for line in f:
-                    if line.startswith("Author:"):
-                        author = line[8:]
-                        return author
-                else:
-                    raise Exception("could not determine author for PR.")
+        self._assert_not_bare()
+        with open(os.path.join(self._git_bare_path, "SQUASH_MSG")) as f:
+            for line in f:
+                if line.startswith("Author:"):
+                    author = line[8:]
+                    return author
+            else:
+                raise Exception("could not determine author for PR.")
 
     def commit(
         self, comment: str, author: Optional[str] = None, amend: bool = False
@@ -204,3 +634,83 @@ class GitRepo:
             args += ["--amend"]
         with self.checkout_shell() as shell:
             shell.call_shell_cmd(*args)
+
+
+class WorktreePool:
+    """A fixed set of ``git worktree`` checkouts of one repository.
+
+    Each slot shares the repository's object store, so it costs a
+    checkout rather than a clone.  A slot is held under an flock for
+    the length of a job, which keeps other threads and processes off it,
+    and is reset and cleaned when it's returned.  The slots live next to
+    the repository, in ``<local_name>.worktrees/``.
+
+    """
+
+    def __init__(self, repo: GitRepo, size: int) -> None:
+        self.repo = repo
+        self.size = size
+        self.dirname = "%s.worktrees" % repo.local_name
+        self.path = os.path.join(repo.shell.path, self.dirname)
+
+    @contextlib.contextmanager
+    def checkout(self, rev: str) -> Iterator[GitRepo]:
+        """Hold a slot with ``rev`` checked out, detached."""
+
+        os.makedirs(self.path, exist_ok=True)
+        slot, lock = self._acquire()
+        try:
+            worktree = self._prepare(slot, rev)
+            try:
+                yield worktree
+            finally:
+                self._clean(worktree)
+        finally:
+            lock.close()
+
+    def _acquire(self) -> Tuple[str, IO[str]]:
+        slots = ["slot-%d" % num for num in range(self.size)]
+        for slot in slots:
+            lock = open(os.path.join(self.path, "%s.lock" % slot), "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+            else:
+                return slot, lock
+
+        # all out; wait on one
+        slot = random.choice(slots)
+        lock = open(os.path.join(self.path, "%s.lock" % slot), "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return slot, lock
+
+    def _prepare(self, slot: str, rev: str) -> GitRepo:
+        slot_path = os.path.join(self.path, slot)
+        added = not os.path.exists(os.path.join(slot_path, ".git"))
+        if added:
+            # prune would drop a slot another process is adding
+            with self.repo._locked("worktrees"):
+                with self.repo.cmd_shell() as shell:
+                    # drop what git knows of a slot whose directory is gone
+                    shell.call_shell_cmd("git", "worktree", "prune")
+                    shell.call_shell_cmd(
+                        "git", "worktree", "add", "--detach", slot_path, rev
+                    )
+
+        worktree = GitRepo(
+            self.repo.thing,
+            self.repo.shell.shell_in(self.dirname),
+            slot,
+            origin=self.repo.origin,
+        )
+        if not added:
+            worktree.checkout(rev, detached=True)
+        return worktree
+
+    def _clean(self, worktree: GitRepo) -> None:
+        with worktree.checkout_shell() as shell:
+            shell.call_shell_cmd("git", "reset", "-q", "--hard")
+            shell.call_shell_cmd("git", "clean", "-q", "-fdx")
+            # let go of any branch, which only one worktree can have
+            shell.call_shell_cmd("git", "checkout", "-q", "--detach")
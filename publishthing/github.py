@@ -1,96 +1,112 @@
+import asyncio
+import collections
+from concurrent import futures
+import functools
 import hmac
+import itertools
 import json
 import re
-import time
+import threading
 from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import ContextManager
 from typing import Dict
+from typing import Iterable
 from typing import Iterator
 from typing import List
+from typing import NamedTuple
 from typing import Optional
 from typing import Tuple
+from urllib.parse import parse_qsl
 from urllib.parse import quote
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
 
 import requests
 
 from . import publishthing  # noqa
+from . import ratelimit
 from . import wsgi  # noqa
 from .util import Hooks
+from .util import memoized_property
 
 GithubJsonRec = Dict[str, Any]
 
 
-class GithubRepo:
-    _last_push_time = 0.0
-    _rate_limit = None
+class PrefetchedRecords(NamedTuple):
+    """What :meth:`.GithubRepo.prefetch_issues` loaded, for its caller.
+
+    Issue records by number as a string, None for a number with no
+    issue behind it, and permission records by username; both in the
+    shapes the REST calls give.
+
+    """
 
+    issues: Dict[str, Optional[GithubJsonRec]]
+    permissions: Dict[str, GithubJsonRec]
+
+
+class GithubRepo:
     def __init__(self, thing: "publishthing.PublishThing", repo: str) -> None:
         self.thing = thing
         self.repo = repo
         self.url = "https://github.com/%s" % repo
-        self.access_token = thing.opts["github_access_token"]
+        self.auth = thing.github_auth
         self.concurrency = thing.opts.get("github_api_concurrency", 1)
+        self.rate_limit_block = thing.opts.get("github_rate_limit_block", True)
+        self.rate_limit_max_wait = thing.opts.get("github_rate_limit_max_wait")
+
         self.session = requests.Session()
+        self.session.mount(
+            "https://api.github.com/", thing.github_http_adapter
+        )
         self.session.hooks["response"].append(self._update_rate_limit)
 
-    def _update_rate_limit(self, resp: Any, *args: Any, **kw: Any) -> None:
-        if "X-RateLimit-Limit" not in resp.headers:
-            return
+    @memoized_property
+    def auth_identity(self) -> str:
+        """Who we are to github, for keying pacing and caching on.
 
-        now = time.time()
-        if self._rate_limit is None or now - self._rate_limit["last"] > 60:
-            self._rate_limit = {
-                "limit": int(resp.headers["X-RateLimit-Limit"]),
-                "remaining": int(resp.headers["X-RateLimit-Remaining"]),
-                "reset": int(resp.headers["X-RateLimit-Reset"]),
-                "last": time.time(),
-            }
+        A personal token, or a GitHub App installation; not the
+        installation token itself, which changes hourly.
 
-            if self._rate_limit["remaining"] <= 100:
-                self.thing.warning(
-                    "WARNING!  Only {} API calls left for the next {} "
-                    "seconds; going to wait that many seconds...".format(
-                        self._rate_limit["remaining"],
-                        self._rate_limit["reset"] - self._rate_limit["last"],
-                    )
-                )
-                seconds = self._rate_limit["reset"] - self._rate_limit["last"]
-                while seconds > 0:
-                    self.thing.message(
-                        "Sleeping....{} seconds remaining".format(seconds)
-                    )
-                    time.sleep(30)
-                    seconds -= 30
-                self.thing.message("OK done sleeping, let's hope it reset")
-                # return so the next API call will come back here and
-                # update rate limit again
-                return
+        """
 
-            self._rate_limit["rate_per_sec"] = self._rate_limit[
-                "remaining"
-            ] / (self._rate_limit["reset"] - self._rate_limit["last"])
-
-            self.thing.message(
-                "Refreshed github rate limit.  {} requests out "
-                "of {} remaining, until {} seconds from now.   Will run "
-                "API calls at {} requests per second".format(
-                    self._rate_limit["remaining"],
-                    self._rate_limit["limit"],
-                    self._rate_limit["reset"] - self._rate_limit["last"],
-                    self._rate_limit["rate_per_sec"],
-                )
-            )
+        return self.auth.identity(self.repo)
+
+    @memoized_property
+    def rate_limiter(self) -> ratelimit.RateLimiter:
+        # pacing is per identity, not per GithubRepo.  a webhook app sets
+        # github_rate_limit_block=False so that a request is refused
+        # rather than parked until the budget resets.
+        return ratelimit.limiter_for(
+            self.auth_identity,
+            reserve=self.thing.opts.get("github_rate_limit_reserve", 100),
+            state_dir=self.thing.opts.get("github_rate_limit_dir"),
+        )
 
-    def _wait_for_api(self) -> None:
-        if self._rate_limit is None:
-            return
-        now = time.time()
-        if self._last_push_time:
-            time_passed = now - self._last_push_time
-            delay = 1 / self._rate_limit["rate_per_sec"]
-            sleep_for = delay - time_passed
-            if sleep_for > 0:
-                time.sleep(sleep_for)
-        self._last_push_time = time.time()
+    def _auth_headers(self) -> Dict[str, str]:
+        return {"Authorization": "token %s" % self.auth.token(self.repo)}
+
+    def _update_rate_limit(self, resp: Any, *args: Any, **kw: Any) -> None:
+        self.rate_limiter.update(resp.headers)
+
+    def _api_claim(self) -> ContextManager[None]:
+        return self.rate_limiter.claim(
+            block=self.rate_limit_block,
+            max_wait=self.rate_limit_max_wait,
+            on_wait=self._warn_rate_limit_wait,
+        )
+
+    def _warn_rate_limit_wait(self, seconds: float) -> None:
+        if seconds > 5:
+            self.thing.warning(
+                "WARNING!  Pacing github API calls for %s; waiting %d "
+                "seconds...",
+                self.repo,
+                seconds,
+            )
 
     def _api_get(
         self,
@@ -98,11 +114,36 @@ class GithubRepo:
         headers: Optional[Dict[str, str]] = None,
         return_none_for_404=False,
     ) -> requests.Response:
-        self._wait_for_api()
-        _headers = {"Authorization": "token %s" % self.access_token}
+        _headers = self._auth_headers()
         if headers:
             _headers.update(headers)
-        resp = self.session.get(url, headers=_headers)
+
+        http_cache = self.thing.http_cache
+        key = http_cache.key(
+            "github",
+            self.repo,
+            self.auth_identity,
+            url,
+            _headers.get("Accept", ""),
+        )
+
+        def send(validators: Dict[str, str]) -> requests.Response:
+            # only a request that goes out is paced; an answer from the
+            # cache costs nothing
+            with self._api_claim():
+                return self.session.get(
+                    url, headers=dict(_headers, **validators)
+                )
+
+        def get() -> requests.Response:
+            # a 304 costs nothing against the rate limit, so every GET
+            # goes out with whatever validators we have for it.
+            return http_cache.conditional_get(key, url, send)
+
+        # a burst of webhook deliveries for one pull request has several
+        # handlers asking for the same thing at once; they share one
+        # request, and each parses the response body for itself.
+        resp = self.thing.inflight.do(key, get)
         if resp.status_code != 200:
             if return_none_for_404 and resp.status_code == 404:
                 return None
@@ -115,12 +156,12 @@ class GithubRepo:
         return resp
 
     def _api_post(self, url: str, rec: GithubJsonRec) -> requests.Response:
-        self._wait_for_api()
-        resp = self.session.post(
-            url,
-            headers={"Authorization": "token %s" % self.access_token},
-            json=rec,
-        )
+        with self._api_claim():
+            resp = self.session.post(
+                url,
+                headers=self._auth_headers(),
+                json=rec,
+            )
         if resp.status_code > 299:
             raise Exception(
                 "Got response %s for %s: %s"
@@ -130,12 +171,12 @@ class GithubRepo:
         return resp
 
     def _api_patch(self, url: str, rec: GithubJsonRec) -> requests.Response:
-        self._wait_for_api()
-        resp = self.session.patch(
-            url,
-            headers={"Authorization": "token %s" % self.access_token},
-            json=rec,
-        )
+        with self._api_claim():
+            resp = self.session.patch(
+                url,
+                headers=self._auth_headers(),
+                json=rec,
+            )
         if resp.status_code > 299:
             raise Exception(
                 "Got response %s for %s: %s"
@@ -147,11 +188,11 @@ class GithubRepo:
     def _api_delete(
         self, url: str, ignore_404: bool = False
     ) -> Optional[requests.Response]:
-        self._wait_for_api()
-        resp = self.session.delete(
-            url,
-            headers={"Authorization": "token %s" % self.access_token},
-        )
+        with self._api_claim():
+            resp = self.session.delete(
+                url,
+                headers=self._auth_headers(),
+            )
         if resp.status_code > 299:
             if ignore_404 and resp.status_code == 404:
                 return None
@@ -163,6 +204,136 @@ class GithubRepo:
 
         return resp
 
+    def _api_graphql(
+        self, query: str, variables: Dict[str, Any]
+    ) -> Tuple[GithubJsonRec, List[GithubJsonRec]]:
+        """Run a graphql query, returning its data and its errors.
+
+        GraphQL reports a missing object as an error alongside the rest
+        of the data rather than failing the request, so the errors are
+        the caller's to sort through.
+
+        """
+
+        resp = self._api_post(
+            "https://api.github.com/graphql",
+            rec={"query": query, "variables": variables},
+        )
+        result = resp.json()
+        return result.get("data") or {}, result.get("errors") or []
+
+    # github's REST API reports permissions in the older vocabulary
+    _GRAPHQL_PERMISSIONS = {
+        "ADMIN": "admin",
+        "MAINTAIN": "write",
+        "WRITE": "write",
+        "TRIAGE": "read",
+        "READ": "read",
+    }
+
+    _prefetch_limit = 50
+
+    def prefetch_issues(
+        self, issue_numbers: Iterable[int], username: Optional[str] = None
+    ) -> PrefetchedRecords:
+        """Load several issues, and a user's permission, in one request.
+
+        The caller looks up what it needs in the records returned,
+        instead of making a :meth:`get_issue` or
+        :meth:`get_user_permission` round trip for each.  Nothing is
+        kept here, so the records can't go stale for a later caller.  If
+        the graphql request fails, nothing is loaded and the caller goes
+        to the REST API as usual.
+
+        """
+
+        prefetched = PrefetchedRecords({}, {})
+        numbers = list(dict.fromkeys(int(n) for n in issue_numbers))[
+            0 : self._prefetch_limit
+        ]
+        if not numbers and username is None:
+            return prefetched
+
+        owner, name = self.repo.split("/")
+        fields = [
+            "i%d: issueOrPullRequest(number: %d) { __typename "
+            "... on Issue { number state labels(first: 100) "
+            "{ nodes { name } } } "
+            "... on PullRequest { number state url } }" % (number, number)
+            for number in numbers
+        ]
+        if username is not None:
+            fields.append(
+                "collaborators(query: $login, first: 10) "
+                "{ edges { permission node { login } } }"
+            )
+        # graphql refuses a declared variable that isn't used, so $login
+        # is only there along with the collaborators field
+        declarations = ["$owner: String!", "$name: String!"]
+        variables = {"owner": owner, "name": name}
+        if username is not None:
+            declarations.append("$login: String!")
+            variables["login"] = username
+        query = (
+            "query(%s) { repository(owner: $owner, name: $name) { %s } }"
+            % (
+                ", ".join(declarations),
+                " ".join(fields),
+            )
+        )
+
+        try:
+            data, errors = self._api_graphql(query, variables)
+        except Exception as err:
+            self.thing.debug(
+                "github", "graphql prefetch failed for %s: %s", self.repo, err
+            )
+            return prefetched
+
+        # a number with no issue behind it is a NOT_FOUND error on its
+        # own alias; anything else means we can't trust what came back
+        for error in errors:
+            if error.get("type") != "NOT_FOUND":
+                self.thing.debug(
+                    "github",
+                    "graphql prefetch for %s returned an error: %s",
+                    self.repo,
+                    error,
+                )
+                return prefetched
+
+        repository = data.get("repository") or {}
+        for number in numbers:
+            node = repository.get("i%d" % number)
+            if node is None:
+                prefetched.issues[str(number)] = None
+                continue
+
+            state = node["state"].lower()
+            rec: GithubJsonRec = {
+                "number": node["number"],
+                "state": "closed" if state == "merged" else state,
+                "labels": (node.get("labels") or {}).get("nodes") or [],
+            }
+            if node["__typename"] == "PullRequest":
+                rec["pull_request"] = {"html_url": node["url"]}
+            prefetched.issues[str(number)] = rec
+
+        # the collaborators query is a search on login and name, and the
+        # exact login can be past the first ten hits; with no exact
+        # match the user is left out, for get_user_permission to look up
+        if username is not None and "collaborators" in repository:
+            for edge in repository["collaborators"]["edges"]:
+                if edge["node"]["login"].lower() == username.lower():
+                    prefetched.permissions[username] = {
+                        "permission": self._GRAPHQL_PERMISSIONS.get(
+                            edge["permission"], "read"
+                        ),
+                        "user": {"login": username},
+                    }
+                    break
+        return prefetched
+
     def get_user_permission(self, username) -> GithubJsonRec:
         url = "https://api.github.com/repos/%s/collaborators/%s/permission" % (
             self.repo,
@@ -355,6 +526,15 @@ class GithubRepo:
         )
         self._api_post(url, rec=comment_rec)
 
+    def get_combined_status(self, sha: str) -> GithubJsonRec:
+        """Return the latest status for each context on a commit."""
+
+        url = (
+            "https://api.github.com/repos/%s/commits/%s/status?per_page=100"
+            % (self.repo, sha)
+        )
+        return self._api_get(url).json()
+
     def create_status(
         self,
         sha: str,
@@ -405,7 +585,32 @@ class GithubRepo:
         )
         self._api_patch(url, rec={"state": "closed" if closed else "open"})
 
-    def _yield_with_links(self, url: Optional[str]) -> Iterator[GithubJsonRec]:
+    def _yield_with_links(
+        self,
+        url: Optional[str],
+        parallel: bool = True,
+        read_ahead: bool = False,
+    ) -> Iterator[GithubJsonRec]:
+        """Yield the records of every page of a listing, in page order.
+
+        Once the first page says how many there are, the remaining pages
+        are fetched up to ``github_api_concurrency`` at a time.  Pass
+        ``parallel=False`` for listings whose pages shift while being
+        read, such as anything sorted by "updated"; those are followed
+        one "next" link at a time.
+
+        ``read_ahead=True`` follows the links one at a time as well, but
+        starts downloading the next page as soon as the current one
+        arrives, so the network overlaps with whatever the consumer does
+        with each record.  It costs one wasted request for a consumer
+        that stops early, so it's for listings that get read through.
+
+        """
+
+        if read_ahead:
+            yield from self._yield_reading_ahead(url)
+            return
+
         while url is not None:
             resp = self._api_get(url)
             next_ = resp.links.get("next")
@@ -416,6 +621,84 @@ class GithubRepo:
             for rec in resp.json():
                 yield rec
 
+            if url is not None and parallel and self.concurrency > 1:
+                page_urls = self._page_urls(url, resp.links.get("last"))
+                if page_urls:
+                    yield from self._yield_pages_concurrently(page_urls)
+                    return
+
+    def _yield_reading_ahead(
+        self, url: Optional[str]
+    ) -> Iterator[GithubJsonRec]:
+        # the next link isn't known until a page arrives, so one page
+        # ahead is as far as this can get
+        executor = futures.ThreadPoolExecutor(1)
+        try:
+            pending = (
+                executor.submit(self._api_get, url)
+                if url is not None
+                else None
+            )
+            while pending is not None:
+                resp = pending.result()
+                next_ = resp.links.get("next")
+                if next_:
+                    pending = executor.submit(self._api_get, next_["url"])
+                else:
+                    pending = None
+                yield from resp.json()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _page_urls(
+        self, next_url: str, last: Optional[Dict[str, str]]
+    ) -> Optional[List[str]]:
+        """Spell out every page from ``next_url`` through the last one.
+
+        Returns None if the links don't number their pages, in which
+        case they can only be followed one at a time.
+
+        """
+
+        if last is None:
+            return None
+        next_parts = urlsplit(next_url)
+        next_query = dict(parse_qsl(next_parts.query))
+        last_query = dict(parse_qsl(urlsplit(last["url"]).query))
+        try:
+            first_page = int(next_query["page"])
+            last_page = int(last_query["page"])
+        except (KeyError, ValueError):
+            return None
+
+        return [
+            urlunsplit(
+                next_parts._replace(
+                    query=urlencode(dict(next_query, page=str(page)))
+                )
+            )
+            for page in range(first_page, last_page + 1)
+        ]
+
+    def _yield_pages_concurrently(
+        self, page_urls: List[str]
+    ) -> Iterator[GithubJsonRec]:
+        executor = futures.ThreadPoolExecutor(self.concurrency)
+        pending: "collections.deque[futures.Future[requests.Response]]" = (
+            collections.deque()
+        )
+        try:
+            for page_url in page_urls:
+                pending.append(executor.submit(self._api_get, page_url))
+                if len(pending) >= self.concurrency:
+                    yield from pending.popleft().result().json()
+            while pending:
+                yield from pending.popleft().result().json()
+        finally:
+            # a consumer that stops early shouldn't wait on pages it
+            # will never read
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def get_comments_since(
         self, last_received: Optional[str]
     ) -> Iterator[GithubJsonRec]:
@@ -430,7 +713,10 @@ class GithubRepo:
             url = "%s&since=%s" % (url, last_received)
 
         idx = 1
-        for idx, comment in enumerate(self._yield_with_links(url), idx):
+        for idx, comment in enumerate(
+            self._yield_with_links(url, parallel=False, read_ahead=True),
+            idx,
+        ):
             if idx % 100 == 0:
                 print("received %s comments" % idx)
             match = re.match(r".*/issues/(\d+)$", comment["issue_url"])
@@ -455,7 +741,10 @@ class GithubRepo:
             url = "%s&since=%s" % (url, last_received)
 
         idx = 1
-        for idx, issue in enumerate(self._yield_with_links(url), idx):
+        for idx, issue in enumerate(
+            self._yield_with_links(url, parallel=False, read_ahead=True),
+            idx,
+        ):
             if idx % 100 == 0:
                 print("received %s issues" % idx)
             yield issue
@@ -511,6 +800,236 @@ class GithubRepo:
             yield filename, abs_
 
 
+class AsyncGithubRepo:
+    """An asyncio face on :class:`GithubRepo`, over a thread pool.
+
+    This is not an async HTTP client.  Every call runs the blocking
+    client on a thread of a pool of ``github_api_concurrency`` (default
+    10 here), so that many requests are in flight at a time, however
+    many coroutines are waiting on them; they go through the same rate
+    limiter, response cache and in-flight coalescing as everything
+    else.  Listings come back as async iterators, pulled from the
+    blocking iterator a page at a time.
+
+    There is one per repository per :class:`.PublishThing`, from
+    :meth:`.PublishThing.async_github_repo`.  The pool is started on
+    first use; :meth:`close`, or :meth:`.PublishThing.close`, shuts it
+    down until the next call.
+
+    """
+
+    _page_size = 100
+
+    def __init__(self, thing: "publishthing.PublishThing", repo: str) -> None:
+        self.sync = thing.github_repo(repo)
+        self.thing = thing
+        self.repo = repo
+        self.url = self.sync.url
+        self.concurrency = thing.opts.get("github_api_concurrency", 10)
+        self._executor: Optional[futures.ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> futures.ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(
+                    self.concurrency, thread_name_prefix="github"
+                )
+            return self._executor
+
+    async def _run(self, fn: Callable[..., Any], *arg: Any) -> Any:
+        # calls past the pool size queue in the executor
+        return await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), functools.partial(fn, *arg)
+        )
+
+    async def _aiter(
+        self, fn: Callable[..., Iterator[GithubJsonRec]], *arg: Any
+    ) -> AsyncIterator[GithubJsonRec]:
+        iterator = fn(*arg)
+        while True:
+            recs = await self._run(
+                lambda: list(itertools.islice(iterator, self._page_size))
+            )
+            if not recs:
+                return
+            for rec in recs:
+                yield rec
+
+    def _yield_with_links(
+        self, url: Optional[str], **kw: bool
+    ) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(
+            functools.partial(self.sync._yield_with_links, **kw), url
+        )
+
+    def close(self) -> None:
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    async def get_user_permission(self, username: str) -> GithubJsonRec:
+        return await self._run(self.sync.get_user_permission, username)
+
+    async def prefetch_issues(
+        self, issue_numbers: Iterable[int], username: Optional[str] = None
+    ) -> PrefetchedRecords:
+        return await self._run(  # type: ignore
+            self.sync.prefetch_issues, issue_numbers, username
+        )
+
+    async def get_issue(self, issue_number: str) -> Optional[GithubJsonRec]:
+        return await self._run(self.sync.get_issue, issue_number)
+
+    def get_issue_comments(
+        self, issue_number: str
+    ) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(self.sync.get_issue_comments, issue_number)
+
+    def get_labels(self) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(self.sync.get_labels)
+
+    async def add_issue_labels(
+        self, issue_number: str, labels: List[str]
+    ) -> None:
+        await self._run(self.sync.add_issue_labels, issue_number, labels)
+
+    async def remove_issue_label(self, issue_number: str, label: str) -> None:
+        await self._run(self.sync.remove_issue_label, issue_number, label)
+
+    async def create_label(
+        self, name: str, color: str, description: str
+    ) -> None:
+        await self._run(self.sync.create_label, name, color, description)
+
+    def get_git_tags(self) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(self.sync.get_git_tags)
+
+    async def get_release_by_tag(self, tagname: str) -> GithubJsonRec:
+        return await self._run(self.sync.get_release_by_tag, tagname)
+
+    async def edit_release(
+        self, release_id: str, release: GithubJsonRec
+    ) -> None:
+        await self._run(self.sync.edit_release, release_id, release)
+
+    async def create_release(self, release: GithubJsonRec) -> None:
+        await self._run(self.sync.create_release, release)
+
+    async def create_pr_review(
+        self,
+        issue_number: str,
+        body: str,
+        sha: Optional[str] = None,
+        event: Optional[str] = None,
+    ) -> None:
+        await self._run(
+            self.sync.create_pr_review, issue_number, body, sha, event
+        )
+
+    async def get_pull_request(self, issue_number: str) -> GithubJsonRec:
+        return await self._run(self.sync.get_pull_request, issue_number)
+
+    def get_pull_request_comments(
+        self, issue_number: str
+    ) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(self.sync.get_pull_request_comments, issue_number)
+
+    def get_review_comments(
+        self, issue_number: str, review_id: int
+    ) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(
+            self.sync.get_review_comments, issue_number, review_id
+        )
+
+    async def get_pull_request_diff(self, issue_number: str) -> str:
+        return await self._run(self.sync.get_pull_request_diff, issue_number)
+
+    async def publish_review(
+        self, issue_number: str, github_review: GithubJsonRec
+    ) -> None:
+        await self._run(self.sync.publish_review, issue_number, github_review)
+
+    async def publish_issue_comment(
+        self, issue_number: str, message: str
+    ) -> None:
+        await self._run(self.sync.publish_issue_comment, issue_number, message)
+
+    async def publish_pr_review_comment(
+        self, pullreq_number: str, comment_rec: GithubJsonRec
+    ) -> None:
+        await self._run(
+            self.sync.publish_pr_review_comment, pullreq_number, comment_rec
+        )
+
+    async def get_combined_status(self, sha: str) -> GithubJsonRec:
+        return await self._run(self.sync.get_combined_status, sha)
+
+    async def create_status(
+        self,
+        sha: str,
+        state: str,
+        description: str,
+        context: str,
+        target_url: Optional[str] = None,
+    ) -> None:
+        await self._run(
+            self.sync.create_status,
+            sha,
+            state,
+            description,
+            context,
+            target_url,
+        )
+
+    async def publish_pr_comment_w_status_change(
+        self,
+        issue_number: str,
+        sha: str,
+        message: str,
+        state: str,
+        context: str,
+        target_url: Optional[str] = None,
+        long_message: Optional[str] = None,
+    ) -> None:
+        await self._run(
+            self.sync.publish_pr_comment_w_status_change,
+            issue_number,
+            sha,
+            message,
+            state,
+            context,
+            target_url,
+            long_message,
+        )
+
+    async def set_pull_request_status(
+        self, issue_number: str, closed: bool = True
+    ) -> None:
+        await self._run(
+            self.sync.set_pull_request_status, issue_number, closed
+        )
+
+    def get_comments_since(
+        self, last_received: Optional[str]
+    ) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(self.sync.get_comments_since, last_received)
+
+    def get_issues_since(
+        self, last_received: Optional[str]
+    ) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(self.sync.get_issues_since, last_received)
+
+    def get_issue_events(
+        self, issue_number: str
+    ) -> AsyncIterator[GithubJsonRec]:
+        return self._aiter(self.sync.get_issue_events, issue_number)
+
+    async def get_attachment(self, url: str) -> bytes:
+        return await self._run(self.sync.get_attachment, url)
+
+
 class GithubEvent:
     def __init__(self, json_data: Any, event: str, delivery: str) -> None:
         self.json_data = json_data
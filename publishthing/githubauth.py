@@ -0,0 +1,150 @@
+"""Credentials for the github API.
+
+A personal access token is one user's hourly budget, shared by every
+repo and app that uses it.  A GitHub App instead gets a budget per
+installation, and authenticates by signing a short-lived JWT with its
+private key and trading that for an installation token, good for an
+hour.  Both are presented to :class:`.GithubRepo` the same way: a token
+to send for a given repo, and a stable identity to key rate limiting
+and caching on.
+
+Signing needs PyJWT with its crypto extra (``pip install
+publishthing[app]``); nothing else does.
+
+"""
+
+import calendar
+import threading
+import time
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import requests
+
+
+class TokenAuth:
+    """A static personal access token."""
+
+    def __init__(self, access_token: str) -> None:
+        self.access_token = access_token
+
+    def token(self, repo: str) -> str:
+        return self.access_token
+
+    def identity(self, repo: str) -> str:
+        return self.access_token
+
+
+class GithubAppAuth:
+    """Installation tokens for a GitHub App, minted and cached per repo.
+
+    ``installations`` optionally maps "owner/name" or just "owner" to an
+    installation id; anything not listed there is looked up through the
+    API once and remembered.  Installation tokens are reused until
+    ``refresh_margin`` seconds before they expire.
+
+    """
+
+    jwt_lifetime = 540
+    refresh_margin = 300
+
+    def __init__(
+        self,
+        app_id: str,
+        private_key: str,
+        installations: Optional[Dict[str, int]] = None,
+        api_url: str = "https://api.github.com",
+    ) -> None:
+        self.app_id = str(app_id)
+        self.private_key = private_key
+        self.installations = dict(installations or {})
+        self.api_url = api_url.rstrip("/")
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._jwt: Optional[Tuple[str, float]] = None
+        self._tokens: Dict[int, Tuple[str, float]] = {}
+
+    def jwt(self) -> str:
+        """The app's own credential, signed locally."""
+
+        try:
+            import jwt
+        except ImportError as err:
+            raise ImportError(
+                "GitHub App authentication requires PyJWT with the crypto "
+                "extra; pip install 'pyjwt[crypto]'"
+            ) from err
+
+        now = time.time()
+        with self._lock:
+            if self._jwt is not None and self._jwt[1] - 60 > now:
+                return self._jwt[0]
+            # backdated a minute for clock drift, per github's docs
+            expires = now + self.jwt_lifetime
+            token = jwt.encode(
+                {
+                    "iat": int(now) - 60,
+                    "exp": int(expires),
+                    "iss": self.app_id,
+                },
+                self.private_key,
+                algorithm="RS256",
+            )
+            self._jwt = (token, expires)
+            return token
+
+    def _app_request(self, method: str, path: str) -> Any:
+        resp = self.session.request(
+            method,
+            "%s/%s" % (self.api_url, path),
+            headers={
+                "Authorization": "Bearer %s" % self.jwt(),
+                "Accept": "application/vnd.github+json",
+            },
+        )
+        if resp.status_code > 299:
+            raise Exception(
+                "Got response %s for %s: %s"
+                % (resp.status_code, resp.url, resp.content)
+            )
+        return resp.json()
+
+    def installation_id(self, repo: str) -> int:
+        owner = repo.split("/")[0]
+        for key in (repo, owner):
+            if key in self.installations:
+                return self.installations[key]
+
+        rec = self._app_request("GET", "repos/%s/installation" % repo)
+        with self._lock:
+            self.installations[repo] = rec["id"]
+        return rec["id"]
+
+    def token(self, repo: str) -> str:
+        installation_id = self.installation_id(repo)
+        with self._lock:
+            cached = self._tokens.get(installation_id)
+        if (
+            cached is not None
+            and cached[1] - self.refresh_margin > time.time()
+        ):
+            return cached[0]
+
+        rec = self._app_request(
+            "POST", "app/installations/%s/access_tokens" % installation_id
+        )
+        expires = calendar.timegm(
+            time.strptime(rec["expires_at"], "%Y-%m-%dT%H:%M:%SZ")
+        )
+        with self._lock:
+            self._tokens[installation_id] = (rec["token"], expires)
+        return rec["token"]
+
+    def identity(self, repo: str) -> str:
+        # budgets are per installation; the token itself changes hourly
+        return "app:%s:installation:%s" % (
+            self.app_id,
+            self.installation_id(repo),
+        )
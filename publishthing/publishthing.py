@@ -1,12 +1,22 @@
 import logging
+import threading
 from typing import Any
+from typing import Dict
+from typing import Tuple
+from typing import Union
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import cache
 from . import gerrit
 from . import github
+from . import githubauth
 from . import publish
 from . import shell
 from . import wsgi
 from .util import memoized_property
+from .util import SingleFlight
 
 logging.basicConfig()
 logging.getLogger("publishthing").setLevel(logging.DEBUG)
@@ -15,6 +25,11 @@ logging.getLogger("publishthing").setLevel(logging.DEBUG)
 class PublishThing:
     def __init__(self, **opts: Any):
         self.opts = opts
+        self._github_repos: Dict[Tuple[str, str], github.GithubRepo] = {}
+        self._async_github_repos: Dict[
+            Tuple[str, str], github.AsyncGithubRepo
+        ] = {}
+        self._github_repos_lock = threading.Lock()
 
     @memoized_property
     def github_webhook(self) -> "github.GithubWebhook":
@@ -28,6 +43,32 @@ class PublishThing:
     def gerrit_api(self) -> "gerrit.GerritApi":
         return gerrit.GerritApi(self)
 
+    @memoized_property
+    def http_cache(self) -> "cache.ResponseCache":
+        """The response cache shared by the github and gerrit clients.
+
+        In-process by default.  ``http_cache_path`` names a sqlite file
+        to keep it in instead, shared by every process that points at
+        it.  ``http_cache_size`` caps the number of entries and
+        ``http_cache_ttls`` maps URL patterns to seconds a response is
+        served without revalidation.
+
+        """
+
+        size = self.opts.get("http_cache_size", 1000)
+        ttls = self.opts.get("http_cache_ttls")
+        path = self.opts.get("http_cache_path")
+        if path:
+            return cache.SqliteResponseCache(path, size, ttls)
+        else:
+            return cache.ResponseCache(size, ttls)
+
+    @memoized_property
+    def inflight(self) -> SingleFlight:
+        """Coalesces identical GETs made concurrently from any thread."""
+
+        return SingleFlight()
+
     def wsgi_request(
         self,
         environ: "wsgi.WsgiEnviron",
@@ -36,7 +77,106 @@ class PublishThing:
         return wsgi.WsgiRequest(self, environ, start_response)
 
     def github_repo(self, repo: str) -> "github.GithubRepo":
-        return github.GithubRepo(self, repo)
+        """Return the client for ``repo``, the same one on every call.
+
+        Handlers ask for this once per event; reusing the client keeps
+        its session, and through :attr:`github_http_adapter` the
+        keep-alive connections to api.github.com, alive across webhook
+        deliveries in a long-lived worker.
+
+        """
+
+        key = (repo, self.opts.get("github_access_token") or "")
+        with self._github_repos_lock:
+            gh_repo = self._github_repos.get(key)
+            if gh_repo is None:
+                gh_repo = self._github_repos[key] = github.GithubRepo(
+                    self, repo
+                )
+            return gh_repo
+
+    @memoized_property
+    def github_auth(
+        self,
+    ) -> "Union[githubauth.TokenAuth, githubauth.GithubAppAuth]":
+        """Credentials for the github clients.
+
+        ``github_app_id`` with ``github_app_private_key`` (the PEM text)
+        or ``github_app_private_key_path`` authenticates as a GitHub
+        App, with an installation token per repo;
+        ``github_app_installations`` optionally maps "owner/name" or
+        "owner" to installation ids so they needn't be looked up.
+        Otherwise ``github_access_token`` is used as is.
+
+        """
+
+        if self.opts.get("github_app_id"):
+            private_key = self.opts.get("github_app_private_key")
+            if not private_key:
+                with open(self.opts["github_app_private_key_path"]) as file_:
+                    private_key = file_.read()
+            return githubauth.GithubAppAuth(
+                self.opts["github_app_id"],
+                private_key,
+                installations=self.opts.get("github_app_installations"),
+                api_url=self.opts.get(
+                    "github_api_url", "https://api.github.com"
+                ),
+            )
+        else:
+            return githubauth.TokenAuth(self.opts["github_access_token"])
+
+    @memoized_property
+    def github_http_adapter(self) -> HTTPAdapter:
+        """Connection pool shared by every GithubRepo client.
+
+        ``github_pool_maxsize`` is the number of connections kept open to
+        api.github.com, by default enough for github_api_concurrency.
+        Idempotent requests that hit a 502/503/504 are retried, since
+        github produces those routinely under load.
+
+        """
+
+        return HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.opts.get(
+                "github_pool_maxsize",
+                max(10, self.opts.get("github_api_concurrency", 1)),
+            ),
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                raise_on_status=False,
+            ),
+        )
+
+    def async_github_repo(self, repo: str) -> "github.AsyncGithubRepo":
+        """Return the asyncio client for ``repo``, the same one on every call.
+
+        As with :meth:`github_repo`; it also keeps its thread pool
+        across calls, until :meth:`close`.
+
+        """
+
+        key = (repo, self.opts.get("github_access_token") or "")
+        with self._github_repos_lock:
+            gh_repo = self._async_github_repos.get(key)
+        if gh_repo is None:
+            # github_repo() takes the lock too
+            new_repo = github.AsyncGithubRepo(self, repo)
+            with self._github_repos_lock:
+                gh_repo = self._async_github_repos.setdefault(key, new_repo)
+        return gh_repo
+
+    def close(self) -> None:
+        """Shut down the thread pools of the asyncio github clients."""
+
+        with self._github_repos_lock:
+            async_repos = list(self._async_github_repos.values())
+        for gh_repo in async_repos:
+            gh_repo.close()
 
     @memoized_property
     def publisher(self) -> "publish.Publisher":
@@ -0,0 +1,240 @@
+"""Pacing for the github API budget.
+
+GitHub grants each token a number of requests per hour window and
+reports what's left in every response.  :class:`RateLimiter` spreads the
+remaining budget evenly over the rest of the window as a token bucket,
+and when the budget runs out either waits for the exact reset time or
+raises :class:`RateLimitExceeded`, as the caller chooses.
+
+The remaining count is only ever what github reported; requests sent
+but not yet answered are counted apart from it, as claims, since only
+github knows what a request cost (a 304 costs nothing).
+
+There is one limiter per token per process, shared by every
+``GithubRepo`` using that token; given a state directory it is shared
+across processes as well, through a locked file.
+
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import Mapping
+from typing import Optional
+
+
+class RateLimitExceeded(Exception):
+    """The budget is spent and the caller asked not to wait for it."""
+
+    def __init__(self, reset: float) -> None:
+        self.reset = reset
+        super(RateLimitExceeded, self).__init__(
+            "GitHub API rate limit exhausted until %s (%d seconds from now)"
+            % (
+                time.strftime("%H:%M:%S", time.localtime(reset)),
+                reset - time.time(),
+            )
+        )
+
+
+class RateLimiter:
+    """A token bucket refilled at the rate the remaining budget allows.
+
+    ``reserve`` requests are held back from pacing altogether, so that
+    an interactive use of the same token isn't starved.  ``burst`` is
+    the bucket size, the number of requests that may go out back to
+    back after a quiet spell.
+
+    """
+
+    def __init__(
+        self,
+        reserve: int = 100,
+        burst: int = 10,
+        state_path: Optional[str] = None,
+    ) -> None:
+        self.reserve = reserve
+        self.burst = burst
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {}
+
+    @contextlib.contextmanager
+    def _locked_state(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            if self.state_path is None:
+                yield self._state
+                return
+
+            with open(self.state_path, "a+") as file_:
+                fcntl.flock(file_, fcntl.LOCK_EX)
+                try:
+                    file_.seek(0)
+                    content = file_.read()
+                    state = json.loads(content) if content else {}
+                    yield state
+                    file_.seek(0)
+                    file_.truncate()
+                    json.dump(state, file_)
+                finally:
+                    fcntl.flock(file_, fcntl.LOCK_UN)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Take the budget reported in a response's headers."""
+
+        if "X-RateLimit-Remaining" not in headers:
+            return
+
+        # graphql and search are budgeted separately, with their own
+        # counts and reset times
+        if headers.get("X-RateLimit-Resource", "core") != "core":
+            return
+
+        remaining = int(headers["X-RateLimit-Remaining"])
+        reset = int(headers["X-RateLimit-Reset"])
+        with self._locked_state() as state:
+            if state.get("reset") == reset:
+                # responses to concurrent requests arrive in any order;
+                # within one window the lowest count is the latest
+                state["remaining"] = min(state["remaining"], remaining)
+            elif reset > state.get("reset", 0):
+                # claims left behind by a process that died mid-request
+                # go with the old window
+                state.update(
+                    limit=int(headers["X-RateLimit-Limit"]),
+                    remaining=remaining,
+                    reset=reset,
+                    claims=0,
+                )
+                state.setdefault("tokens", float(self.burst))
+                state.setdefault("last", time.time())
+
+    @contextlib.contextmanager
+    def claim(
+        self,
+        block: bool = True,
+        max_wait: Optional[float] = None,
+        on_wait: Optional[Callable[[float], None]] = None,
+    ) -> Iterator[None]:
+        """Claim one request for the duration of the block.
+
+        Takes the same arguments as :meth:`.acquire`; the claim is
+        released once the request is done, its response having reported
+        what it cost through :meth:`.update`.
+
+        """
+
+        claimed = self.acquire(block=block, max_wait=max_wait, on_wait=on_wait)
+        try:
+            yield
+        finally:
+            if claimed:
+                self.release()
+
+    def acquire(
+        self,
+        block: bool = True,
+        max_wait: Optional[float] = None,
+        on_wait: Optional[Callable[[float], None]] = None,
+    ) -> bool:
+        """Claim one request, sleeping first if the pace calls for it.
+
+        With ``block=False``, or when the wait would be longer than
+        ``max_wait`` seconds, raises :class:`RateLimitExceeded` instead
+        of sleeping.  ``on_wait`` is called with the number of seconds
+        about to be slept.  Returns whether a claim was taken, to be
+        given back with :meth:`.release`.
+
+        """
+
+        with self._locked_state() as state:
+            now = time.time()
+            if not state or now >= state["reset"]:
+                # nothing known, or the window has rolled over; the
+                # response to this request will tell us where we are
+                return False
+
+            window = state["reset"] - now
+            budget = state["remaining"] - state.get("claims", 0) - self.reserve
+            if budget <= 0:
+                # wait out the window itself; a second or so past reset
+                # keeps us clear of clock skew with github
+                wait = window + 1
+                state["claims"] = state.get("claims", 0) + 1
+            else:
+                rate = budget / window
+                state["tokens"] = min(
+                    float(self.burst),
+                    state["tokens"] + (now - state["last"]) * rate,
+                )
+                state["last"] = now
+
+                # take the token now, even if that puts the bucket in
+                # debt; the debt is how long this caller has to wait,
+                # and it queues up everyone behind it fairly
+                state["tokens"] -= 1
+                state["claims"] = state.get("claims", 0) + 1
+                wait = -state["tokens"] / rate if state["tokens"] < 0 else 0
+
+            if wait > 0 and (
+                not block or (max_wait is not None and wait > max_wait)
+            ):
+                # give back what we took
+                state["claims"] -= 1
+                if budget > 0:
+                    state["tokens"] += 1
+                raise RateLimitExceeded(state["reset"])
+
+        if wait > 0:
+            if on_wait is not None:
+                on_wait(wait)
+            time.sleep(wait)
+        return True
+
+    def release(self) -> None:
+        """Give back a claim taken by :meth:`.acquire`."""
+
+        with self._locked_state() as state:
+            if state.get("claims"):
+                state["claims"] -= 1
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(
+    token: str,
+    reserve: int = 100,
+    burst: int = 10,
+    state_dir: Optional[str] = None,
+) -> RateLimiter:
+    """Return the process-wide limiter for a token.
+
+    With ``state_dir``, the limiter's state lives in a file there named
+    for a hash of the token, so every process using the same directory
+    paces against the same budget.
+
+    """
+
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            state_path = (
+                os.path.join(state_dir, "%s.json" % key[0:16])
+                if state_dir
+                else None
+            )
+            limiter = _limiters[key] = RateLimiter(
+                reserve=reserve, burst=burst, state_path=state_path
+            )
+        return limiter
@@ -7,6 +7,7 @@ from subprocess import check_output
 from subprocess import run as subprocess_run
 from typing import Any
 from typing import AnyStr
+from typing import Dict
 from typing import IO
 from typing import Optional
 
@@ -61,9 +62,12 @@ class Shell:
         *args: str,
         include_stderr: bool = False,
         none_for_error: bool = False,
+        env: Optional[Dict[str, str]] = None,
     ) -> Any:
         self.thing.debug("shell", " ".join(args))
 
+        # added to the environment, rather than replacing it
+        full_env = dict(os.environ, **env) if env else None
         try:
             if include_stderr:
                 return check_output(
@@ -71,10 +75,11 @@ class Shell:
                     encoding="utf-8",
                     cwd=self.path,
                     stderr=subprocess.STDOUT,
+                    env=full_env,
                 ).strip()
             else:
                 return check_output(
-                    args, encoding="utf-8", cwd=self.path
+                    args, encoding="utf-8", cwd=self.path, env=full_env
                 ).strip()
         except subprocess.CalledProcessError:
             if none_for_error:
@@ -125,6 +130,11 @@ class Shell:
         origin: Optional[str] = None,
         bare: bool = False,
         create: bool = False,
+        filter_: Optional[str] = None,
+        depth: Optional[int] = None,
+        shallow_since: Optional[str] = None,
+        reference: Optional[str] = None,
+        dissociate: bool = False,
     ) -> "git.GitRepo":
         return git.GitRepo(
             self.thing,
@@ -133,4 +143,9 @@ class Shell:
             origin=origin,
             bare=bare,
             create=create,
+            filter_=filter_,
+            depth=depth,
+            shallow_since=shallow_since,
+            reference=reference,
+            dissociate=dissociate,
         )
@@ -1,7 +1,13 @@
 import collections
+from concurrent import futures
+import contextvars
+import hashlib
+import queue
+import threading
 from typing import Any
 from typing import Callable
 from typing import Dict
+from typing import Hashable
 from typing import List
 from typing import Optional
 from typing import Tuple
@@ -26,6 +32,106 @@ class memoized_property:
         return result
 
 
+class SingleFlight:
+    """Coalesce concurrent calls that would do the same work.
+
+    The first caller for a key runs the function; anyone else asking for
+    the same key while it's running waits for, and gets, that same
+    result or exception.  Nothing is kept once the call completes.
+
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, "futures.Future[Any]"] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = futures.Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class KeyedWorkers:
+    """A fixed pool of threads that keeps work for one key in order.
+
+    Everything submitted under the same key goes to the same thread, so
+    it runs one item at a time in the order submitted, while different
+    keys proceed in parallel.  ``fn`` is called with each item and is
+    expected to deal with its own exceptions.
+
+    """
+
+    def __init__(self, workers: int, fn: Callable[[Any], None]) -> None:
+        self.fn = fn
+        self._queues: List["queue.Queue[Any]"] = [
+            queue.Queue() for _ in range(workers)
+        ]
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,), daemon=True)
+            for q in self._queues
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key: str, item: Any) -> None:
+        # not hash(), which differs from process to process
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        self._queues[int(digest, 16) % len(self._queues)].put((item,))
+
+    def close(self) -> None:
+        """Finish everything submitted so far, then stop the threads."""
+
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, q: "queue.Queue[Any]") -> None:
+        while True:
+            entry = q.get()
+            if entry is None:
+                return
+            self.fn(entry[0])
+
+
+def run_concurrently(*fns: Callable[[], Any]) -> List[Any]:
+    """Call each of ``fns`` on its own thread; return their results in order.
+
+    For a handful of independent requests, so that the wait is for the
+    slowest of them rather than for all of them in turn.  Each call runs
+    in a copy of the caller's context, so context variables such as a
+    gerrit event scope carry over.  The first exception, in argument
+    order, is raised once all the calls have finished.
+
+    """
+
+    if len(fns) < 2:
+        return [fn() for fn in fns]
+
+    with futures.ThreadPoolExecutor(len(fns)) as executor:
+        pending = [
+            executor.submit(contextvars.copy_context().run, fn) for fn in fns
+        ]
+    return [future.result() for future in pending]
+
+
 EventHook = Callable[..., None]
 EventFilter = Callable[[Any], None]
 _HookRecord = Tuple[EventHook, Optional[EventFilter]]
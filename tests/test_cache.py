@@ -0,0 +1,179 @@
+"""Tests for the conditional-request response cache.
+
+A wrong answer here serves one token's view of a repo to another, or a
+stale pull request to the gate, so the keying and the 304 handling are
+covered directly.
+
+"""
+
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from publishthing import cache
+import requests
+
+URL = "https://api.github.com/repos/sqlalchemy/testgerrit/issues/5"
+
+
+def response(
+    status_code: int = 200,
+    content: bytes = b'{"number": 5}',
+    headers: Optional[Dict[str, str]] = None,
+) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp._content = content
+    resp.headers.update(headers or {})
+    resp.url = URL
+    return resp
+
+
+class FakeServer:
+    """Answers like github does: 304 when the ETag still matches."""
+
+    def __init__(self, etag: str = '"v1"') -> None:
+        self.etag = etag
+        self.body = b'{"number": 5}'
+        self.sent: List[Dict[str, str]] = []
+
+    def get(self, validators: Dict[str, str]) -> requests.Response:
+        self.sent.append(validators)
+        if validators.get("If-None-Match") == self.etag:
+            return response(304, b"")
+        return response(200, self.body, {"ETag": self.etag})
+
+
+def test_second_get_is_conditional_and_answered_from_cache():
+    http_cache = cache.ResponseCache()
+    server = FakeServer()
+    key = http_cache.key("github", "token", URL)
+
+    first = http_cache.conditional_get(key, URL, server.get)
+    second = http_cache.conditional_get(key, URL, server.get)
+
+    assert server.sent == [{}, {"If-None-Match": '"v1"'}]
+    assert first.json() == second.json() == {"number": 5}
+    assert second.status_code == 200
+
+
+def test_changed_resource_replaces_the_cached_copy():
+    http_cache = cache.ResponseCache()
+    server = FakeServer()
+    key = http_cache.key("github", "token", URL)
+
+    http_cache.conditional_get(key, URL, server.get)
+    server.etag = '"v2"'
+    server.body = b'{"number": 5, "state": "closed"}'
+
+    assert http_cache.conditional_get(key, URL, server.get).json() == {
+        "number": 5,
+        "state": "closed",
+    }
+    http_cache.conditional_get(key, URL, server.get)
+    assert server.sent[-1] == {"If-None-Match": '"v2"'}
+
+
+def test_links_survive_a_304():
+    http_cache = cache.ResponseCache()
+    key = http_cache.key("github", "token", URL)
+    link = '<%s?page=2>; rel="next"' % URL
+
+    http_cache.conditional_get(
+        key,
+        URL,
+        lambda validators: response(headers={"ETag": '"v1"', "Link": link}),
+    )
+    resp = http_cache.conditional_get(
+        key, URL, lambda validators: response(304, b"")
+    )
+    assert resp.links["next"]["url"] == "%s?page=2" % URL
+
+
+def test_errors_and_unvalidated_responses_are_not_cached():
+    http_cache = cache.ResponseCache()
+    key = http_cache.key("github", "token", URL)
+
+    http_cache.conditional_get(key, URL, lambda v: response(404, b""))
+    http_cache.conditional_get(key, URL, lambda v: response(200))
+    assert http_cache.get(key) is None
+
+
+def test_key_separates_identity_and_representation():
+    keys = {
+        cache.ResponseCache.key("github", "token-a", URL, ""),
+        cache.ResponseCache.key("github", "token-b", URL, ""),
+        cache.ResponseCache.key(
+            "github", "token-a", URL, "application/vnd.github.v3.diff"
+        ),
+    }
+    assert len(keys) == 3
+    assert not any("token-a" in key for key in keys)
+
+
+def test_lru_eviction():
+    http_cache = cache.ResponseCache(size=2)
+    rec = cache.CachedResponse(200, {"ETag": '"x"'}, b"{}", None, 0.0)
+    http_cache.set("a", rec)
+    http_cache.set("b", rec)
+    http_cache.get("a")
+    http_cache.set("c", rec)
+
+    assert http_cache.get("a") is not None
+    assert http_cache.get("b") is None
+    assert http_cache.get("c") is not None
+
+
+def test_size_zero_disables():
+    http_cache = cache.ResponseCache(size=0)
+    server = FakeServer()
+    key = http_cache.key("github", "token", URL)
+
+    http_cache.conditional_get(key, URL, server.get)
+    http_cache.conditional_get(key, URL, server.get)
+    assert server.sent == [{}, {}]
+
+
+def test_ttl_serves_without_asking():
+    http_cache = cache.ResponseCache(ttls={r"/labels": 60})
+    server = FakeServer()
+    labels_url = "https://api.github.com/repos/sqlalchemy/testgerrit/labels"
+    key = http_cache.key("github", "token", labels_url)
+
+    http_cache.conditional_get(key, labels_url, server.get)
+    http_cache.conditional_get(key, labels_url, server.get)
+    assert server.sent == [{}]
+
+    # the issue url matches no pattern and is always revalidated
+    key = http_cache.key("github", "token", URL)
+    http_cache.conditional_get(key, URL, server.get)
+    http_cache.conditional_get(key, URL, server.get)
+    assert len(server.sent) == 3
+
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    server = FakeServer()
+    key = cache.ResponseCache.key("github", "token", URL)
+
+    cache.SqliteResponseCache(path).conditional_get(key, URL, server.get)
+    resp = cache.SqliteResponseCache(path).conditional_get(
+        key, URL, server.get
+    )
+
+    assert server.sent == [{}, {"If-None-Match": '"v1"'}]
+    assert resp.json() == {"number": 5}
+    assert resp.headers["etag"] == '"v1"'
+
+
+def test_sqlite_lru_eviction(tmp_path):
+    http_cache = cache.SqliteResponseCache(str(tmp_path / "cache.db"), size=2)
+    for key in "abc":
+        http_cache.set(
+            key, cache.CachedResponse(200, {}, key.encode(), None, 0.0)
+        )
+        http_cache.get("a")
+
+    assert http_cache.get("a").content == b"a"
+    assert http_cache.get("b") is None
+    assert http_cache.get("c").content == b"c"
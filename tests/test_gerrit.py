@@ -0,0 +1,327 @@
+"""Tests for GerritApi's transport against a local stand-in server."""
+
+import base64
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+import threading
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+from publishthing import PublishThing
+from publishthing.util import run_concurrently
+import pytest
+
+
+class GerritRest(BaseHTTPRequestHandler):
+    # keep-alive, as gerrit behind any real web server does
+    protocol_version = "HTTP/1.1"
+    server: Any
+
+    def _respond(self, rec: Any) -> None:
+        body = (")]}'\n" + json.dumps(rec)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _record(self) -> None:
+        self.server.requests.append(
+            (
+                self.command,
+                self.path,
+                self.client_address[1],
+                self.headers.get("Authorization"),
+            )
+        )
+
+    def do_GET(self) -> None:
+        self._record()
+        self._respond(
+            self.server.responses.get(
+                self.path[3:], {"_number": 5, "id": "p~master~I5"}
+            )
+        )
+
+    def do_POST(self) -> None:
+        self._record()
+        length = int(self.headers["Content-Length"])
+        self._respond({"labels": json.loads(self.rfile.read(length))})
+
+    def log_message(self, *arg: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[ThreadingHTTPServer]:
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), GerritRest)
+    httpd.requests = []
+    httpd.responses = {}
+    thread = threading.Thread(
+        target=httpd.serve_forever, args=(0.01,), daemon=True
+    )
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def gerrit_thing(server: ThreadingHTTPServer, **opts: Any) -> PublishThing:
+    opts.setdefault("http_cache_size", 0)
+    return PublishThing(
+        gerrit_api_url="http://127.0.0.1:%s" % server.server_port,
+        gerrit_api_username="bot",
+        gerrit_api_password="pw",
+        **opts,
+    )
+
+
+def test_calls_share_one_connection(server: ThreadingHTTPServer) -> None:
+    api = gerrit_thing(server).gerrit_api
+
+    assert api.get_change_current_revision("5")["_number"] == 5
+    api.get_change_inline_comments("5")
+    assert api.set_review("5", "1", {"Verified": 1}) == {
+        "labels": {"Verified": 1}
+    }
+
+    assert [(method, path) for method, path, _, _ in server.requests] == [
+        ("GET", "/a/changes/5?o=CURRENT_REVISION&o=CURRENT_COMMIT"),
+        ("GET", "/a/changes/5/comments"),
+        ("POST", "/a/changes/5/revisions/1/review"),
+    ]
+    assert len({port for _, _, port, _ in server.requests}) == 1
+
+    expected_auth = "Basic %s" % base64.b64encode(b"bot:pw").decode("ascii")
+    assert {auth for _, _, _, auth in server.requests} == {expected_auth}
+
+
+def test_responses_are_logged(
+    server: ThreadingHTTPServer, caplog: pytest.LogCaptureFixture
+) -> None:
+    api = gerrit_thing(server).gerrit_api
+
+    with caplog.at_level("DEBUG", logger="publishthing"):
+        api.get_change_inline_comments("5")
+
+    assert any(
+        "GET http://127.0.0.1:%s/a/changes/5/comments -> 200"
+        % server.server_port
+        in record.getMessage()
+        for record in caplog.records
+    )
+
+
+def test_pool_size_and_timeout_opts(server: ThreadingHTTPServer) -> None:
+    api = gerrit_thing(
+        server, gerrit_api_pool_size=3, gerrit_api_timeout=5
+    ).gerrit_api
+
+    adapter = api.session.get_adapter(api.service_url + "/a/changes/")
+    assert adapter._pool_maxsize == 3
+    assert api.timeout == 5
+
+
+def revision(number: int) -> Dict[str, Any]:
+    return {
+        "_number": number,
+        "commit": {"message": "patchset %d" % number},
+    }
+
+
+def change(*numbers: int) -> Dict[str, Any]:
+    return {
+        "id": "p~master~I5",
+        "current_revision": "sha%d" % numbers[-1],
+        "revisions": {
+            "sha%d" % number: revision(number) for number in numbers
+        },
+    }
+
+
+def requested_paths(server: ThreadingHTTPServer) -> List[str]:
+    paths = [path[3:] for _, path, _, _ in server.requests]
+    server.requests[:] = []
+    return paths
+
+
+ALL_REVISIONS = "changes/5?o=ALL_REVISIONS&o=ALL_COMMITS"
+CURRENT_REVISION = "changes/5?o=CURRENT_REVISION&o=CURRENT_COMMIT"
+
+
+def test_patchset_commit_cached_for_good(server: ThreadingHTTPServer) -> None:
+    api = gerrit_thing(server, http_cache_size=100).gerrit_api
+    server.responses["changes/5/revisions/1/commit"] = {"message": "one"}
+
+    assert api.get_patchset_commit("5", 1) == {"message": "one"}
+    assert api.get_patchset_commit("5", 1) == {"message": "one"}
+    assert api.get_patchset_commit("5", "current") is not None
+    api.get_patchset_commit("5", "current")
+
+    assert requested_paths(server) == [
+        "changes/5/revisions/1/commit",
+        "changes/5/revisions/current/commit",
+        "changes/5/revisions/current/commit",
+    ]
+
+
+def test_all_revisions_seed_patchset_commits(
+    server: ThreadingHTTPServer,
+) -> None:
+    api = gerrit_thing(server, http_cache_size=100).gerrit_api
+    server.responses[ALL_REVISIONS] = change(1, 2)
+
+    api.get_change_all_revisions("5")
+    assert api.get_patchset_commit("5", 1) == {
+        "message": "patchset 1",
+        "commit": "sha1",
+    }
+    assert api.get_patchset_commit("5", "sha2")["message"] == "patchset 2"
+    assert requested_paths(server) == [ALL_REVISIONS]
+
+
+def test_all_revisions_within_ttl(server: ThreadingHTTPServer) -> None:
+    api = gerrit_thing(server, http_cache_size=100).gerrit_api
+    server.responses[ALL_REVISIONS] = change(1, 2)
+
+    assert api.get_change_all_revisions("5") == change(1, 2)
+    assert api.get_change_all_revisions("5") == change(1, 2)
+    assert requested_paths(server) == [ALL_REVISIONS]
+
+
+def test_all_revisions_extended_by_current(
+    server: ThreadingHTTPServer,
+) -> None:
+    api = gerrit_thing(
+        server, http_cache_size=100, gerrit_change_cache_ttl=0
+    ).gerrit_api
+    server.responses[ALL_REVISIONS] = change(1, 2)
+    api.get_change_all_revisions("5")
+    requested_paths(server)
+
+    server.responses[CURRENT_REVISION] = change(3)
+    assert api.get_change_all_revisions("5") == change(1, 2, 3)
+    assert requested_paths(server) == [CURRENT_REVISION]
+
+
+def test_all_revisions_refetched_past_a_gap(
+    server: ThreadingHTTPServer,
+) -> None:
+    api = gerrit_thing(
+        server, http_cache_size=100, gerrit_change_cache_ttl=0
+    ).gerrit_api
+    server.responses[ALL_REVISIONS] = change(1, 2)
+    api.get_change_all_revisions("5")
+    requested_paths(server)
+
+    server.responses[CURRENT_REVISION] = change(4)
+    server.responses[ALL_REVISIONS] = change(1, 2, 3, 4)
+    assert api.get_change_all_revisions("5") == change(1, 2, 3, 4)
+    assert requested_paths(server) == [CURRENT_REVISION, ALL_REVISIONS]
+
+
+HOOK_CHANGE = (
+    "changes/5?o=CURRENT_REVISION&o=CURRENT_COMMIT&o=LABELS"
+    "&o=DETAILED_LABELS&o=DETAILED_ACCOUNTS&o=REVIEWER_UPDATES&o=MESSAGES"
+)
+
+
+def test_get_change_outside_event_scope(server: ThreadingHTTPServer) -> None:
+    api = gerrit_thing(server).gerrit_api
+
+    api.get_change_current_revision("5")
+    api.get_change_current_revision("5")
+    api.get_change_standalone_comments("5")
+
+    assert requested_paths(server) == [
+        CURRENT_REVISION,
+        CURRENT_REVISION,
+        "changes/5?o=MESSAGES&o=DETAILED_ACCOUNTS",
+    ]
+
+
+def test_get_change_once_per_event(server: ThreadingHTTPServer) -> None:
+    api = gerrit_thing(server).gerrit_api
+
+    with api.event_scope():
+        api.get_change_current_revision("5")
+        api.get_change_detail("5")
+        api.get_change_standalone_comments("5")
+        api.get_change("5", ("CURRENT_REVISION", "ALL_FILES"))
+        api.get_change("5", ("ALL_FILES",))
+    api.get_change_current_revision("5")
+
+    assert requested_paths(server) == [
+        HOOK_CHANGE,
+        HOOK_CHANGE + "&o=ALL_FILES",
+        CURRENT_REVISION,
+    ]
+
+
+def test_set_review_drops_change_from_event(
+    server: ThreadingHTTPServer,
+) -> None:
+    api = gerrit_thing(server).gerrit_api
+
+    with api.event_scope():
+        api.get_change_detail("5")
+        api.set_review("5", "1", {"labels": {"Verified": 1}})
+        api.get_change_detail("5")
+
+    assert requested_paths(server) == [
+        HOOK_CHANGE,
+        "changes/5/revisions/1/review",
+        HOOK_CHANGE,
+    ]
+
+
+def test_event_scope_carries_into_run_concurrently(
+    server: ThreadingHTTPServer,
+) -> None:
+    api = gerrit_thing(server).gerrit_api
+
+    with api.event_scope():
+        api.get_change_detail("5")
+        run_concurrently(
+            lambda: api.get_change_current_revision("5"),
+            lambda: api.get_change_standalone_comments("5"),
+        )
+    run_concurrently(lambda: api.get_change_current_revision("5"))
+
+    assert requested_paths(server) == [HOOK_CHANGE, CURRENT_REVISION]
+
+
+def test_query_changes_pages(server: ThreadingHTTPServer) -> None:
+    api = gerrit_thing(server).gerrit_api
+    query = "changes/?q=status%3Aopen&o=LABELS&n=2&S="
+    server.responses[query + "0"] = [
+        {"_number": 1},
+        {"_number": 2, "_more_changes": True},
+    ]
+    server.responses[query + "2"] = [
+        {"_number": 3},
+        {"_number": 4, "_more_changes": True},
+    ]
+    server.responses[query + "4"] = [{"_number": 5}]
+
+    changes = api.query_changes("status:open", ("LABELS",), page_size=2)
+    assert [change["_number"] for change in changes] == [1, 2, 3, 4, 5]
+    assert requested_paths(server) == [query + "0", query + "2", query + "4"]
+
+
+def test_query_changes_limit(server: ThreadingHTTPServer) -> None:
+    api = gerrit_thing(server).gerrit_api
+    server.responses["changes/?q=status%3Aopen&n=2&S=0"] = [
+        {"_number": 1},
+        {"_number": 2, "_more_changes": True},
+    ]
+    server.responses["changes/?q=status%3Aopen&n=1&S=2"] = [
+        {"_number": 3, "_more_changes": True},
+    ]
+
+    changes = api.query_changes("status:open", limit=3, page_size=2)
+    assert [change["_number"] for change in changes] == [1, 2, 3]
+    assert len(requested_paths(server)) == 2
@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+import threading
+from typing import Any
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+from publishthing import gerritdaemon
+from publishthing import gerritforward
+from publishthing import PublishThing
+import pytest
+
+
+@pytest.fixture
+def daemon(
+    tmp_path: Any,
+) -> Iterator[Tuple[gerritdaemon.GerritHookDaemon, List[Any]]]:
+    thing = PublishThing()
+    handled: List[Any] = []
+    lock = threading.Lock()
+
+    @thing.gerrit_hook.event("patchset-created")  # type: ignore
+    @thing.gerrit_hook.event("comment-added")  # type: ignore
+    def record(opts: Any) -> None:
+        with lock:
+            handled.append((opts.hook, opts.change, opts.patchset))
+
+    hook_daemon = gerritdaemon.GerritHookDaemon(
+        thing, path=str(tmp_path / "hook.sock"), workers=3
+    )
+    thread = threading.Thread(target=hook_daemon.serve_forever)
+    thread.start()
+    assert hook_daemon.ready.wait(5)
+    try:
+        yield hook_daemon, handled
+    finally:
+        hook_daemon.shutdown()
+        thread.join()
+
+
+def test_forwarded_hooks_run_in_order_per_change(
+    daemon: Tuple[gerritdaemon.GerritHookDaemon, List[Any]],
+) -> None:
+    hook_daemon, handled = daemon
+
+    for patchset in (1, 2, 3):
+        for change in ("Ia", "Ib"):
+            gerritforward.forward(
+                ["--change", change, "--patchset", str(patchset)],
+                hook_daemon.path,
+                hook="patchset-created",
+            )
+
+    hook_daemon.shutdown()
+
+    for change in ("Ia", "Ib"):
+        assert [rec for rec in handled if rec[1] == change] == [
+            ("patchset-created", change, patchset) for patchset in (1, 2, 3)
+        ]
+
+
+def test_bad_request_is_refused(
+    daemon: Tuple[gerritdaemon.GerritHookDaemon, List[Any]],
+) -> None:
+    hook_daemon, handled = daemon
+
+    with pytest.raises(Exception, match="didn't accept"):
+        gerritforward.forward(
+            ["--patchset", "not a number"],
+            hook_daemon.path,
+            hook="patchset-created",
+        )
+
+
+def test_forwarder_script_stays_light(
+    daemon: Tuple[gerritdaemon.GerritHookDaemon, List[Any]], tmp_path: Any
+) -> None:
+    hook_daemon, handled = daemon
+
+    # run as the hooks plugin would, through a symlink named for the hook
+    hook_path = tmp_path / "comment-added"
+    os.symlink(gerritforward.__file__, hook_path)
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import runpy, sys; "
+            "sys.argv = sys.argv[1:]; "
+            "runpy.run_path(sys.argv[0], run_name='__main__'); "
+            "print(sorted(m for m in sys.modules "
+            "if m.split('.')[0] in ('publishthing', 'requests')))",
+            str(hook_path),
+            "--change",
+            "Ic",
+            "--patchset",
+            "4",
+        ],
+        env=dict(os.environ, PUBLISHTHING_HOOK_SOCKET=hook_daemon.path),
+        cwd=str(tmp_path),
+        encoding="utf-8",
+    )
+    assert output.strip() == "[]"
+
+    hook_daemon.shutdown()
+    assert handled == [("comment-added", "Ic", 4)]
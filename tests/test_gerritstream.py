@@ -0,0 +1,162 @@
+import json
+import sys
+import threading
+from typing import Any
+from typing import Dict
+from typing import List
+
+from publishthing import gerritstream
+from publishthing import PublishThing
+
+
+def owner() -> Dict[str, str]:
+    return {"name": "Some One", "email": "one@example.com", "username": "one"}
+
+
+def change(number: int) -> Dict[str, Any]:
+    return {
+        "project": "o/r",
+        "branch": "main",
+        "id": "I%040d" % number,
+        "number": number,
+        "url": "https://gerrit.example.com/c/o/r/+/%d" % number,
+        "owner": owner(),
+    }
+
+
+def patchset_created(number: int, patchset: int, at: int) -> Dict[str, Any]:
+    return {
+        "type": "patchset-created",
+        "change": change(number),
+        "patchSet": {
+            "number": patchset,
+            "revision": "%040d" % patchset,
+            "kind": "REWORK",
+        },
+        "uploader": owner(),
+        "eventCreatedOn": at,
+    }
+
+
+def comment_added(number: int, at: int) -> Dict[str, Any]:
+    return {
+        "type": "comment-added",
+        "change": change(number),
+        "patchSet": {"number": 2, "revision": "%040d" % 2},
+        "author": owner(),
+        "comment": "Patch Set 2: Verified+1\n\nlooks good",
+        "approvals": [
+            {"type": "Verified", "value": "1", "oldValue": "0"},
+            {"type": "Workflow", "value": "1"},
+        ],
+        "eventCreatedOn": at,
+    }
+
+
+def test_event_to_argv_parses_like_a_hook() -> None:
+    thing = PublishThing()
+    argv = gerritstream.event_to_argv(comment_added(5, 100))
+    opts, _ = thing.gerrit_hook._argument_parser.parse_known_args(argv)
+
+    assert opts.hook == "comment-added"
+    assert opts.change == "I%040d" % 5
+    assert opts.project == "o/r"
+    assert opts.branch == "main"
+    assert opts.patchset == 2
+    assert opts.author == "Some One (one@example.com)"
+    assert opts.author_username == "one"
+    assert opts.comment == "Patch Set 2: Verified+1\n\nlooks good"
+    assert opts.Verified == 1
+    assert getattr(opts, "Verified_oldValue") == 0
+    assert opts.reason is None
+
+
+def test_replayed_stream_dispatched_once_in_order(tmp_path: Any) -> None:
+    events = [
+        patchset_created(5, 1, 100),
+        patchset_created(6, 1, 100),
+        patchset_created(5, 2, 101),
+        comment_added(5, 101),
+        patchset_created(6, 2, 102),
+    ]
+    feed = tmp_path / "events.jsonl"
+    feed.write_text(
+        "\n".join(json.dumps(event) for event in events) + "\nnot json\n"
+    )
+
+    thing = PublishThing()
+    handled: List[Any] = []
+    lock = threading.Lock()
+
+    @thing.gerrit_hook.event("patchset-created")  # type: ignore
+    @thing.gerrit_hook.event("comment-added")  # type: ignore
+    def record(opts: Any) -> None:
+        with lock:
+            handled.append((opts.change[-1], opts.hook, opts.patchset))
+
+    stream = gerritstream.GerritEventStream(
+        thing,
+        command=[
+            sys.executable,
+            "-c",
+            "import sys; sys.stdout.write(open(sys.argv[1]).read())",
+            str(feed),
+        ],
+        workers=3,
+    )
+    stream.reconnect_backoff = (0,)
+
+    # the second connection replays the same feed, as a stream that
+    # resumes from a little way back would
+    stream.run(max_connections=2)
+
+    assert sorted(handled) == sorted(
+        [
+            ("5", "patchset-created", 1),
+            ("6", "patchset-created", 1),
+            ("5", "patchset-created", 2),
+            ("5", "comment-added", 2),
+            ("6", "patchset-created", 2),
+        ]
+    )
+    # one change's events are handled in the order they happened
+    assert [rec for rec in handled if rec[0] == "5"] == [
+        ("5", "patchset-created", 1),
+        ("5", "patchset-created", 2),
+        ("5", "comment-added", 2),
+    ]
+
+
+def test_events_out_of_time_order_are_all_handled() -> None:
+    thing = PublishThing()
+    stream = gerritstream.GerritEventStream(thing, command=["true"])
+
+    # created a second apart, but arriving the other way round
+    assert stream._is_new(comment_added(5, 101))
+    assert stream._is_new(patchset_created(6, 1, 100))
+    assert stream._is_new(patchset_created(6, 1, 99))
+
+
+def test_failing_handler_does_not_stop_the_stream(tmp_path: Any) -> None:
+    feed = tmp_path / "events.jsonl"
+    feed.write_text(
+        "\n".join(
+            json.dumps(patchset_created(5, patchset, 100 + patchset))
+            for patchset in (1, 2)
+        )
+    )
+
+    thing = PublishThing()
+    handled: List[int] = []
+
+    @thing.gerrit_hook.event("patchset-created")  # type: ignore
+    def record(opts: Any) -> None:
+        handled.append(opts.patchset)
+        if opts.patchset == 1:
+            raise Exception("boom")
+
+    gerritstream.GerritEventStream(
+        thing, command=["cat", str(feed)], workers=1
+    ).run(max_connections=1)
+
+    assert handled == [1, 2]
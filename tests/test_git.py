@@ -0,0 +1,452 @@
+import os
+import subprocess
+import threading
+from typing import Any
+from typing import Dict
+
+from publishthing import git
+from publishthing import PublishThing
+import pytest
+
+GITREVIEW = """[gerrit]
+host=gerrit.example.com
+project=org/proj.git
+defaultbranch=main
+"""
+
+
+def run(path: Any, *args: str) -> str:
+    return subprocess.check_output(
+        ("git",) + args, cwd=str(path), encoding="utf-8"
+    ).strip()
+
+
+def commit_file(path: Any, name: str, content: str, message: str) -> str:
+    with open(os.path.join(str(path), name), "w") as f:
+        f.write(content)
+    run(path, "add", name)
+    run(path, "commit", "-q", "-m", message)
+    return run(path, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def repo(tmp_path: Any, monkeypatch: Any) -> git.GitRepo:
+    for who in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv("GIT_%s_NAME" % who, "Some Committer")
+        monkeypatch.setenv("GIT_%s_EMAIL" % who, "committer@example.com")
+
+    checkout = tmp_path / "proj"
+    checkout.mkdir()
+    run(checkout, "init", "-q", "-b", "main")
+    commit_file(checkout, ".gitreview", GITREVIEW, "gitreview")
+    commit_file(checkout, "lib.py", "one\ntwo\nthree\n", "base")
+
+    run(checkout, "checkout", "-q", "-b", "feature")
+    monkeypatch.setenv("GIT_AUTHOR_NAME", "Pr Author")
+    monkeypatch.setenv("GIT_AUTHOR_EMAIL", "author@example.com")
+    commit_file(checkout, "lib.py", "one\ntwo\nthree\nfour\n", "add four")
+    commit_file(checkout, "new.py", "new\n", "add new")
+    monkeypatch.setenv("GIT_AUTHOR_NAME", "Some Committer")
+    monkeypatch.setenv("GIT_AUTHOR_EMAIL", "committer@example.com")
+
+    run(checkout, "checkout", "-q", "main")
+    commit_file(checkout, "lib.py", "zero\none\ntwo\nthree\n", "add zero")
+
+    return PublishThing().shell_in(str(tmp_path)).git_repo("proj")
+
+
+def test_squash_without_checkout(repo: git.GitRepo) -> None:
+    checkout = repo.checkout_location
+    head = run(checkout, "rev-parse", "HEAD")
+    assert repo.can_merge_tree
+
+    tree = repo.merge_tree("main", "feature")
+    commit = repo.commit_tree(
+        tree, ["main"], "squashed", author=repo.read_author("feature")
+    )
+
+    assert run(checkout, "show", "%s:lib.py" % commit) == (
+        "zero\none\ntwo\nthree\nfour"
+    )
+    assert run(checkout, "show", "%s:new.py" % commit) == "new"
+    assert run(checkout, "rev-parse", "%s^@" % commit) == head
+    assert run(checkout, "log", "-1", "--format=%an <%ae>|%cn", commit) == (
+        "Pr Author <author@example.com>|Some Committer"
+    )
+
+    # nothing moved in the checkout
+    assert run(checkout, "rev-parse", "HEAD") == head
+    assert run(checkout, "status", "--porcelain") == ""
+
+
+def test_merge_tree_conflict(repo: git.GitRepo) -> None:
+    checkout = repo.checkout_location
+    run(checkout, "checkout", "-q", "feature")
+    commit_file(checkout, "lib.py", "uno\n", "conflicting")
+
+    with pytest.raises(git.GitError, match="conflicts"):
+        repo.merge_tree("main", "feature")
+
+
+def test_gerrit_commit_tree(repo: git.GitRepo, monkeypatch: Any) -> None:
+    checkout = repo.checkout_location
+    repo.enable_gerrit("bot", "bot@example.com", "bot", "pw", rev="main")
+    assert repo.gerrit.change_triplet("Iabc") == "org%2Fproj~main~Iabc"
+
+    tree = repo.merge_tree("main", "feature")
+    commit, change_id = repo.gerrit.commit_tree(tree, "main", "squashed\n")
+    assert change_id.startswith("I") and len(change_id) == 41
+    assert run(checkout, "log", "-1", "--format=%B", commit) == (
+        "squashed\n\nChange-Id: %s" % change_id
+    )
+
+    # given a commit id for the parent, no git command is run for the
+    # Change-Id
+    main = run(checkout, "rev-parse", "main")
+    monkeypatch.setattr(
+        repo, "cmd_shell", lambda: pytest.fail("ran git")  # type: ignore
+    )
+    assert repo.gerrit._create_change_id("squashed\n", tree, main)
+    monkeypatch.undo()
+    assert run(checkout, "log", "-1", "--format=%P", commit) == main
+
+    again, same_change_id = repo.gerrit.commit_tree(
+        tree, "main", "squashed\n", change_id="Iexisting"
+    )
+    assert same_change_id == "Iexisting"
+    assert run(checkout, "log", "-1", "--format=%B", again).endswith(
+        "\nChange-Id: Iexisting"
+    )
+
+
+def test_hash_commit_matches_git(repo: git.GitRepo) -> None:
+    payload = (
+        "tree %s\nauthor A <a@example.com> 1700000000 +0100\n"
+        "committer C <c@example.com> 1700000000 +0100\n\nmessage\né\n"
+        % run(repo.checkout_location, "rev-parse", "main^{tree}")
+    )
+    hashed = subprocess.run(
+        ["git", "hash-object", "-t", "commit", "--stdin"],
+        input=payload.encode("utf-8"),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout.decode("ascii")
+    assert git.hash_commit(payload) == hashed.strip()
+
+
+def test_gerrit_commit_once(repo: git.GitRepo, monkeypatch: Any) -> None:
+    checkout = repo.checkout_location
+    repo.enable_gerrit("bot", "bot@example.com", "bot", "pw")
+    base = run(checkout, "rev-parse", "HEAD")
+    reflog = run(checkout, "reflog").splitlines()
+    with open(os.path.join(checkout, "lib.py"), "a") as f:
+        f.write("four\n")
+    run(checkout, "add", "lib.py")
+
+    commands = []
+    output_shell_cmd = repo.shell.__class__.output_shell_cmd
+
+    def record(self: Any, *args: str, **kw: Any) -> Any:
+        commands.append(args[1])
+        return output_shell_cmd(self, *args, **kw)
+
+    monkeypatch.setattr(repo.shell.__class__, "output_shell_cmd", record)
+    change_id = repo.gerrit.commit(
+        "fix\n", author="Pr Author <pr@example.com>", parent=base
+    )
+    monkeypatch.undo()
+
+    assert commands == ["write-tree"]
+    assert run(checkout, "rev-parse", "HEAD^") == base
+    assert run(checkout, "log", "-1", "--format=%B") == (
+        "fix\n\nChange-Id: %s" % change_id
+    )
+    # committed once, not committed and amended
+    assert len(run(checkout, "reflog").splitlines()) == len(reflog) + 1
+
+
+def test_worktree_pool(repo: git.GitRepo) -> None:
+    checkout = repo.checkout_location
+    main = run(checkout, "rev-parse", "main")
+    feature = run(checkout, "rev-parse", "feature")
+
+    with repo.worktrees.checkout("main") as first:
+        with repo.worktrees.checkout("feature") as second:
+            assert first.checkout_location != second.checkout_location
+            assert first.rev_parse("HEAD") == main
+            assert second.rev_parse("HEAD") == feature
+            assert first.rev_parse("feature") == feature
+
+            # a new file and a modified one, left behind
+            with open(os.path.join(first.checkout_location, "x"), "w") as f:
+                f.write("x")
+            with open(os.path.join(first.checkout_location, "lib.py"), "w"):
+                pass
+
+    with repo.worktrees.checkout("feature") as again:
+        # the first slot free, cleaned and moved to the new revision
+        assert again.checkout_location == first.checkout_location
+        assert again.rev_parse("HEAD") == feature
+        assert run(again.checkout_location, "status", "--porcelain") == ""
+
+    # one object store, and the main checkout untouched
+    assert not os.path.isdir(os.path.join(again.checkout_location, ".git"))
+    assert run(checkout, "rev-parse", "HEAD") == main
+
+
+def test_worktree_pool_waits_for_a_slot(repo: git.GitRepo) -> None:
+    repo.thing.opts["git_worktree_pool_size"] = 1
+    pool = repo.worktrees
+    assert pool.size == 1
+    order = []
+
+    def second_job() -> None:
+        with pool.checkout("feature"):
+            order.append("second")
+
+    with pool.checkout("main"):
+        thread = threading.Thread(target=second_job)
+        thread.start()
+        thread.join(0.5)
+        order.append("first")
+    thread.join()
+
+    assert order == ["first", "second"]
+
+
+def test_targeted_fetch_into_partial_clone(
+    repo: git.GitRepo, tmp_path: Any
+) -> None:
+    origin = repo.checkout_location
+    run(origin, "config", "uploadpack.allowFilter", "true")
+    run(origin, "update-ref", "refs/pull/5/head", "feature")
+    (tmp_path / "clones").mkdir()
+
+    clone = repo.thing.shell_in(str(tmp_path / "clones")).git_repo(
+        "proj", origin="file://%s" % origin, create=True, filter_="blob:none"
+    )
+    assert clone.was_created
+    assert run(
+        clone.checkout_location, "config", "remote.origin.promisor"
+    ) == ("true")
+
+    run(origin, "checkout", "-q", "main")
+    main = commit_file(origin, "lib.py", "changed\n", "on main")
+    run(origin, "checkout", "-q", "feature")
+    commit_file(origin, "lib.py", "changed too\n", "on feature")
+    feature = run(clone.checkout_location, "rev-parse", "origin/feature")
+
+    clone.fetch_branch("main")
+    clone.fetch_pull_request(5, "refs/publishthing/pull/5")
+
+    assert clone.rev_parse("origin/main") == main
+    assert clone.rev_parse("origin/feature") == feature
+    assert clone.rev_parse("refs/publishthing/pull/5") == run(
+        origin, "rev-parse", "refs/pull/5/head"
+    )
+
+
+def test_fetch_arguments(repo: git.GitRepo, monkeypatch: Any) -> None:
+    calls = []
+    monkeypatch.setattr(
+        repo.shell.__class__,
+        "call_shell_cmd",
+        lambda self, *args: calls.append(args),
+    )
+    # as if the clone was made shallow and partial
+    repo.shallow_since = "2024-01-01"
+    repo.filter_ = "blob:none"
+
+    repo.fetch()
+    repo.fetch(all_=True)
+    repo.fetch(refspecs=["main"], depth=5)
+    with pytest.raises(git.GitError, match="Only one of"):
+        repo.fetch(depth=5, shallow_since="2024-01-01")
+
+    # the shallow boundary of the clone isn't reapplied; a fetch's own
+    # replaces it
+    assert calls == [
+        ("git", "fetch", "--filter", "blob:none"),
+        ("git", "fetch", "--filter", "blob:none", "--all"),
+        (
+            "git",
+            "fetch",
+            "--depth",
+            "5",
+            "--filter",
+            "blob:none",
+            "origin",
+            "main",
+        ),
+    ]
+
+    with pytest.raises(git.GitError, match="Only one of"):
+        repo.shell.git_repo("proj", depth=5, shallow_since="2024-01-01")
+
+
+def test_deepen_to_merge_base(repo: git.GitRepo, tmp_path: Any) -> None:
+    origin = repo.checkout_location
+    run(origin, "update-ref", "refs/pull/5/head", "feature")
+    merge_base = run(origin, "merge-base", "main", "feature")
+    run(origin, "checkout", "-q", "main")
+    for num in range(4):
+        commit_file(origin, "more.py", "%d\n" % num, "more %d" % num)
+    (tmp_path / "clones").mkdir()
+
+    clone = repo.thing.shell_in(str(tmp_path / "clones")).git_repo(
+        "proj", origin="file://%s" % origin, create=True, depth=2
+    )
+    pull_ref = "refs/publishthing/pull/5"
+    clone.fetch_branch("main")
+    clone.fetch_pull_request(5, pull_ref)
+    assert clone.is_shallow
+    assert clone.merge_base("origin/main", pull_ref) is None
+
+    # one step of deepening isn't enough here; the rest is fetched
+    clone._deepen_steps = (1,)  # type: ignore
+    refspecs = [
+        clone.branch_refspec("main"),
+        clone.pull_request_refspec(5, pull_ref),
+    ]
+    assert (
+        clone.deepen_to_merge_base("origin/main", pull_ref, refspecs)
+        == merge_base
+    )
+    assert not clone.is_shallow
+    tree = clone.merge_tree("origin/main", pull_ref)
+    assert run(clone.checkout_location, "show", "%s:new.py" % tree) == "new"
+
+    # truly unrelated history is reported as such, not as a conflict
+    run(origin, "checkout", "-q", "--orphan", "unrelated")
+    commit_file(origin, "other.py", "other\n", "unrelated")
+    run(origin, "update-ref", "refs/pull/6/head", "unrelated")
+    clone.fetch_pull_request(6, "refs/publishthing/pull/6")
+    with pytest.raises(git.GitError, match="no history in common"):
+        clone.deepen_to_merge_base(
+            "origin/main", "refs/publishthing/pull/6", refspecs
+        )
+
+
+def test_concurrent_fetches_wait_for_each_other(
+    repo: git.GitRepo, tmp_path: Any
+) -> None:
+    origin = repo.checkout_location
+    (tmp_path / "clones").mkdir()
+    clone = repo.thing.shell_in(str(tmp_path / "clones")).git_repo(
+        "proj", origin="file://%s" % origin, create=True, depth=1
+    )
+    main = commit_file(origin, "lib.py", "changed\n", "on main")
+    for number in range(1, 5):
+        run(origin, "update-ref", "refs/pull/%d/head" % number, "feature")
+
+    errors = []
+
+    def fetch(number: int) -> None:
+        pull_ref = "refs/publishthing/pull/%d" % number
+        try:
+            with clone.fetch_lock():
+                clone.fetch_branch("main")
+                clone.fetch_pull_request(number, pull_ref)
+                clone.deepen_to_merge_base(
+                    "origin/main",
+                    pull_ref,
+                    refspecs=[
+                        clone.branch_refspec("main"),
+                        clone.pull_request_refspec(number, pull_ref),
+                    ],
+                )
+        except Exception as err:
+            errors.append(err)
+
+    threads = [
+        threading.Thread(target=fetch, args=(number,))
+        for number in range(1, 5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert clone.rev_parse("origin/main") == main
+
+
+def count_objects(path: str) -> Dict[str, str]:
+    return dict(
+        line.split(": ", 1)
+        for line in run(path, "count-objects", "-v").splitlines()
+    )
+
+
+def test_clone_borrows_objects(repo: git.GitRepo, tmp_path: Any) -> None:
+    lender = repo.checkout_location
+    (tmp_path / "clones").mkdir()
+    shell = repo.thing.shell_in(str(tmp_path / "clones"))
+
+    clone = shell.git_repo(
+        "proj", origin="file://%s" % lender, create=True, reference=lender
+    )
+    with open(clone._alternates_path) as f:
+        assert f.read().strip() == os.path.join(lender, ".git", "objects")
+    assert count_objects(clone.checkout_location)["size-pack"] == "0"
+    assert run(lender, "config", "gc.pruneExpire") == "never"
+
+    # opening it again doesn't add to the alternates, nor look at the
+    # reference's configuration
+    run(lender, "config", "--unset", "gc.pruneExpire")
+    shell.git_repo("proj", reference=lender)
+    with open(clone._alternates_path) as f:
+        assert len(f.readlines()) == 1
+
+    assert (
+        subprocess.call(["git", "config", "gc.pruneExpire"], cwd=str(lender))
+        == 1
+    )
+    run(clone.checkout_location, "fsck", "--no-progress")
+
+
+def test_existing_clone_starts_borrowing(
+    repo: git.GitRepo, tmp_path: Any
+) -> None:
+    lender = repo.checkout_location
+    (tmp_path / "clones").mkdir()
+    shell = repo.thing.shell_in(str(tmp_path / "clones"))
+    clone = shell.git_repo("proj", origin="file://%s" % lender, create=True)
+    assert count_objects(clone.checkout_location)["size-pack"] != "0"
+
+    clone = shell.git_repo("proj", reference=lender)
+    assert count_objects(clone.checkout_location)["size-pack"] == "0"
+    run(clone.checkout_location, "fsck", "--no-progress")
+
+    clone = shell.git_repo("proj", reference=lender, dissociate=True)
+    assert not os.path.exists(clone._alternates_path)
+    assert count_objects(clone.checkout_location)["size-pack"] != "0"
+    run(clone.checkout_location, "fsck", "--no-progress")
+
+
+def test_concurrent_opens_borrow_once(
+    repo: git.GitRepo, tmp_path: Any
+) -> None:
+    lender = repo.checkout_location
+    (tmp_path / "clones").mkdir()
+    shell = repo.thing.shell_in(str(tmp_path / "clones"))
+    clone = shell.git_repo("proj", origin="file://%s" % lender, create=True)
+
+    errors = []
+
+    def open_clone() -> None:
+        try:
+            shell.git_repo("proj", reference=lender)
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=open_clone) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with open(clone._alternates_path) as f:
+        assert len(f.readlines()) == 1
+    run(clone.checkout_location, "fsck", "--no-progress")
@@ -0,0 +1,401 @@
+"""Tests for GithubRepo's transport: pagination against a local server.
+
+The server stands in for api.github.com closely enough for the parts
+that matter here, numbered pages linked by a Link header.
+
+"""
+
+import asyncio
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+from typing import Any
+from typing import Iterator
+from typing import List
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from publishthing import PublishThing
+from publishthing.apps.prgate import util as prgate_util
+import pytest
+
+PAGES = 6
+PER_PAGE = 3
+
+
+class PagedListing(BaseHTTPRequestHandler):
+    server: Any
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        page = int(query.get("page", ["1"])[0])
+
+        with self.server.lock:
+            self.server.requested.append(page)
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(
+                self.server.max_in_flight, self.server.in_flight
+            )
+        try:
+            # later pages answer sooner, so out-of-order completion is
+            # the norm rather than the exception
+            time.sleep(float(query.get("delay", [0.01 * (PAGES - page)])[0]))
+
+            base = "http://127.0.0.1:%s%s" % (
+                self.server.server_port,
+                parts.path,
+            )
+            links = []
+            if page < PAGES:
+                links.append('<%s?page=%s>; rel="next"' % (base, page + 1))
+                links.append('<%s?page=%s>; rel="last"' % (base, PAGES))
+            body = json.dumps(
+                [page * 100 + idx for idx in range(PER_PAGE)]
+            ).encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if links:
+                self.send_header("Link", ", ".join(links))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def log_message(self, *arg: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[ThreadingHTTPServer]:
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), PagedListing)
+    httpd.lock = threading.Lock()
+    httpd.requested = []
+    httpd.in_flight = 0
+    httpd.max_in_flight = 0
+    thread = threading.Thread(
+        target=httpd.serve_forever, args=(0.01,), daemon=True
+    )
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def listing_url(httpd: ThreadingHTTPServer) -> str:
+    return "http://127.0.0.1:%s/repos/o/r/labels" % httpd.server_port
+
+
+def expected() -> List[int]:
+    return [
+        page * 100 + idx
+        for page in range(1, PAGES + 1)
+        for idx in range(PER_PAGE)
+    ]
+
+
+def gh_repo(concurrency: int = 1) -> Any:
+    thing = PublishThing(
+        github_access_token="token", github_api_concurrency=concurrency
+    )
+    return thing.github_repo("o/r")
+
+
+def test_serial_pagination(server):
+    records = list(gh_repo()._yield_with_links(listing_url(server)))
+    assert records == expected()
+    assert server.max_in_flight == 1
+
+
+def test_concurrent_pagination_keeps_page_order(server):
+    records = list(gh_repo(3)._yield_with_links(listing_url(server)))
+    assert records == expected()
+    assert sorted(server.requested) == list(range(1, PAGES + 1))
+    assert 1 < server.max_in_flight <= 3
+
+
+def test_parallel_false_follows_next_links(server):
+    records = list(
+        gh_repo(3)._yield_with_links(listing_url(server), parallel=False)
+    )
+    assert records == expected()
+    assert server.max_in_flight == 1
+
+
+def test_read_ahead_fetches_the_next_page_while_consuming(server):
+    records = gh_repo()._yield_with_links(listing_url(server), read_ahead=True)
+
+    assert next(records) == 100
+    # page 2 is requested without the consumer asking for more
+    deadline = time.time() + 5
+    while 2 not in server.requested and time.time() < deadline:
+        time.sleep(0.01)
+    assert server.requested == [1, 2]
+
+    assert [100] + list(records) == expected()
+    assert server.max_in_flight == 1
+
+
+def test_concurrent_identical_gets_share_one_request(server):
+    thing = PublishThing(github_access_token="token")
+    url = "%s?page=%s&delay=0.3" % (listing_url(server), PAGES)
+    barrier = threading.Barrier(5)
+    results = []
+
+    def get() -> None:
+        # separate GithubRepo objects, as separate handlers would have
+        gh = thing.github_repo("o/r")
+        barrier.wait()
+        results.append(gh._api_get(url).json())
+
+    threads = [threading.Thread(target=get) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert server.requested == [PAGES]
+    assert len(results) == 5 and all(r == results[0] for r in results)
+
+
+def test_only_requests_that_go_out_are_paced(server, monkeypatch):
+    thing = PublishThing(
+        github_access_token="token", http_cache_ttls={r"/labels": 60}
+    )
+    gh = thing.github_repo("o/r")
+    claims = []
+    monkeypatch.setattr(
+        gh.rate_limiter, "acquire", lambda **kw: claims.append(kw) or False
+    )
+
+    gh._api_get(listing_url(server))
+    gh._api_get(listing_url(server))
+    assert server.requested == [1]
+    assert len(claims) == 1
+
+
+def test_async_listing_and_bounded_concurrency(server):
+    thing = PublishThing(github_access_token="token", github_api_concurrency=3)
+    gh = thing.async_github_repo("o/r")
+
+    async def go() -> Any:
+        records = [
+            rec async for rec in gh._yield_with_links(listing_url(server))
+        ]
+        pages = await asyncio.gather(
+            *[
+                gh._run(
+                    gh.sync._api_get,
+                    "%s?page=%s&delay=0.05" % (listing_url(server), page),
+                )
+                for page in range(1, PAGES + 1)
+            ]
+        )
+        return records, pages
+
+    try:
+        records, pages = asyncio.run(go())
+    finally:
+        thing.close()
+
+    assert records == expected()
+    assert [resp.json()[0] for resp in pages] == [
+        page * 100 for page in range(1, PAGES + 1)
+    ]
+    assert server.max_in_flight == 3
+
+
+def test_async_clients_are_pooled_and_closed(server):
+    thing = PublishThing(github_access_token="token")
+    gh = thing.async_github_repo("o/r")
+    assert thing.async_github_repo("o/r") is gh
+    assert thing.async_github_repo("o/other") is not gh
+
+    async def labels() -> Any:
+        return [rec async for rec in gh._yield_with_links(listing_url(server))]
+
+    assert asyncio.run(labels()) == expected()
+    executor = gh._executor
+    assert executor is not None
+
+    thing.close()
+    assert gh._executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(lambda: None)
+
+    # a closed client starts a new pool when it's used again
+    try:
+        assert asyncio.run(labels()) == expected()
+    finally:
+        thing.close()
+
+
+def test_prefetch_issues_matches_the_rest_shapes():
+    gh = gh_repo()
+    gh._api_graphql = lambda query, variables: (
+        {
+            "repository": {
+                "i1": {
+                    "__typename": "Issue",
+                    "number": 1,
+                    "state": "OPEN",
+                    "labels": {"nodes": [{"name": "bug"}]},
+                },
+                "i2": {
+                    "__typename": "PullRequest",
+                    "number": 2,
+                    "state": "MERGED",
+                    "url": "https://github.com/o/r/pull/2",
+                },
+                "i3": None,
+                "collaborators": {
+                    "edges": [
+                        {"permission": "READ", "node": {"login": "someone"}},
+                        {"permission": "MAINTAIN", "node": {"login": "Zz"}},
+                    ]
+                },
+            }
+        },
+        [{"type": "NOT_FOUND", "path": ["repository", "i3"]}],
+    )
+    prefetched = gh.prefetch_issues([1, 2, 3], "zz")
+
+    assert prefetched.issues["1"] == {
+        "number": 1,
+        "state": "open",
+        "labels": [{"name": "bug"}],
+    }
+    pull_request = prefetched.issues["2"]
+    assert pull_request["state"] == "closed" and pull_request["pull_request"]
+    assert prefetched.issues["3"] is None
+    assert prefetched.permissions["zz"]["permission"] == "write"
+
+
+def test_prefetch_leaves_out_a_user_not_found_exactly():
+    gh = gh_repo()
+    # a search for "zz" whose first hits are other people
+    gh._api_graphql = lambda query, variables: (
+        {
+            "repository": {
+                "collaborators": {
+                    "edges": [
+                        {"permission": "READ", "node": {"login": "zzyzx"}}
+                    ]
+                }
+            }
+        },
+        [],
+    )
+    prefetched = gh.prefetch_issues([], "zz")
+    assert prefetched.permissions == {}
+
+    gh.get_user_permission = lambda username: {"permission": "admin"}
+    assert prgate_util.user_has_write_permission(gh, "zz", prefetched)
+
+
+def test_failed_prefetch_loads_nothing():
+    gh = gh_repo()
+    gh._api_graphql = lambda query, variables: (
+        {},
+        [{"type": "FORBIDDEN", "message": "no"}],
+    )
+    assert gh.prefetch_issues([1, 2], "zz") == ({}, {})
+
+
+def test_prefetch_variables_match_the_query():
+    gh = gh_repo()
+    requests = []
+
+    def graphql(query: str, variables: Any) -> Any:
+        requests.append((query, variables))
+        return {"repository": {}}, []
+
+    gh._api_graphql = graphql
+    gh.prefetch_issues([1, 2])
+    gh.prefetch_issues([1], "zz")
+
+    for query, variables in requests:
+        declared = set(re.findall(r"\$(\w+):", query))
+        used = set(re.findall(r"\$(\w+)\b(?!:)", query))
+        assert declared == used == set(variables)
+    assert "login" not in requests[0][1]
+    assert requests[1][1]["login"] == "zz"
+
+
+class FakeResponse:
+    def __init__(self, rec: Any) -> None:
+        self.rec = rec
+
+    def json(self) -> Any:
+        return self.rec
+
+
+def test_prefetch_is_only_for_one_evaluation():
+    thing = PublishThing(github_access_token="token")
+    gh = thing.github_repo("o/r")
+    issue_state = {1: "open", 2: "open"}
+
+    gh._api_graphql = lambda query, variables: (
+        {
+            "repository": {
+                "i%d"
+                % number: {
+                    "__typename": "Issue",
+                    "number": number,
+                    "state": state.upper(),
+                    "labels": {"nodes": [{"name": "ok"}]},
+                }
+                for number, state in issue_state.items()
+            }
+            | {
+                "collaborators": {
+                    "edges": [{"permission": "WRITE", "node": {"login": "m"}}]
+                }
+            }
+        },
+        [],
+    )
+    rest_gets = []
+
+    def api_get(url: str, **kw: Any) -> Any:
+        rest_gets.append(url)
+        number = int(url.rsplit("/", 1)[1])
+        return FakeResponse(
+            {"state": issue_state[number], "labels": [{"name": "ok"}]}
+        )
+
+    gh._api_get = api_get
+
+    # a maintainer is let through before the issues that were loaded
+    # with the permission are looked at
+    result = prgate_util.evaluate_pr(gh, "o/r", "m", "fix", "#1 #2", "ok")
+    assert result.reason == prgate_util.ALLOW_MAINTAINER
+
+    # then the issue is closed; the next evaluation, on the same cached
+    # GithubRepo, mustn't be answered from the first one's records
+    issue_state[1] = "closed"
+    assert thing.github_repo("o/r") is gh
+    result = prgate_util.evaluate_pr(
+        gh, "o/r", "m", "fix", "#1", "ok", exempt_maintainers=False
+    )
+    assert result == prgate_util.GateResult(
+        "close", prgate_util.CLOSE_ISSUE_CLOSED, 1
+    )
+    assert rest_gets == ["https://api.github.com/repos/o/r/issues/1"]
+
+
+def test_clients_are_pooled_per_thing():
+    thing = PublishThing(github_access_token="token")
+    one = thing.github_repo("o/r")
+
+    assert thing.github_repo("o/r") is one
+    assert thing.github_repo("o/other") is not one
+    assert thing.github_repo("o/other").session.get_adapter(
+        "https://api.github.com/repos/o/other"
+    ) is one.session.get_adapter("https://api.github.com/repos/o/r")
@@ -0,0 +1,160 @@
+"""Tests for GitHub App authentication against a local stand-in API."""
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+import threading
+import time
+from typing import Any
+from typing import Iterator
+
+from publishthing import githubauth
+from publishthing import PublishThing
+import pytest
+
+jwt = pytest.importorskip("jwt")
+rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+serialization = pytest.importorskip(
+    "cryptography.hazmat.primitives.serialization"
+)
+
+APP_ID = "1234"
+
+
+class AppApi(BaseHTTPRequestHandler):
+    server: Any
+
+    def _respond(self, status: int, rec: Any) -> None:
+        body = json.dumps(rec).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _claims(self) -> Any:
+        scheme, _, token = self.headers["Authorization"].partition(" ")
+        assert scheme == "Bearer"
+        return jwt.decode(token, self.server.public_key, algorithms=["RS256"])
+
+    def do_GET(self) -> None:
+        assert self._claims()["iss"] == APP_ID
+        self.server.requested.append(("GET", self.path))
+        if self.path == "/repos/o/r/installation":
+            self._respond(200, {"id": 77})
+        else:
+            self._respond(404, {"message": "Not Found"})
+
+    def do_POST(self) -> None:
+        assert self._claims()["iss"] == APP_ID
+        self.server.requested.append(("POST", self.path))
+        self.server.minted += 1
+        self._respond(
+            201,
+            {
+                "token": "ghs_%d" % self.server.minted,
+                "expires_at": time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ",
+                    time.gmtime(time.time() + self.server.lifetime),
+                ),
+            },
+        )
+
+    def log_message(self, *arg: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def private_key() -> Any:
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def server(private_key: Any) -> Iterator[ThreadingHTTPServer]:
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), AppApi)
+    httpd.public_key = private_key.public_key()
+    httpd.requested = []
+    httpd.minted = 0
+    httpd.lifetime = 3600
+    thread = threading.Thread(
+        target=httpd.serve_forever, args=(0.01,), daemon=True
+    )
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def pem(private_key: Any) -> str:
+    return private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode("ascii")
+
+
+def app_auth(
+    server: ThreadingHTTPServer, private_key: Any, **kw: Any
+) -> githubauth.GithubAppAuth:
+    return githubauth.GithubAppAuth(
+        APP_ID,
+        pem(private_key),
+        api_url="http://127.0.0.1:%s" % server.server_port,
+        **kw,
+    )
+
+
+def test_installation_token_is_minted_and_reused(
+    server: ThreadingHTTPServer, private_key: Any
+) -> None:
+    auth = app_auth(server, private_key)
+
+    assert auth.token("o/r") == "ghs_1"
+    assert auth.token("o/r") == "ghs_1"
+    assert auth.identity("o/r") == "app:1234:installation:77"
+
+    assert server.requested == [
+        ("GET", "/repos/o/r/installation"),
+        ("POST", "/app/installations/77/access_tokens"),
+    ]
+
+
+def test_installation_from_mapping(
+    server: ThreadingHTTPServer, private_key: Any
+) -> None:
+    auth = app_auth(server, private_key, installations={"o": 5})
+
+    assert auth.token("o/other") == "ghs_1"
+    assert server.requested == [("POST", "/app/installations/5/access_tokens")]
+
+
+def test_token_refreshed_near_expiry(
+    server: ThreadingHTTPServer, private_key: Any
+) -> None:
+    server.lifetime = githubauth.GithubAppAuth.refresh_margin - 10
+    auth = app_auth(server, private_key)
+
+    assert auth.token("o/r") == "ghs_1"
+    assert auth.token("o/r") == "ghs_2"
+
+
+def test_github_repo_sends_installation_token(
+    server: ThreadingHTTPServer, private_key: Any
+) -> None:
+    thing = PublishThing(
+        github_app_id=APP_ID,
+        github_app_private_key=pem(private_key),
+        github_api_url="http://127.0.0.1:%s" % server.server_port,
+    )
+    gh_repo = thing.github_repo("o/r")
+
+    assert gh_repo._auth_headers() == {"Authorization": "token ghs_1"}
+    assert gh_repo.auth_identity == "app:1234:installation:77"
+
+
+def test_personal_token_by_default() -> None:
+    thing = PublishThing(github_access_token="abc")
+    gh_repo = thing.github_repo("o/r")
+
+    assert gh_repo._auth_headers() == {"Authorization": "token abc"}
+    assert gh_repo.auth_identity == "abc"
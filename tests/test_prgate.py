@@ -11,6 +11,7 @@ from typing import Dict
 from typing import List
 from typing import Optional
 
+from publishthing import github
 from publishthing.apps.prgate import util
 import pytest
 
@@ -30,6 +31,13 @@ class FakeRepo:
         self.issues = issues or {}
         self.permission = permission
         self.requested: List[str] = []
+        self.prefetched: List[Any] = []
+
+    def prefetch_issues(
+        self, issue_numbers: List[int], username: Optional[str] = None
+    ) -> github.PrefetchedRecords:
+        self.prefetched.append((list(issue_numbers), username))
+        return github.PrefetchedRecords({}, {})
 
     def get_user_permission(self, username: str) -> Optional[Dict[str, Any]]:
         if self.permission is None:
@@ -410,3 +418,17 @@ def test_other_pr_labels_do_not_override():
         repo, REPO, "someone", "fix", "", LABEL, pr_labels=["bug", "typing"]
     )
     assert result == util.GateResult("close", util.CLOSE_NO_ISSUE, None)
+
+
+def test_issues_and_permission_are_prefetched_in_one_call():
+    repo = FakeRepo({1: issue(labels=["bug"]), 2: issue(labels=[LABEL])})
+    util.evaluate_pr(repo, REPO, "someone", "fix", "#1 #2", LABEL)
+    assert repo.prefetched == [([1, 2], "someone")]
+
+
+def test_nothing_to_batch_is_not_prefetched():
+    repo = FakeRepo({1: issue(labels=[LABEL])})
+    util.evaluate_pr(
+        repo, REPO, "someone", "fix", "#1", LABEL, exempt_maintainers=False
+    )
+    assert repo.prefetched == []
@@ -11,6 +11,7 @@ from typing import Dict
 from typing import List
 from typing import Optional
 
+from publishthing import github
 from publishthing.apps import prgate
 from publishthing.apps.prgate import github as prgate_github
 from publishthing.apps.prgate import messages
@@ -37,6 +38,11 @@ class FakeRepo:
         self.labels_added: List[Any] = []
         self.labels_removed: List[Any] = []
 
+    def prefetch_issues(
+        self, issue_numbers: List[int], username: Optional[str] = None
+    ) -> github.PrefetchedRecords:
+        return github.PrefetchedRecords({}, {})
+
     def get_user_permission(self, username: str) -> Optional[Dict[str, Any]]:
         if self.permission is None:
             return None
@@ -0,0 +1,109 @@
+import threading
+from typing import Any
+from typing import Dict
+from typing import List
+
+from publishthing.apps.prtogerrit import util
+
+
+def stamp(minute: int) -> str:
+    return "2024-01-31 12:%02d:00.000000000" % minute
+
+
+class FakeGerritApi:
+    def __init__(self, reviews: int) -> None:
+        self.messages: List[Dict[str, Any]] = []
+        self.inline: Dict[str, List[Dict[str, Any]]] = {"lib.py": []}
+        for idx in range(reviews):
+            message_id = "m%d" % idx
+            self.messages.append(
+                {
+                    "id": message_id,
+                    "date": stamp(idx),
+                    "message": "Patch Set 1:\n\nreview %d" % idx,
+                }
+            )
+            self.inline["lib.py"].append(
+                {
+                    "change_message_id": message_id,
+                    "patch_set": 1,
+                    "updated": stamp(idx),
+                    "commit_id": "c1",
+                    "author": {"username": "rev"},
+                    "line": idx + 1,
+                    "message": "line comment %d" % idx,
+                }
+            )
+
+    def get_change_standalone_comments(self, change: str) -> Dict[str, Any]:
+        return {"messages": self.messages}
+
+    def get_change_inline_comments(self, change: str) -> Dict[str, Any]:
+        return self.inline
+
+
+class BarrierGerritApi(FakeGerritApi):
+    """Each call waits for the other, so only succeeds if both overlap."""
+
+    def __init__(self, reviews: int) -> None:
+        super().__init__(reviews)
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def get_change_standalone_comments(self, change: str) -> Dict[str, Any]:
+        self.barrier.wait()
+        return super().get_change_standalone_comments(change)
+
+    def get_change_inline_comments(self, change: str) -> Dict[str, Any]:
+        self.barrier.wait()
+        return super().get_change_inline_comments(change)
+
+
+def test_fetches_concurrently() -> None:
+    comments = util.GerritComments(BarrierGerritApi(3), "5")
+
+    assert len(list(comments)) == 3
+
+
+def test_full_scan() -> None:
+    comments = util.GerritComments(FakeGerritApi(5), "5")
+
+    assert len(list(comments)) == 5
+    found = comments.most_recent_comment_matching("rev", "review 1")
+    assert found is not None
+    assert found["change_message_id"] == "m1"
+
+
+def test_match_prefers_hook_username() -> None:
+    api = FakeGerritApi(3)
+    # the same text left later by someone else
+    api.messages[2]["message"] = api.messages[0]["message"]
+    api.inline["lib.py"][2]["author"] = {"username": "other"}
+    comments = util.GerritComments(api, "5")
+
+    found = comments.most_recent_comment_matching("rev", "review 0")
+    assert found is not None and found["change_message_id"] == "m0"
+
+    found = comments.most_recent_comment_matching("someone", "review 0")
+    assert found is not None and found["change_message_id"] == "m2"
+
+    found = comments.most_recent_comment_matching(None, "review 0")
+    assert found is not None and found["change_message_id"] == "m2"
+
+
+def test_messages_normalized_once(monkeypatch: Any) -> None:
+    calls: List[str] = []
+    normalize = util.GerritComments._normalize_message
+
+    def counting(message: str) -> str:
+        calls.append(message)
+        return normalize(message)
+
+    monkeypatch.setattr(
+        util.GerritComments, "_normalize_message", staticmethod(counting)
+    )
+    comments = util.GerritComments(FakeGerritApi(20), "5")
+    for idx in range(20):
+        assert comments.most_recent_comment_matching("rev", "review %d" % idx)
+
+    # each review's command line message, then each hook text
+    assert len(calls) == 40
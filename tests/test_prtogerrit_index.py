@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+from typing import Any
+from typing import Dict
+from typing import List
+
+from publishthing import PublishThing
+from publishthing.apps.prtogerrit import index
+from publishthing.apps.prtogerrit import util
+import pytest
+
+PR_URL = "https://github.com/o/r/pull/7"
+
+
+class FakeGerritApi:
+    def __init__(self, results: List[Dict[str, Any]]) -> None:
+        self.results = results
+        self.searches: List[Dict[str, str]] = []
+
+    def search(self, **kw: str) -> List[Dict[str, Any]]:
+        self.searches.append(kw)
+        return self.results
+
+    def get_change_current_revision(self, change: str) -> Dict[str, Any]:
+        message = "fix\n\nPull-request: %s\nPull-request-sha: p1\n" % (PR_URL)
+        return dict(
+            self.results[0],
+            current_revision="g1",
+            revisions={"g1": {"commit": {"message": message}}},
+        )
+
+
+def make_thing(tmp_path: Any, results: List[Dict[str, Any]]) -> PublishThing:
+    thing = PublishThing(prtogerrit_index_path=str(tmp_path / "index.db"))
+    thing.gerrit_api = FakeGerritApi(results)  # type: ignore
+    return thing
+
+
+def change_rec(status: str = "NEW") -> Dict[str, Any]:
+    return {"id": "o%2Fr~main~Iabc", "change_id": "Iabc", "status": status}
+
+
+def test_index_round_trip(tmp_path: Any) -> None:
+    pr_index = index.PullRequestIndex(str(tmp_path / "index.db"))
+    assert pr_index.lookup("o/r", 7) is None
+
+    pr_index.record(
+        "o/r", 7, "o%2Fr~main~Iabc", "Iabc", revision="g1", pullreq_sha="p1"
+    )
+    pr_index.record(
+        "o/r", 7, "o%2Fr~main~Iabc", "Iabc", revision="g2", pullreq_sha="p2"
+    )
+
+    # another process, as it were
+    other = index.PullRequestIndex(str(tmp_path / "index.db"))
+    assert other.lookup("o/r", 7) == ("o%2Fr~main~Iabc", "Iabc")
+    assert other.revision_for("o/r", 7, "p1") == "g1"
+    assert other.revision_for("o/r", 7, "p2") == "g2"
+    assert other.lookup("o/other", 7) is None
+
+    other.forget("o/r", 7)
+    assert pr_index.lookup("o/r", 7) is None
+    assert pr_index.revision_for("o/r", 7, "p1") is None
+
+
+def test_no_index_configured() -> None:
+    assert index.index_for(PublishThing()) is None
+
+
+def test_find_searches_once_then_uses_index(tmp_path: Any) -> None:
+    thing = make_thing(tmp_path, [change_rec()])
+
+    for _ in range(3):
+        found = util.find_gerrit_change(thing, "o/r", 7, PR_URL)
+        assert found == index.IndexedChange("o%2Fr~main~Iabc", "Iabc")
+
+    assert thing.gerrit_api.searches == [  # type: ignore
+        {"message": "Pull-request: %s" % PR_URL}
+    ]
+
+
+@pytest.mark.parametrize("status", ["MERGED", "ABANDONED"])
+def test_closed_changes_not_indexed(tmp_path: Any, status: str) -> None:
+    thing = make_thing(tmp_path, [change_rec(status)])
+
+    assert util.find_gerrit_change(thing, "o/r", 7, PR_URL) is not None
+    assert util.find_gerrit_change(thing, "o/r", 7, PR_URL) is not None
+    assert len(thing.gerrit_api.searches) == 2  # type: ignore
+
+
+def test_hooks_on_closed_changes_take_them_out(tmp_path: Any) -> None:
+    thing = make_thing(tmp_path, [change_rec()])
+    hook = SimpleNamespace(project="o/r", change="o%2Fr~main~Iabc")
+    pr_index = index.index_for(thing)
+    assert pr_index is not None
+
+    util.get_pullreq_for_gerrit_change(thing, hook)  # type: ignore
+    assert pr_index.lookup("o/r", 7) is not None
+    assert pr_index.revision_for("o/r", 7, "p1") == "g1"
+
+    # e.g. a comment on the change after it was merged
+    thing.gerrit_api.results = [change_rec("MERGED")]  # type: ignore
+    util.get_pullreq_for_gerrit_change(thing, hook)  # type: ignore
+    assert pr_index.lookup("o/r", 7) is None
+
+    thing.gerrit_api.results = []  # type: ignore
+    assert (
+        util.find_gerrit_change(thing, "o/r", 7, PR_URL, open_only=True)
+        is None
+    )
+
+
+def test_find_open_only(tmp_path: Any) -> None:
+    thing = make_thing(tmp_path, [])
+
+    assert (
+        util.find_gerrit_change(thing, "o/r", 7, PR_URL, open_only=True)
+        is None
+    )
+    assert thing.gerrit_api.searches == [  # type: ignore
+        {"status": "open", "message": "Pull-request: %s" % PR_URL}
+    ]
@@ -0,0 +1,118 @@
+"""Tests for the shared github rate limiter."""
+
+import time
+from typing import Dict
+from typing import List
+
+from publishthing import ratelimit
+import pytest
+
+
+def headers(remaining: int, reset_in: float) -> Dict[str, str]:
+    return {
+        "X-RateLimit-Limit": "5000",
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(int(time.time() + reset_in)),
+    }
+
+
+@pytest.fixture
+def slept(monkeypatch) -> List[float]:
+    sleeps: List[float] = []
+    monkeypatch.setattr(ratelimit.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_unknown_budget_does_not_wait(slept):
+    ratelimit.RateLimiter().acquire()
+    assert slept == []
+
+
+def test_burst_then_paced(slept):
+    limiter = ratelimit.RateLimiter(reserve=0, burst=3)
+    # 100 requests over 1000 seconds is one every ten seconds
+    limiter.update(headers(100, 1000))
+
+    for _ in range(3):
+        limiter.acquire()
+    assert slept == []
+
+    limiter.acquire()
+    assert slept and 9 < slept[0] < 11
+
+
+def test_exhausted_budget_waits_for_the_exact_reset(slept):
+    limiter = ratelimit.RateLimiter(reserve=100)
+    limiter.update(headers(100, 600))
+
+    limiter.acquire()
+    assert len(slept) == 1 and 595 < slept[0] <= 601
+
+
+def test_exhausted_budget_can_fail_fast(slept):
+    limiter = ratelimit.RateLimiter(reserve=100)
+    limiter.update(headers(50, 600))
+
+    with pytest.raises(ratelimit.RateLimitExceeded):
+        limiter.acquire(block=False)
+    with pytest.raises(ratelimit.RateLimitExceeded):
+        limiter.acquire(max_wait=30)
+    assert slept == []
+
+
+def test_out_of_order_responses_keep_the_lowest_count(slept):
+    limiter = ratelimit.RateLimiter(reserve=100)
+    reset_headers = headers(4000, 600)
+    limiter.update(dict(reset_headers, **{"X-RateLimit-Remaining": "50"}))
+    limiter.update(reset_headers)
+
+    with pytest.raises(ratelimit.RateLimitExceeded):
+        limiter.acquire(block=False)
+
+
+def test_unchanged_counts_do_not_run_down_the_budget(slept):
+    # what a run of 304s looks like: each is claimed, and each reports
+    # the count it was claimed against
+    limiter = ratelimit.RateLimiter(reserve=100)
+    reset_headers = headers(300, 600)
+    limiter.update(reset_headers)
+    for _ in range(200):
+        with limiter.claim():
+            limiter.update(reset_headers)
+
+    assert limiter._state["remaining"] == 300
+    assert limiter._state["claims"] == 0
+
+
+def test_claims_count_until_released(slept):
+    limiter = ratelimit.RateLimiter(reserve=100)
+    limiter.update(headers(101, 600))
+
+    with limiter.claim():
+        with pytest.raises(ratelimit.RateLimitExceeded):
+            limiter.acquire(block=False)
+    limiter.acquire(block=False)
+
+
+def test_new_window_replaces_the_old_one(slept):
+    limiter = ratelimit.RateLimiter(reserve=100)
+    limiter.update(headers(0, 10))
+    limiter.update(headers(5000, 3600))
+
+    limiter.acquire(block=False)
+
+
+def test_limiter_is_shared_per_token():
+    assert ratelimit.limiter_for("a") is ratelimit.limiter_for("a")
+    assert ratelimit.limiter_for("a") is not ratelimit.limiter_for("b")
+
+
+def test_state_file_is_shared_across_limiters(tmp_path, slept):
+    path = str(tmp_path / "state.json")
+    one = ratelimit.RateLimiter(reserve=100, state_path=path)
+    other = ratelimit.RateLimiter(reserve=100, state_path=path)
+
+    one.update(headers(101, 600))
+    one.acquire()
+    with pytest.raises(ratelimit.RateLimitExceeded):
+        other.acquire(block=False)
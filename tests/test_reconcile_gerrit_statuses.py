@@ -0,0 +1,162 @@
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+from publishthing import PublishThing
+from publishthing.apps import reconcile_gerrit_statuses
+import pytest
+
+APPROVED = {"approved": {"username": "ci"}}
+
+
+def change(number: int, verified: Any, code_review: Any) -> Dict[str, Any]:
+    return {
+        "_number": number,
+        "project": "o/r",
+        "current_revision": "g%d" % number,
+        "revisions": {
+            "g%d"
+            % number: {
+                "commit": {
+                    "message": "fix\n\nPull-request: "
+                    "https://github.com/o/r/pull/%d\n"
+                    "Pull-request-sha: p%d\n" % (number, number)
+                }
+            }
+        },
+        "labels": {"Verified": verified, "Code-Review": code_review},
+    }
+
+
+class FakeGerritApi:
+    service_url = "https://gerrit.example.com"
+
+    def __init__(self, changes: List[Dict[str, Any]]) -> None:
+        self.changes = changes
+
+    def query_changes(
+        self, query: str, options: Any = ()
+    ) -> Iterator[Dict[str, Any]]:
+        assert "LABELS" in options
+        return iter(self.changes)
+
+
+class FakeRepo:
+    def __init__(self, statuses: Dict[str, List[Dict[str, str]]]) -> None:
+        self.statuses = statuses
+        self.created: List[Any] = []
+
+    def get_combined_status(self, sha: str) -> Dict[str, Any]:
+        return {"statuses": self.statuses.get(sha, [])}
+
+    def create_status(self, sha: str, **kw: Any) -> None:
+        self.created.append(
+            (sha, kw["context"], kw["state"], kw["target_url"])
+        )
+
+
+def make_thing(changes: List[Dict[str, Any]], repo: FakeRepo) -> PublishThing:
+    thing = PublishThing()
+    thing.gerrit_api = FakeGerritApi(changes)  # type: ignore
+    thing.github_repo = lambda name: repo  # type: ignore
+    thing.message = lambda *arg: None  # type: ignore
+    return thing
+
+
+def test_posts_only_differing_statuses() -> None:
+    repo = FakeRepo(
+        {
+            "p1": [
+                {
+                    "context": "ci_verification",
+                    "state": "success",
+                    "description": "Gerrit review has been verified",
+                },
+                {
+                    "context": "code_review",
+                    "state": "pending",
+                    "description": "Needs code review +2",
+                },
+            ]
+        }
+    )
+    thing = make_thing(
+        [change(1, APPROVED, APPROVED), change(2, {}, {"disliked": {}})],
+        repo,
+    )
+
+    assert reconcile_gerrit_statuses.reconcile(thing, "status:open") == 3
+    assert sorted(repo.created) == [
+        (
+            "p1",
+            "code_review",
+            "success",
+            "https://gerrit.example.com/c/o/r/+/1",
+        ),
+        (
+            "p2",
+            "ci_verification",
+            "pending",
+            "https://gerrit.example.com/c/o/r/+/2",
+        ),
+        (
+            "p2",
+            "code_review",
+            "failure",
+            "https://gerrit.example.com/c/o/r/+/2",
+        ),
+    ]
+
+
+def test_dry_run_and_unlinked_changes() -> None:
+    repo = FakeRepo({})
+    unlinked = change(3, APPROVED, APPROVED)
+    unlinked["revisions"]["g3"]["commit"]["message"] = "no pull request"
+    thing = make_thing([change(1, {}, {}), unlinked], repo)
+
+    assert (
+        reconcile_gerrit_statuses.reconcile(thing, "status:open", dry_run=True)
+        == 2
+    )
+    assert repo.created == []
+
+
+def test_failing_change_is_skipped() -> None:
+    repo = FakeRepo({})
+    broken = change(4, {}, {})
+    del broken["labels"]["Verified"]
+    warnings: List[Any] = []
+    thing = make_thing([broken, change(5, {}, {})], repo)
+    thing.warning = lambda *arg: warnings.append(arg)  # type: ignore
+
+    assert reconcile_gerrit_statuses.reconcile(thing, "status:open") == 2
+    assert [arg[1] for arg in warnings] == [4]
+
+
+GERRIT_ARGS = [
+    "--gerrit-api-url",
+    "https://gerrit.example.com",
+    "--gerrit-api-username",
+    "bot",
+    "--gerrit-api-password",
+    "pw",
+]
+
+
+def test_main_needs_github_credentials(monkeypatch: Any) -> None:
+    things: List[PublishThing] = []
+    monkeypatch.setattr(
+        reconcile_gerrit_statuses,
+        "reconcile",
+        lambda thing, query, **kw: things.append(thing) or 0,
+    )
+
+    with pytest.raises(SystemExit):
+        reconcile_gerrit_statuses.main(GERRIT_ARGS)
+    with pytest.raises(SystemExit):
+        reconcile_gerrit_statuses.main(GERRIT_ARGS + ["--github-app-id", "1"])
+    assert things == []
+
+    reconcile_gerrit_statuses.main(GERRIT_ARGS + ["--access-token", "tok"])
+    assert things[0].github_auth.token("o/r") == "tok"